@@ -1,27 +1,20 @@
-import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-from shapely.geometry import LineString, Point
 from sys import argv
 
-# Read csv files
-def read_csv_file(filename):
-    df = pd.read_csv(filename)
-    points = list(zip(df['x'], df['y'], df['z']))
-    return LineString(points)
-
-# Resample a linestring into n evenly spaced points
-def resample(linestring, n):
-    length = linestring.length
-    return [Point(linestring.interpolate(i * length / n)) for i in range(n)]
+from spline_traj_optm.models.track_ingestion import read_track_points
+from spline_traj_optm.models.race_track import RaceTrack
+from spline_traj_optm.models.trajectory import Trajectory
 
-# Compute the mid points between two sets of points
-def compute_mid_points(points1, points2):
-    mid_points = [(p1.x*0.5 + p2.x*0.5, p1.y*0.5 + p2.y*0.5, p1.z*0.5 + p2.z*0.5) for p1, p2 in zip(points1, points2)]
-    return mid_points
+# Read csv files chunk by chunk, thinned to 0.1 m
+def read_csv_file(filename):
+    points, stats = read_track_points(filename, min_dist=0.1)
+    print(f"{filename}: {stats}")
+    return points
 
 def plot_points(points, color, ax):
-    x,y,z = zip(*points)
+    x,y,z = points[:, 0], points[:, 1], points[:, 2]
     ax.set_aspect('equal', adjustable='box')
     ax.scatter(x, y, z, c=color, s=0.1)
 
@@ -35,29 +28,27 @@ def main():
     output_csv = argv[3]
 
     # Read polygons from csv files
-    line_outer = read_csv_file(outer_boundary_csv)
-    line_inner = read_csv_file(inner_boundary_csv)
-
-    # Compute the mid points
-    resampled_outer_points = resample(line_outer, 1000)  # Adjust number of points as needed
-    resampled_inner_points = resample(line_inner, 1000)  # Adjust number of points as needed
+    points_outer = read_csv_file(outer_boundary_csv)
+    points_inner = read_csv_file(inner_boundary_csv)
 
-    mid_points = compute_mid_points(resampled_outer_points, resampled_inner_points)
+    # Compute the center line at equal distance from both boundaries, every 0.5 m
+    race_track = RaceTrack("track", points_outer, points_inner)
+    center_line = race_track.center_line(0.5).sample_along(0.5)
+    mid_points = center_line[:, [Trajectory.X, Trajectory.Y, Trajectory.Z]]
 
     # Create a 3D plot
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
 
     # Plot outer, inner, and mid points
-    plot_points([(point.x, point.y, point.z) for point in resampled_outer_points], 'red', ax)
-    plot_points([(point.x, point.y, point.z) for point in resampled_inner_points], 'blue', ax)
+    plot_points(points_outer, 'red', ax)
+    plot_points(points_inner, 'blue', ax)
     plot_points(mid_points, 'green', ax)
     ax.legend(['Outer', 'Inner', 'Mid'])
     plt.show()
 
     # Save the mid points to a csv file
-    df = pd.DataFrame(mid_points, columns=['x', 'y', 'z'])
-    df.to_csv(output_csv, index=False)
+    np.savetxt(output_csv, mid_points, delimiter=',', header='x,y,z', comments='')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,183 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict
+
+# the profiler the instrumented code reports to, see `profiler` and `Profiler.activate`
+_active = None
+
+
+@dataclass
+class PhaseStats:
+    count: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+
+@dataclass
+class Failure:
+    phase: str
+    reason: str
+    time: float
+
+
+@dataclass
+class Progress:
+    time: float
+    fields: dict = field(default_factory=dict)
+
+
+class Profiler:
+    def __init__(self, jsonl_path=None) -> None:
+        """Records per-phase timings, call counts, failure reasons and the progress of the iterations
+        of an optimization run.
+
+        The instrumented code reports to the active profiler, see `profiler`. Nothing is recorded
+        while no profiler is active, which only costs a function call and an empty context per phase.
+        Worker processes have no active profiler, so the parallel sweeps only report their merges.
+
+        Args:
+            jsonl_path (str, optional): If given, write every failure and progress record as a JSON
+                line to this file while running, and the summary as the last line when deactivated.
+                Defaults to None.
+        """
+        self.jsonl_path = jsonl_path
+        self._file = None
+        self._previous = None
+        self._start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.failures = []
+        self.progress_records = []
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, *exc):
+        self.deactivate()
+        return False
+
+    def activate(self):
+        """Makes the instrumented code report to this profiler, until `deactivate`."""
+        global _active
+        if self.jsonl_path is not None and self._file is None:
+            self._file = open(self.jsonl_path, "a")
+        self._previous = _active
+        _active = self
+
+    def deactivate(self):
+        """Restores the previously active profiler, and closes the JSONL file with the summary."""
+        global _active
+        _active = self._previous
+        self._previous = None
+        if self._file is not None:
+            self.__write(dict(type="summary", **self.to_dict()))
+            self._file.close()
+            self._file = None
+
+    def __elapsed(self):
+        return time.perf_counter() - self._start
+
+    def __write(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Times a block of code as one call of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, duration: float):
+        """Adds one call of a phase, timed elsewhere."""
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats()
+        stats.count += 1
+        stats.total_time += duration
+        stats.max_time = max(stats.max_time, duration)
+
+    def count(self, name: str, n=1):
+        """Increments a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def failure(self, phase: str, reason):
+        """Records why a phase failed.
+
+        Args:
+            phase (str): The phase.
+            reason (str or Exception): The reason, of which only the last line of an exception message is kept.
+        """
+        if isinstance(reason, BaseException):
+            lines = str(reason).strip().splitlines()
+            reason = f"{type(reason).__name__}: {lines[-1].strip() if lines else ''}"
+        record = Failure(phase, str(reason), self.__elapsed())
+        self.failures.append(record)
+        self.count(f"{phase}_failed")
+        self.__write(dict(type="failure", **asdict(record)))
+
+    def progress(self, **fields):
+        """Records the progress of an iteration, like its lap time. The fields are kept apart from
+        the time of the record, so they can have any name."""
+        record = Progress(self.__elapsed(), fields)
+        self.progress_records.append(record)
+        self.__write(dict(type="progress", **asdict(record)))
+
+    def to_dict(self):
+        return {
+            "elapsed": self.__elapsed(),
+            "phases": {name: asdict(stats) for name, stats in self.phases.items()},
+            "counters": dict(self.counters),
+            "failures": [asdict(f) for f in self.failures],
+            "progress": [asdict(p) for p in self.progress_records],
+        }
+
+    def __str__(self):
+        lines = [f"Profile of {self.__elapsed():.3f} s:"]
+        for name, stats in sorted(self.phases.items(), key=lambda item: -item[1].total_time):
+            lines.append(f"  {name}: {stats.count} calls, {stats.total_time:.3f} s total, {stats.max_time * 1e3:.3f} ms max")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f"  {name}: {n}")
+        reasons = {}
+        for f in self.failures:
+            reasons[(f.phase, f.reason)] = reasons.get((f.phase, f.reason), 0) + 1
+        for (phase, reason), n in sorted(reasons.items(), key=lambda item: -item[1]):
+            lines.append(f"  {phase} failed {n} times: {reason}")
+        return "\n".join(lines)
+
+
+class _DisabledProfiler:
+    """Stands in for the profiler while none is active, ignoring everything."""
+    _phase = nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def add_time(self, name, duration):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def failure(self, phase, reason):
+        pass
+
+    def progress(self, **fields):
+        pass
+
+
+_disabled = _DisabledProfiler()
+
+
+def profiler():
+    """The active `Profiler`, or a stand-in that ignores everything if none is active."""
+    return _disabled if _active is None else _active
+
+
+def is_enabled():
+    return _active is not None
@@ -1,14 +1,34 @@
+import os
+import hashlib
+import time
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
 import casadi as ca
 
 from spline_traj_optm.models.trajectory import Trajectory
 import spline_traj_optm.models.dynamic_bicycle as dyn
+from spline_traj_optm.instrumentation.profiler import profiler
+
+# window solver of a worker process in the parallel receding horizon sweeps
+_worker_window_solver = None
+
+
+def _init_window_worker(params, size):
+    global _worker_window_solver
+    _worker_window_solver = set_up_window_problem(params, size)
+
+
+def _solve_windows(args):
+    return [solve_window(_worker_window_solver, a) for a in args]
 
 
 def global_to_frenet(p, p0, yaw):
     cos_theta = ca.cos(-yaw)
     sin_theta = ca.sin(-yaw)
-    R = ca.DM(ca.vertcat(ca.horzcat(cos_theta, -sin_theta),
-                         ca.horzcat(sin_theta, cos_theta)))
+    R = ca.vertcat(ca.horzcat(cos_theta, -sin_theta),
+                   ca.horzcat(sin_theta, cos_theta))
     return R @ (p - p0)
 
 
@@ -23,8 +43,7 @@ def align_yaw(yaw1, yaw2):
 
 
 def hermite_simpson(model, dynamics, x1, x2, u, dt):
-    temp = ca.MX(x2)
-    temp[0, 2] = align_yaw(temp[0, 2], x1[0, 2])
+    temp = ca.horzcat(x2[0, 0:2], align_yaw(x2[0, 2], x1[0, 2]), x2[0, 3:])
     f1 = dynamics(model, x1, u).T
     f2 = dynamics(model, temp, u).T
     xm = 0.5 * (x1 + temp) + (dt / 8.0) * (f1 - f2)
@@ -32,7 +51,58 @@ def hermite_simpson(model, dynamics, x1, x2, u, dt):
     return x1 + (dt / 6.0) * (f1 + 4 * fm + f2) - temp
 
 
-def set_up_problem(params):
+# linear solver of IPOPT, the HSL and SPRAL solvers need their libraries next to IPOPT
+LINEAR_SOLVER = "mumps"
+# compiler command of the generated NLP functions, the source and the library are appended
+CODEGEN_COMPILER = ["gcc", "-fPIC", "-shared", "-O1"]
+# IPOPT options of a warm start, which keep the given point and multipliers away from the bounds
+# only as much as necessary
+WARM_START_OPTS = {
+    "warm_start_init_point": "yes",
+    "warm_start_bound_push": 1e-6,
+    "warm_start_bound_frac": 1e-6,
+    "warm_start_slack_bound_push": 1e-6,
+    "warm_start_slack_bound_frac": 1e-6,
+    "warm_start_mult_bound_push": 1e-6,
+    "mu_init": 1e-5,
+}
+
+
+def ipopt_options(params, warm_start=False):
+    """IPOPT options of the problem parameters.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        warm_start (bool, optional): Add `WARM_START_OPTS`. Defaults to False.
+
+    Returns:
+        dict: The options.
+    """
+    opts = {"max_iter": params["max_iter"], "tol": params["tol"], "constr_viol_tol": params["constr_viol_tol"],
+            "print_level": 5 if params["verbose"] else 0,
+            "linear_solver": params.get("linear_solver", LINEAR_SOLVER)}
+    opts.update(params.get("linear_solver_opts", {}))
+    if warm_start:
+        opts.update(WARM_START_OPTS)
+    return opts
+
+
+def set_up_problem(params, report=False):
+    """Sets up the min time problem of a closed track as an `Opti` problem.
+
+    Args:
+        params (dict): Problem parameters. The reference path "traj_d" of "N" waypoints with the
+            boundaries filled, the model values "model", the "dynamics", the state and control
+            bounds "x_l", "x_u", "u_l" and "u_u" of the model, "nx" and "nu", and the IPOPT
+            options "max_iter", "tol", "constr_viol_tol" and "verbose". The optional "linear_solver"
+            chooses the linear solver of IPOPT, `LINEAR_SOLVER` by default, and the optional
+            "linear_solver_opts" adds IPOPT options like its ordering and scaling, e.g.
+            {"mumps_pivot_order": 5, "mumps_scaling": 77, "nlp_scaling_method": "none"}.
+        report (bool, optional): Also return the `ProblemStructure` of the problem. Defaults to False.
+
+    Returns:
+        tuple: (X, U, T, opti), with the `ProblemStructure` last if `report`.
+    """
     N = params["N"]
     traj_d = params["traj_d"]
     nu = params["nu"]
@@ -95,10 +165,746 @@ def set_up_problem(params):
         opti.subject_to(U[i, :] <= u_u)
         opti.subject_to(0.0 <= T[i])
 
-    print_lvl = 5 if params["verbose"] else 0
-    p_opts = {"expand": True}
-    s_opts = {"max_iter": params["max_iter"], "tol": params["tol"],
-              "constr_viol_tol": params["constr_viol_tol"], "print_level": print_lvl}
+    p_opts = {"expand": True, "record_time": True}
+    s_opts = ipopt_options(params)
     opti.solver('ipopt', p_opts, s_opts)
 
+    if report:
+        # the variables are X, U and T, each stacked column by column
+        waypoints = np.tile(np.arange(N), nx + nu + 1)
+        return X, U, T, opti, problem_structure(opti.x, opti.g, opti.f, waypoints)
     return X, U, T, opti
+
+
+@dataclass
+class ProblemStructure:
+    num_variables: int
+    num_constraints: int
+    jac_g_nnz: int
+    hess_l_nnz: int
+    hess_l_bandwidth: int
+    waypoint_bandwidth: int
+    jac_g_wrap_nnz: int
+    hess_l_wrap_nnz: int
+
+    def __str__(self):
+        return str(
+            f"{self.num_variables} variables, {self.num_constraints} constraints, "
+            f"Jacobian nnz: {self.jac_g_nnz} ({self.jac_g_wrap_nnz} across the wrap), "
+            f"Hessian nnz: {self.hess_l_nnz} ({self.hess_l_wrap_nnz} across the wrap), "
+            f"Hessian bandwidth: {self.hess_l_bandwidth}, waypoint bandwidth: {self.waypoint_bandwidth}"
+        )
+
+
+def problem_structure(x, g, f, waypoints):
+    """Sparsity structure of the matrices IPOPT factorizes, from the symbolic NLP.
+
+    The constraints are assumed to be stacked waypoint by waypoint, the same number for every
+    waypoint. The entries that couple waypoints more than half the lap apart only come from the
+    periodic wrap, like `X[i-1]` at i = 0, and are counted separately from the band.
+
+    Args:
+        x (casadi.MX or casadi.SX): Variables.
+        g (casadi.MX or casadi.SX): Constraints.
+        f (casadi.MX or casadi.SX): Objective.
+        waypoints (np.ndarray): Waypoint of every variable.
+
+    Returns:
+        ProblemStructure: The number of variables and constraints, the nonzeros of the constraint
+            Jacobian and of the lower triangle of the Lagrangian Hessian, the bandwidth of the
+            Hessian in the variable order, the largest distance in waypoints between the variables
+            coupled by the band, and the nonzeros across the wrap.
+    """
+    N = np.max(waypoints) + 1
+    assert g.numel() % N == 0, "every waypoint should have the same constraints"
+    lam = type(x).sym("lam", g.numel())
+    lagrangian = ca.Function("lagrangian", [x, lam], [f + ca.dot(lam, g), g])
+    if isinstance(x, ca.MX):
+        lagrangian = lagrangian.expand()
+    sx = ca.SX.sym("x", x.numel())
+    slam = ca.SX.sym("lam", lam.numel())
+    L, G = lagrangian(sx, slam)
+    jac_rows, jac_cols = ca.jacobian(G, sx).sparsity().get_triplet()
+    hess_rows, hess_cols = ca.tril(ca.hessian(L, sx)[0]).sparsity().get_triplet()
+
+    jac_dist = np.abs(np.asarray(jac_rows) // (g.numel() // N) - waypoints[jac_cols])
+    hess_dist = np.abs(waypoints[hess_rows] - waypoints[hess_cols])
+    jac_wrap = jac_dist > N // 2
+    hess_wrap = hess_dist > N // 2
+    return ProblemStructure(x.numel(), g.numel(), len(jac_rows), len(hess_rows),
+                            int(np.max(np.abs(np.subtract(hess_rows, hess_cols)), initial=0)),
+                            int(max(np.max(jac_dist[~jac_wrap], initial=0), np.max(hess_dist[~hess_wrap], initial=0))),
+                            int(np.sum(jac_wrap)), int(np.sum(hess_wrap)))
+
+
+def solver_time_breakdown(stats):
+    """Splits the wall time of a solve into the evaluations of the NLP functions and IPOPT itself,
+    which is mostly the factorizations of the linear solver.
+
+    Args:
+        stats (dict): Solver stats, of a solver built with the option "record_time".
+
+    Returns:
+        dict: Wall times in seconds, of "total", "ipopt" and the NLP functions.
+    """
+    evals = {key[len("t_wall_"):]: stats[key] for key in
+             ("t_wall_nlp_f", "t_wall_nlp_g", "t_wall_nlp_grad_f", "t_wall_nlp_jac_g", "t_wall_nlp_hess_l")}
+    return dict(total=stats["t_wall_total"], ipopt=stats["t_wall_total"] - sum(evals.values()), **evals)
+
+
+def model_keys(model):
+    """Order of the model values in the model parameter vector."""
+    return sorted(model.keys())
+
+
+def interval_constraints(params):
+    """The constraints of a single waypoint as a function, to be mapped over the track.
+
+    The model values are an input, so one function serves all the models of the same keys.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+
+    Returns:
+        casadi.Function: (x_prev, x, u_prev, u, t, p0, yaw, m) -> g, with the states and controls as
+            columns, the reference point p0, its yaw and the model values m in `model_keys` order.
+            g stacks the Hermite-Simpson defect (nx), the longitudinal and lateral Frenet offsets
+            and the squared acceleration.
+    """
+    nx = params["nx"]
+    nu = params["nu"]
+    keys = model_keys(params["model"])
+    dynamics = params["dynamics"]
+    m = ca.SX.sym("m", len(keys))
+    model = {key: m[i] for i, key in enumerate(keys)}
+
+    x_prev = ca.SX.sym("x_prev", nx)
+    x = ca.SX.sym("x", nx)
+    u_prev = ca.SX.sym("u_prev", nu)
+    u = ca.SX.sym("u", nu)
+    t = ca.SX.sym("t")
+    p0 = ca.SX.sym("p0", 2)
+    yaw = ca.SX.sym("yaw")
+
+    defect = hermite_simpson(model, dynamics, x_prev.T, x.T, u_prev.T, t).T
+    pf = global_to_frenet(x[0:2], p0, yaw)
+    lat_acc = dyn.lat_acc(model, x, u)
+    lon_acc = dyn.lon_acc(model, x, u)
+    acc = ca.power(lat_acc, 2) + ca.power(lon_acc, 2)
+    g = ca.vertcat(defect, pf, acc)
+    return ca.Function("interval_constraints", [x_prev, x, u_prev, u, t, p0, yaw, m], [g],
+                       ["x_prev", "x", "u_prev", "u", "t", "p0", "yaw", "m"], ["g"])
+
+
+def compile_nlp(nlp, key, codegen_dir, expand=False):
+    """Generates C code of the functions IPOPT calls (objective, constraints, their derivatives
+    and the Hessian of the Lagrangian) and compiles it into a shared library, unless the library
+    of this key is already in the directory.
+
+    Args:
+        nlp (dict): The NLP, with "x", "p", "f" and "g".
+        key (str): Name of the library, identifying the structure of the NLP.
+        codegen_dir (str): Directory of the libraries. The generated code is removed once compiled.
+        expand (bool, optional): Expand the NLP into SX before generating. Defaults to False.
+
+    Returns:
+        str: Path of the shared library, to be loaded with `nlpsol`.
+    """
+    name = f"min_time_nlp_{key}"
+    lib = os.path.join(codegen_dir, name + ".so")
+    if os.path.exists(lib):
+        return lib
+    os.makedirs(codegen_dir, exist_ok=True)
+    solver = ca.nlpsol("solver", "ipopt", nlp, {"expand": expand})
+    # generate and compile under names of this process, so processes building the same key
+    # at once never compile a partial source or load a partial library
+    gen = ca.CodeGenerator(f"{name}_{os.getpid()}.c")
+    gen.add(solver.oracle())
+    for f in solver.get_function():
+        gen.add(solver.get_function(f))
+    src = gen.generate(os.path.join(codegen_dir, ""))
+    tmp = f"{lib}.{os.getpid()}.tmp"
+    try:
+        subprocess.run(CODEGEN_COMPILER + [src, "-o", tmp], check=True)
+        os.replace(tmp, lib)
+    finally:
+        for path in (src, tmp):
+            if os.path.exists(path):
+                os.remove(path)
+    return lib
+
+
+def set_up_batched_problem(params, warm_start=False):
+    """Same problem as `set_up_problem`, with the constraints of one waypoint built once as a
+    function and mapped over the track, and all the bounds passed to `nlpsol` as flat vectors.
+
+    The decision variables are the columns [x_i; u_i; t_i] of the waypoints, stacked in order,
+    so the constraint Jacobian stays banded.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`. The optional "expand" expands
+            the problem into SX before solving, which takes longer to build but iterates faster.
+            The optional "codegen_dir" compiles the problem into a shared library in this directory,
+            see `compile_nlp`. The reference path and the model values are parameters of the NLP,
+            so the library is reused by all the problems with the same N, model keys and dynamics.
+        warm_start (bool, optional): Make IPOPT start from the given primal and dual variables,
+            see `WARM_START_OPTS`. Defaults to False.
+
+    Returns:
+        tuple: (solver, args). The IPOPT solver and its arguments x0, p, lbx, ubx, lbg and ubg,
+            see `batched_problem_arguments`. `unpack_solution` splits the optimal variables into X, U and T.
+    """
+    N = params["N"]
+    nu = params["nu"]
+    nx = params["nx"]
+    nw = nx + nu + 1
+
+    W = ca.MX.sym("w", nw, N)
+    X = W[0:nx, :]
+    U = W[nx:nx+nu, :]
+    T = W[nx+nu, :]
+
+    # parameters: the model values, then the reference points and their yaws
+    nm = len(model_keys(params["model"]))
+    p = ca.MX.sym("p", nm + 3 * N)
+    M = p[0:nm]
+    P0 = ca.reshape(p[nm:nm+2*N], 2, N)
+    Yaws = p[nm+2*N:].T
+
+    # every waypoint is connected to the previous one, around the closed track
+    X_prev = ca.horzcat(X[:, N-1], X[:, 0:N-1])
+    U_prev = ca.horzcat(U[:, N-1], U[:, 0:N-1])
+    constraints = interval_constraints(params)
+    G = constraints.map(N)(X_prev, X, U_prev, U, T, P0, Yaws, M)
+    nlp = {"x": ca.vec(W), "p": p, "f": min_time_cost(T.T), "g": ca.vec(G)}
+
+    opts = {"ipopt": ipopt_options(params, warm_start), "record_time": True}
+    if not params["verbose"]:
+        opts["print_time"] = False
+    # the mapped constraints build much faster without expanding them into one SX graph
+    expand = params.get("expand", False)
+    if params.get("codegen_dir") is not None:
+        # the single waypoint function captures the model keys and the dynamics
+        key = hashlib.sha1(f"{N}:{expand}:".encode() + constraints.serialize().encode()).hexdigest()[:16]
+        lib = compile_nlp(nlp, key, params["codegen_dir"], expand)
+        solver = ca.nlpsol("solver", "ipopt", lib, opts)
+    else:
+        solver = ca.nlpsol("solver", "ipopt", nlp, dict(opts, expand=expand))
+
+    return solver, batched_problem_arguments(params)
+
+
+def batched_problem_arguments(params):
+    """Solver arguments of `set_up_batched_problem` for a reference path and a model, which can
+    change between solves as long as N and the model keys stay the same.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+
+    Returns:
+        dict: x0 (the reference path at 1 m/s), p, lbx, ubx, lbg and ubg.
+    """
+    N = params["N"]
+    traj_d = params["traj_d"]
+    nu = params["nu"]
+    nx = params["nx"]
+    model = params["model"]
+    nw = nx + nu + 1
+
+    P0 = traj_d[:, Trajectory.X:Trajectory.Y+1]
+    Yaws = traj_d[:, Trajectory.YAW]
+    BoundL = traj_d[:, Trajectory.LEFT_BOUND_X:Trajectory.LEFT_BOUND_Y+1]
+    BoundR = traj_d[:, Trajectory.RIGHT_BOUND_X:Trajectory.RIGHT_BOUND_Y+1]
+
+    # constraint bounds, per waypoint in the order of `interval_constraints`
+    ng = nx + 3
+    lbg = np.zeros((ng, N))
+    ubg = np.zeros((ng, N))
+    lbg[nx+1, :] = -np.linalg.norm(BoundR - P0, axis=1)
+    ubg[nx+1, :] = np.linalg.norm(BoundL - P0, axis=1)
+    lbg[nx+2, :] = -np.inf
+    ubg[nx+2, :] = model["acc_max"] ** 2
+
+    # primal bounds
+    lbx = np.zeros((nw, N))
+    ubx = np.zeros((nw, N))
+    lbx[0:nx, :] = np.array(params["x_l"](model)).reshape((-1, 1))
+    ubx[0:nx, :] = np.array(params["x_u"](model)).reshape((-1, 1))
+    lbx[nx:nx+nu, :] = np.array(params["u_l"](model)).reshape((-1, 1))
+    ubx[nx:nx+nu, :] = np.array(params["u_u"](model)).reshape((-1, 1))
+    lbx[nx+nu, :] = 0.0
+    ubx[nx+nu, :] = np.inf
+
+    # initial condition
+    x0 = np.zeros((nw, N))
+    x0[0:2, :] = P0.T
+    x0[2, :] = Yaws
+    x0[4, :] = 1.0
+    x0[nx+nu, :] = 1.0
+
+    p0 = np.concatenate([[model[key] for key in model_keys(model)], flat_variables(P0.T), Yaws])
+    return {"x0": flat_variables(x0), "p": p0, "lbx": flat_variables(lbx), "ubx": flat_variables(ubx),
+            "lbg": flat_variables(lbg), "ubg": flat_variables(ubg)}
+
+
+def flat_variables(a):
+    """Stacks the columns of the waypoints, the same as `ca.vec`."""
+    return np.asarray(a).reshape((-1,), order="F")
+
+
+def initial_guess(params, traj):
+    """Variables of `set_up_batched_problem` that follow a simulated trajectory, with the time
+    steps from its speed profile and the steering from its yaw rate.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        traj (Trajectory): N waypoints with speeds and lon accs, like a `Simulator` result.
+
+    Returns:
+        np.ndarray: The flat variables.
+    """
+    nx = params["nx"]
+    nu = params["nu"]
+    model = params["model"]
+    speed = np.maximum(traj[:, Trajectory.SPEED], 1e-3)
+
+    # the time step of a waypoint covers the segment from the previous one, T = ds / v
+    xy = traj[:, Trajectory.X:Trajectory.Y+1]
+    ds = np.hypot(*(xy - np.roll(xy, 1, axis=0)).T)
+    dt = ds / (0.5 * (speed + np.roll(speed, 1)))
+    dyaw = np.angle(np.exp(1j * (traj[:, Trajectory.YAW] - np.roll(traj[:, Trajectory.YAW], 1))))
+    delta = np.clip(np.arctan(model["L"] * dyaw / np.maximum(ds, 1e-6)), -model["delta_max"], model["delta_max"])
+
+    W = np.zeros((nx + nu + 1, len(traj)))
+    W[0:2, :] = xy.T
+    W[2, :] = traj[:, Trajectory.YAW]
+    W[3, :] = delta
+    W[4, :] = speed
+    W[nx, :] = traj[:, Trajectory.LON_ACC]
+    W[nx+1, :] = (np.roll(delta, -1) - delta) / np.roll(dt, -1)
+    W[nx+nu, :] = dt
+    return flat_variables(W)
+
+
+@dataclass
+class MinTimeSolution:
+    x: np.ndarray
+    u: np.ndarray
+    t: np.ndarray
+    w: np.ndarray
+    lam_x: np.ndarray
+    lam_g: np.ndarray
+    lap_time: float
+    iterations: int
+    success: bool
+
+
+class MinTimeProblem:
+    def __init__(self, params) -> None:
+        """Min time problem of one track discretization, solved repeatedly for different reference
+        paths and models without rebuilding, optionally warm started from a previous solution.
+
+        Args:
+            params (dict): Problem parameters, see `set_up_problem` and `set_up_batched_problem`.
+        """
+        self.params = dict(params)
+        self.args = batched_problem_arguments(self.params)
+        # built on their first solve, IPOPT's warm start options are fixed per solver
+        self.solver = None
+        self.warm_solver = None
+
+    def get_solver(self, warm_start=False):
+        """The solver of cold or warm starts, built on the first call."""
+        if warm_start:
+            if self.warm_solver is None:
+                self.warm_solver, _ = set_up_batched_problem(self.params, warm_start=True)
+            return self.warm_solver
+        if self.solver is None:
+            self.solver, _ = set_up_batched_problem(self.params)
+        return self.solver
+
+    def update(self, traj_d=None, model=None):
+        """Changes the reference path or the model values of the next solves.
+
+        Args:
+            traj_d (Trajectory, optional): Reference path with the boundaries filled, of the same length.
+            model (dict, optional): Model values, with the same keys.
+        """
+        if traj_d is not None:
+            assert len(traj_d) == self.params["N"], "the reference path should keep its length"
+            self.params["traj_d"] = traj_d
+        if model is not None:
+            assert model_keys(model) == model_keys(self.params["model"]), "the model should keep its keys"
+            self.params["model"] = model
+        self.args = batched_problem_arguments(self.params)
+
+    def solve(self, warm_start: MinTimeSolution = None, initial_guess: np.ndarray = None):
+        """Solves the problem.
+
+        Args:
+            warm_start (MinTimeSolution, optional): Previous solution, whose primal and dual variables
+                IPOPT starts from. Defaults to None.
+            initial_guess (np.ndarray, optional): Primal variables to start from, e.g. `initial_guess`
+                of a `Simulator` result. Ignored with a warm start. Defaults to None, the reference path at 1 m/s.
+
+        Returns:
+            MinTimeSolution: The solution, also when IPOPT did not converge.
+        """
+        args = dict(self.args)
+        solver = self.get_solver(warm_start is not None)
+        if warm_start is not None:
+            args.update(x0=warm_start.w, lam_x0=warm_start.lam_x, lam_g0=warm_start.lam_g)
+        elif initial_guess is not None:
+            args["x0"] = initial_guess
+        with profiler().phase("nlp_solve"):
+            r = solver(**args)
+        stats = solver.stats()
+        if not stats["success"]:
+            profiler().failure("nlp_solve", f"ipopt: {stats['return_status']}")
+        w = np.array(r["x"]).reshape((-1,))
+        x, u, t = unpack_solution(self.params, w)
+        return MinTimeSolution(x, u, t, w, np.array(r["lam_x"]).reshape((-1,)), np.array(r["lam_g"]).reshape((-1,)),
+                               float(np.sum(t)), stats["iter_count"], stats["success"])
+
+
+def unpack_solution(params, w):
+    """Splits the variables of `set_up_batched_problem` into the states, controls and time steps.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        w (casadi.DM or np.ndarray): The variables of the solver.
+
+    Returns:
+        tuple: (X, U, T). N * nx states, N * nu controls and N time steps.
+    """
+    nx = params["nx"]
+    nu = params["nu"]
+    W = np.array(w).reshape((nx + nu + 1, params["N"]), order="F")
+    return W[0:nx, :].T, W[nx:nx+nu, :].T, W[nx+nu, :]
+
+
+def interpolate_solution(params, solution, traj_from, traj_to):
+    """A solution interpolated along the arc length onto another sampling of the same reference
+    path, to warm start the problem of that sampling.
+
+    The multipliers of the Hermite-Simpson defects approximate the costates and are interpolated
+    as they are, while the multipliers of the bounds and the path constraints are integrated over
+    the segments, so they are scaled by the ratio of the sampling intervals.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        solution (MinTimeSolution): Solution on the waypoints of `traj_from`.
+        traj_from (Trajectory): Waypoints of the solution, sampled with `BSplineTrajectory.sample_along`.
+        traj_to (Trajectory): Waypoints to interpolate to, sampled from the same spline.
+
+    Returns:
+        MinTimeSolution: The interpolated solution, with the iterations and success of the original one.
+    """
+    nx = params["nx"]
+    nu = params["nu"]
+    nw = nx + nu + 1
+    length = traj_from[0, Trajectory.DIST_TO_SF_FWD]
+    s_from = traj_from[:, Trajectory.DIST_TO_SF_BWD]
+    s_to = traj_to[:, Trajectory.DIST_TO_SF_BWD]
+    ratio = len(traj_from) / len(traj_to)
+
+    def interp(values):
+        return np.interp(s_to, s_from, values, period=length)
+
+    def interp_rows(values):
+        values = values.reshape((-1, len(traj_from)), order="F")
+        return np.array([interp(row) for row in values])
+
+    W = interp_rows(solution.w)
+    # the yaw of the solution is continuous, not wrapped, so keep the yaw of the previous waypoint
+    # and interpolate the wrapped difference to the next one
+    i = np.searchsorted(s_from, s_to, side="right") - 1
+    s_next = np.append(s_from[1:], length)[i]
+    yaw = solution.x[:, 2]
+    dyaw = np.angle(np.exp(1j * (np.roll(yaw, -1) - yaw)))
+    W[2, :] = yaw[i] + dyaw[i] * (s_to - s_from[i]) / (s_next - s_from[i])
+    # the time step of a waypoint covers the segment from the previous one, so interpolate the
+    # time since the first waypoint and take its differences
+    elapsed = np.cumsum(solution.t) - solution.t[0]
+    elapsed = np.interp(s_to, np.append(s_from, length), np.append(elapsed, solution.lap_time))
+    W[nw-1, :] = np.diff(elapsed, prepend=elapsed[-1] - solution.lap_time)
+
+    lam_x = interp_rows(solution.lam_x) * ratio
+    lam_g = interp_rows(solution.lam_g)
+    lam_g[nx:, :] *= ratio
+
+    w = flat_variables(W)
+    x, u, t = unpack_solution(dict(params, N=len(traj_to)), w)
+    return MinTimeSolution(x, u, t, w, flat_variables(lam_x), flat_variables(lam_g), float(np.sum(t)),
+                           solution.iterations, solution.success)
+
+
+@dataclass
+class MinTimeLevel:
+    interval: float
+    N: int
+    iterations: int
+    build_time: float
+    solve_time: float
+    lap_time: float
+    success: bool
+
+
+def solve_coarse_to_fine(params, traj_spline, race_track, intervals):
+    """Solves the min time problem on successively finer samplings of a reference path, each
+    level starting from the solution of the previous one interpolated onto its waypoints.
+
+    The coarse levels are cheap and converge in few iterations, and the finer levels start close
+    to their optimum, so the fine solution takes much less time than solving it directly.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem` and `set_up_batched_problem`.
+            "N" and "traj_d" are replaced at every level.
+        traj_spline (BSplineTrajectory): The reference path.
+        race_track (RaceTrack): The track, whose boundaries are filled into every level's waypoints.
+        intervals (list): Sampling intervals in meter, from the coarsest to the target resolution.
+
+    Returns:
+        tuple: (solution, params, levels). The MinTimeSolution of the last level, its problem
+            parameters and the MinTimeLevel stats of all levels.
+    """
+    levels = []
+    solution = None
+    traj_prev = None
+    for interval in intervals:
+        traj_d = traj_spline.sample_along(interval)
+        race_track.fill_trajectory_boundaries(traj_d)
+        level_params = dict(params, N=len(traj_d), traj_d=traj_d)
+
+        start = time.perf_counter()
+        problem = MinTimeProblem(level_params)
+        problem.get_solver(warm_start=solution is not None)
+        build_time = time.perf_counter() - start
+
+        if solution is not None:
+            solution = interpolate_solution(level_params, solution, traj_prev, traj_d)
+        start = time.perf_counter()
+        solution = problem.solve(warm_start=solution)
+        solve_time = time.perf_counter() - start
+
+        levels.append(MinTimeLevel(interval, len(traj_d), solution.iterations, build_time, solve_time,
+                                   solution.lap_time, solution.success))
+        profiler().progress(optimizer="min_time_coarse_to_fine", interval=interval, iterations=solution.iterations,
+                            lap_time=solution.lap_time)
+        traj_prev = traj_d
+    return solution, level_params, levels
+
+
+def set_up_window_problem(params, size, warm_start=False):
+    """The problem of `set_up_batched_problem` on a horizon of consecutive waypoints, with the
+    waypoints before and after the horizon fixed.
+
+    The horizon starts from the fixed state and control of the waypoint before it, and ends at
+    the fixed state of the waypoint after it, whose time step is the last variable. The reference
+    path, the model values and the fixed waypoints are parameters, so one solver serves all the
+    horizons of the same size around the track.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        size (int): Number of waypoints of the horizon.
+        warm_start (bool, optional): See `set_up_batched_problem`. Defaults to False.
+
+    Returns:
+        casadi.Function: The IPOPT solver, see `window_arguments` for its arguments.
+    """
+    nu = params["nu"]
+    nx = params["nx"]
+    nw = nx + nu + 1
+
+    W = ca.MX.sym("w", nw, size)
+    t_after = ca.MX.sym("t_after")
+    X = W[0:nx, :]
+    U = W[nx:nx+nu, :]
+    T = W[nx+nu, :]
+
+    # parameters: the model values, the fixed waypoints, then the reference points and their yaws
+    nm = len(model_keys(params["model"]))
+    p = ca.MX.sym("p", nm + 2 * nx + nu + 3 * size)
+    M = p[0:nm]
+    x_before = p[nm:nm+nx]
+    u_before = p[nm+nx:nm+nx+nu]
+    x_after = p[nm+nx+nu:nm+2*nx+nu]
+    P0 = ca.reshape(p[nm+2*nx+nu:nm+2*nx+nu+2*size], 2, size)
+    Yaws = p[nm+2*nx+nu+2*size:].T
+
+    X_prev = ca.horzcat(x_before, X[:, 0:size-1])
+    U_prev = ca.horzcat(u_before, U[:, 0:size-1])
+    constraints = interval_constraints(params)
+    G = constraints.map(size)(X_prev, X, U_prev, U, T, P0, Yaws, M)
+    # only the dynamics connect the horizon to the fixed waypoint after it
+    G_after = constraints(X[:, size-1], x_after, U[:, size-1], U[:, size-1], t_after, x_after[0:2], 0.0, M)[0:nx]
+    nlp = {"x": ca.vertcat(ca.vec(W), t_after), "p": p, "f": min_time_cost(T.T) + t_after,
+           "g": ca.vertcat(ca.vec(G), G_after)}
+
+    opts = {"ipopt": dict(ipopt_options(params, warm_start), print_level=0), "print_time": False, "record_time": True}
+    solver = ca.nlpsol("window_solver", "ipopt", nlp, dict(opts, expand=params.get("expand", False)))
+
+    return solver
+
+
+def window_arguments(params, args, state, start, size):
+    """Solver arguments of the horizon of `set_up_window_problem` from a waypoint.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        args (dict): Solver arguments of the whole lap, see `batched_problem_arguments`.
+        state (np.ndarray): nw * N variables of the whole lap, whose waypoints around the horizon
+            are fixed and whose waypoints in the horizon are the initial guess.
+        start (int): First waypoint of the horizon, which wraps around the closed track.
+        size (int): Number of waypoints of the horizon.
+
+    Returns:
+        dict: x0, p, lbx, ubx, lbg and ubg.
+    """
+    nx = params["nx"]
+    nu = params["nu"]
+    nw = nx + nu + 1
+    nm = len(model_keys(params["model"]))
+    N = state.shape[1]
+    idx = (start + np.arange(size)) % N
+    before = (start - 1) % N
+    after = (start + size) % N
+
+    def columns(v, rows):
+        return v.reshape((rows, N), order="F")[:, idx]
+
+    P0 = columns(args["p"][nm:nm+2*N], 2)
+    Yaws = args["p"][nm+2*N:][idx]
+    return {
+        "x0": np.append(flat_variables(state[:, idx]), state[nw-1, after]),
+        "p": np.concatenate([args["p"][0:nm], state[0:nx, before], state[nx:nx+nu, before], state[0:nx, after],
+                             flat_variables(P0), Yaws]),
+        "lbx": np.append(flat_variables(columns(args["lbx"], nw)), 0.0),
+        "ubx": np.append(flat_variables(columns(args["ubx"], nw)), np.inf),
+        "lbg": np.append(flat_variables(columns(args["lbg"], nx + 3)), np.zeros(nx)),
+        "ubg": np.append(flat_variables(columns(args["ubg"], nx + 3)), np.zeros(nx)),
+    }
+
+
+def solve_window(solver, args):
+    """Solves a horizon of `set_up_window_problem`.
+
+    Returns:
+        tuple: (w, success, iterations). The optimal variables, with the time step of the waypoint
+            after the horizon last.
+    """
+    r = solver(**args)
+    stats = solver.stats()
+    return np.array(r["x"]).reshape((-1,)), stats["success"], stats["iter_count"]
+
+
+def color_windows(N, size, stride):
+    """Colors the horizons from every `stride` waypoints so that the ones of a color are apart by
+    at least one waypoint around the closed track, and none of them is fixed in another one.
+
+    Args:
+        N (int): Number of waypoints of the track.
+        size (int): Number of waypoints of a horizon.
+        stride (int): Waypoints between the starts of consecutive horizons.
+
+    Returns:
+        list: Arrays of the first waypoints of the horizons of every color.
+    """
+    starts = np.arange(0, N, stride)
+    num = len(starts)
+    num_colors = min(-(-(size + 1) // stride), num)
+    pos = np.arange(num)
+    colors = pos % num_colors
+    # the horizons after the last full round would be too close to the first ones
+    tail = pos >= num - num % num_colors
+    colors[tail] = num_colors + pos[tail] % num_colors
+    return [starts[colors == c] for c in np.unique(colors)]
+
+
+@dataclass
+class MinTimeSweep:
+    lap_time: float
+    iterations: int
+    solve_time: float
+    num_success: int
+    num_windows: int
+
+
+def solve_receding_horizon(params, size, overlap, max_sweeps=10, tol=1e-3, initial_guess=None, num_workers=None):
+    """Solves the min time problem as overlapping horizons of `size` waypoints, swept around the
+    lap until the lap time converges.
+
+    Every horizon is solved with the waypoints around it fixed to the current lap, see
+    `set_up_window_problem`, so the problem size, and the memory and time of the factorizations,
+    stay bounded by the horizon size regardless of the track length. A horizon that fails to
+    converge keeps the current lap.
+
+    Args:
+        params (dict): Problem parameters, see `set_up_problem`.
+        size (int): Number of waypoints of a horizon.
+        overlap (int): Waypoints shared by consecutive horizons, less than `size`.
+        max_sweeps (int, optional): Maximum number of sweeps around the lap. Defaults to 10.
+        tol (float, optional): Relative change of the lap time of a sweep to stop at. Defaults to 1e-3.
+        initial_guess (np.ndarray, optional): Flat variables of the whole lap to start from, e.g.
+            `initial_guess` of a `Simulator` result. Defaults to the reference path at 1 m/s.
+        num_workers (int, optional): If given, solve the horizons that do not touch each other in
+            this many processes. Defaults to None, solving them one after the other.
+
+    Returns:
+        tuple: (solution, sweeps). The MinTimeSolution of the lap, without multipliers, and the
+            MinTimeSweep stats of every sweep.
+    """
+    N = params["N"]
+    nx = params["nx"]
+    nu = params["nu"]
+    nw = nx + nu + 1
+    assert 0 <= overlap < size < N, "the horizons should overlap less than their size, and be shorter than the lap"
+    args = batched_problem_arguments(params)
+    state = np.array(args["x0"] if initial_guess is None else initial_guess).reshape((nw, N), order="F")
+    colors = color_windows(N, size, size - overlap)
+
+    def sweep(solve):
+        iterations = 0
+        num_success = 0
+        for color in colors:
+            results = solve([window_arguments(params, args, state, start, size) for start in color])
+            # merge after the whole color, independently of the solving order
+            for start, (w, success, iter_count) in zip(color, results):
+                iterations += iter_count
+                if success:
+                    idx = (start + np.arange(size)) % N
+                    state[:, idx] = w[:-1].reshape((nw, size), order="F")
+                    state[nw-1, (start + size) % N] = w[-1]
+                    num_success += 1
+        return iterations, num_success
+
+    def run(solve):
+        sweeps = []
+        lap_time = np.sum(state[nw-1, :])
+        for _ in range(max_sweeps):
+            start = time.perf_counter()
+            iterations, num_success = sweep(solve)
+            prev_lap_time, lap_time = lap_time, np.sum(state[nw-1, :])
+            sweeps.append(MinTimeSweep(float(lap_time), iterations, time.perf_counter() - start,
+                                       num_success, sum(len(c) for c in colors)))
+            profiler().progress(optimizer="min_time_receding_horizon", iteration=len(sweeps), iterations=iterations,
+                                lap_time=float(lap_time))
+            if abs(prev_lap_time - lap_time) < tol * lap_time:
+                break
+        return sweeps
+
+    if num_workers is None:
+        solver = set_up_window_problem(params, size)
+        sweeps = run(lambda window_args: [solve_window(solver, a) for a in window_args])
+    else:
+        with ProcessPoolExecutor(num_workers, initializer=_init_window_worker, initargs=(params, size)) as executor:
+            def solve(window_args):
+                chunks = [c for c in np.array_split(np.arange(len(window_args)), num_workers) if len(c) > 0]
+                results = executor.map(_solve_windows, [[window_args[i] for i in chunk] for chunk in chunks])
+                return [r for chunk_results in results for r in chunk_results]
+            sweeps = run(solve)
+
+    w = flat_variables(state)
+    x, u, t = unpack_solution(params, w)
+    return MinTimeSolution(x, u, t, w, None, None, float(np.sum(t)), sum(s.iterations for s in sweeps),
+                           sweeps[-1].num_success == sweeps[-1].num_windows), sweeps
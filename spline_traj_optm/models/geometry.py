@@ -0,0 +1,197 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def ring_segments(vertices: np.ndarray):
+    """Split a closed polyline into its segments.
+
+    Args:
+        vertices (np.ndarray): M * 2 vertices of the ring. The closing vertex is optional.
+
+    Returns:
+        tuple: (starts, ends), both K * 2 segment end points.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)[:, :2]
+    if not np.array_equal(vertices[0], vertices[-1]):
+        vertices = np.vstack([vertices, vertices[0, np.newaxis, :]])
+    return vertices[:-1], vertices[1:]
+
+
+class SegmentSet:
+    def __init__(self, vertices: np.ndarray) -> None:
+        """Segments of a closed boundary, indexed by their mid points for spatial pruning.
+
+        Args:
+            vertices (np.ndarray): M * 2 vertices of the ring, in driving direction. The closing vertex is optional.
+        """
+        self.starts, self.ends = ring_segments(vertices)
+        self.edges = self.ends - self.starts
+        self.mids = 0.5 * (self.starts + self.ends)
+        # contiguous coordinates for fast gathers
+        self.starts_x, self.starts_y = self.starts[:, 0].copy(), self.starts[:, 1].copy()
+        self.edges_x, self.edges_y = self.edges[:, 0].copy(), self.edges[:, 1].copy()
+        self.lengths = np.hypot(self.edges_x, self.edges_y)
+        # arc length of the ring at the start of every segment
+        self.s = np.concatenate([[0.0], np.cumsum(self.lengths)[:-1]])
+        self.length = np.sum(self.lengths)
+        # any point on a segment is within this distance from its mid point
+        self.max_half_length = 0.5 * np.max(self.lengths)
+        self.tree = cKDTree(self.mids)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def candidates(self, points: np.ndarray, radius, k=12):
+        """Find the segments that may intersect with anything within `radius` of the points.
+
+        Args:
+            points (np.ndarray): N * 2 query points.
+            radius (float or np.ndarray): Search radius in meter, for all or each of the points.
+            k (int, optional): Initial number of candidates per point, doubled until no point
+                has more segments in range than candidates. Defaults to 12.
+
+        Returns:
+            tuple: (idx, found). N * K segment indices and the mask of the valid ones.
+        """
+        k = min(k, len(self))
+        bound = np.reshape(radius + self.max_half_length, (-1, 1))
+        while True:
+            dist, idx = self.tree.query(points, k=k, distance_upper_bound=np.max(bound))
+            dist, idx = dist.reshape((len(points), -1)), idx.reshape((len(points), -1))
+            found = dist <= bound
+            if k == len(self) or not np.any(found[:, -1]):
+                idx[~found] = 0
+                return idx, found
+            k = min(2 * k, len(self))
+
+    def nearest(self, points: np.ndarray):
+        """Project points onto the closest segments.
+
+        Args:
+            points (np.ndarray): N * 2 query points.
+
+        Returns:
+            tuple: (nearest, dist, s, idx). N * 2 closest points on the ring, their distances to the
+                query points, their arc lengths along the ring and the indices of their segments.
+        """
+        points = np.asarray(points, dtype=np.float64)[:, :2]
+        # the closest mid point bounds the distance to the closest segment
+        mid_dist, _ = self.tree.query(points, k=1)
+        si, found = self.candidates(points, mid_dist * (1.0 + 1e-9))
+        px, py = points[:, 0, np.newaxis], points[:, 1, np.newaxis]
+        ex, ey = self.edges_x[si], self.edges_y[si]
+        apx, apy = px - self.starts_x[si], py - self.starts_y[si]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = np.clip((apx * ex + apy * ey) / (ex * ex + ey * ey), 0.0, 1.0)
+        v[~np.isfinite(v)] = 0.0
+        dist = np.hypot(apx - v * ex, apy - v * ey)
+        dist[~found] = np.inf
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(points))
+        idx, v = si[rows, best], v[rows, best]
+        nearest = self.starts[idx] + v[:, np.newaxis] * self.edges[idx]
+        return nearest, dist[rows, best], self.s[idx] + v * self.lengths[idx], idx
+
+    def intersect(self, points: np.ndarray, directions: np.ndarray, max_dist=100.0, search_radius=8.0, two_sided=True):
+        """Intersect a ray (or a line) from every point with the ring, all at once.
+
+        The candidate segments are first searched within `search_radius`, and only the points
+        without a hit there are searched again with a doubled radius until `max_dist` is covered.
+
+        Args:
+            points (np.ndarray): N * 2 ray origins.
+            directions (np.ndarray): N * 2 unit ray directions.
+            max_dist (float, optional): Length of the rays. Defaults to 100.0.
+            search_radius (float, optional): Radius of the first pruned search. Defaults to 8.0.
+            two_sided (bool, optional): Cast the rays both forward and backward, and keep the
+                closest hit of either. Defaults to True.
+
+        Returns:
+            tuple: (hits, dist, no_hit). N * 2 closest intersections, their distances to the ray
+                origins, and a mask for the points without any intersection, whose hits are the
+                points themselves and distances are inf.
+        """
+        points = np.asarray(points, dtype=np.float64)[:, :2]
+        hits = points.copy()
+        dists = np.full(len(points), np.inf)
+
+        def search(idx, radius):
+            si, found = self.candidates(points[idx], radius)
+            px, py = points[idx, 0, np.newaxis], points[idx, 1, np.newaxis]
+            nx, ny = directions[idx, 0, np.newaxis], directions[idx, 1, np.newaxis]
+            ex, ey = self.edges_x[si], self.edges_y[si]
+            apx, apy = self.starts_x[si], self.starts_y[si]
+            apx -= px
+            apy -= py
+            denom = nx * ey
+            denom -= ny * ex
+            # solve p + u * n = a + v * e, parallel segments end up with nan or inf and are rejected
+            with np.errstate(divide='ignore', invalid='ignore'):
+                u = apx * ey
+                u -= apy * ex
+                u /= denom
+                v = apx * ny
+                v -= apy * nx
+                v /= denom
+                abs_u = np.abs(u)
+                valid = found & (abs_u <= radius) & (v >= 0.0) & (v <= 1.0)
+                if not two_sided:
+                    valid &= u >= 0.0
+            abs_u[~valid] = np.inf
+            # keep the closest intersection of every point
+            best = np.argmin(abs_u, axis=1)
+            rows = np.arange(len(idx))
+            dists[idx] = abs_u[rows, best]
+            hit = np.isfinite(dists[idx])
+            closest = u[rows, best][hit]
+            hits[idx[hit]] = points[idx[hit]] + closest[:, np.newaxis] * directions[idx[hit]]
+
+        # widen the search for the points without a hit until max_dist is covered
+        remaining = np.arange(len(points))
+        radius = min(search_radius, max_dist)
+        while len(remaining) > 0:
+            search(remaining, radius)
+            remaining = remaining[np.isinf(dists[remaining])]
+            if radius >= max_dist:
+                break
+            radius = min(2.0 * radius, max_dist)
+
+        return hits, dists, np.isinf(dists)
+
+    def side(self, points: np.ndarray, nearest: np.ndarray, idx: np.ndarray):
+        """Which side of the ring the points are on, given their projections.
+
+        Args:
+            points (np.ndarray): N * 2 query points.
+            nearest (np.ndarray): N * 2 closest points on the ring.
+            idx (np.ndarray): N segment indices of the closest points.
+
+        Returns:
+            np.ndarray: N signs, 1.0 on the left of the driving direction and -1.0 on the right.
+        """
+        offset = points[:, :2] - nearest
+        cross = self.edges_x[idx] * offset[:, 1] - self.edges_y[idx] * offset[:, 0]
+        return np.where(cross >= 0.0, 1.0, -1.0)
+
+
+def normal_intersections(points: np.ndarray, yaws: np.ndarray, segments: SegmentSet, max_dist=100.0, search_radius=8.0):
+    """Intersect the normal line of every waypoint with a closed boundary, all at once.
+
+    The normal line of a waypoint spans `max_dist` to both sides of it, and the closest
+    intersection is kept, same as intersecting a 2 * `max_dist` `LineString` with the
+    boundary `LinearRing`.
+
+    Args:
+        points (np.ndarray): N * 2 waypoints.
+        yaws (np.ndarray): N tangent directions of the waypoints.
+        segments (SegmentSet): The boundary to intersect with.
+        max_dist (float, optional): Half length of the normal line. Defaults to 100.0.
+        search_radius (float, optional): Radius of the first pruned search. Defaults to 8.0.
+
+    Returns:
+        tuple: (hits, no_hit). N * 2 closest intersections, and a mask of length N for the
+            points without any intersection, whose hits are the points themselves.
+    """
+    normals = np.column_stack([-np.sin(yaws), np.cos(yaws)])
+    hits, _, no_hit = segments.intersect(points, normals, max_dist, search_radius, two_sided=True)
+    return hits, no_hit
@@ -2,6 +2,8 @@ import numpy as np
 from shapely.geometry import LinearRing
 
 from spline_traj_optm.models.trajectory import BSplineTrajectory, Trajectory
+from spline_traj_optm.models.geometry import SegmentSet
+from spline_traj_optm.instrumentation.profiler import profiler
 
 
 class RaceTrack:
@@ -10,16 +12,17 @@ class RaceTrack:
 
         Args:
             name (str): Race track name.
-            left (np.ndarray): N * 2 Left boundries in meter. N >= 3.
-            right (np.ndarray): N * 2 Right boundries in meter. N >= 3.
+            left (np.ndarray): N * 2 Left boundries in meter, or N * 3 with z. N >= 3.
+            right (np.ndarray): N * 2 Right boundries in meter, or N * 3 with z. N >= 3.
             s (float, optional): Smoothing value for `scipy.interpolate.splprep`. Defaults to 10.0.
             interval (float, optional): Sampling interval for the discretized version of the spline boundaries. Defaults to 2.0.
         """
         assert left.shape[0] >= 3 and right.shape[0] >= 3
         assert left.shape[1] >= 2 and right.shape[1] >= 2
 
-        self.left_s = BSplineTrajectory(left[:, :2], s, 5)
-        self.right_s = BSplineTrajectory(right[:, :2], s, 5)
+        self.left_s = BSplineTrajectory(left[:, :3], s, 5)
+        self.right_s = BSplineTrajectory(right[:, :3], s, 5)
+        self.has_z = left.shape[1] >= 3 and right.shape[1] >= 3
 
         self.left_d = self.left_s.sample_along(interval)
         self.right_d = self.right_s.sample_along(interval)
@@ -27,12 +30,130 @@ class RaceTrack:
         self.left_r = LinearRing(self.left_d[:, :2])
         self.right_r = LinearRing(self.right_d[:, :2])
 
+        self.left_segments = SegmentSet(self.left_d[:, :2])
+        self.right_segments = SegmentSet(self.right_d[:, :2])
+
         self.name = name
 
-    def fill_trajectory_boundaries(self, traj: Trajectory):
+    def fill_trajectory_boundaries(self, traj: Trajectory, rows=None):
         """Fills the boundary properties of a trajectory.
 
         Args:
             traj (Trajectory): The trajectory to be modified in-place.
+            rows (np.ndarray, optional): Indices of the waypoints to fill. Defaults to all.
+
+        Returns:
+            np.ndarray: N * 2 mask of the waypoints without a left or right boundary intersection.
+        """
+        with profiler().phase("bound_fill"):
+            return traj.fill_bounds(self.left_segments, self.right_segments, max_dist=100.0, rows=rows)
+
+    def nearest_boundary(self, points: np.ndarray):
+        """Finds the closest boundary point of each query point.
+
+        Args:
+            points (np.ndarray): N * 2 query points.
+
+        Returns:
+            tuple: (nearest, dist, s, is_left). N * 2 closest boundary points, their distances,
+                their arc lengths along their boundaries, and whether they are on the left boundary.
+        """
+        left, left_dist, left_s, _ = self.left_segments.nearest(points)
+        right, right_dist, right_s, _ = self.right_segments.nearest(points)
+        is_left = left_dist <= right_dist
+        nearest = np.where(is_left[:, np.newaxis], left, right)
+        return nearest, np.where(is_left, left_dist, right_dist), np.where(is_left, left_s, right_s), is_left
+
+    def center_line(self, interval=0.5, s=None, iterations=3):
+        """Fits the line at equal distance from both boundaries.
+
+        The center points start on the left boundary, `interval` apart in arc length, and move to
+        the mid point of their closest points on both boundaries, which settles where both are equally
+        far. They are then ordered by their mean progress along both boundaries, which stays in order
+        where one boundary stalls, like around the inside of a hairpin.
+
+        Args:
+            interval (float, optional): Spacing of the center points in meter, along the longer boundary. Defaults to 0.5.
+            s (float, optional): Smoothing value for `scipy.interpolate.splprep`. Defaults to None, which allows
+                a 5 cm RMS deviation from the center points.
+            iterations (int, optional): Number of mid point updates. Defaults to 3.
+
+        Returns:
+            BSplineTrajectory: The center line in driving direction, with z averaged from both boundaries if they have z.
+        """
+        n = int(np.ceil(max(self.left_segments.length, self.right_segments.length) / interval))
+        ss = np.arange(n) * (self.left_s.get_length() / n)
+        points = np.column_stack(self.left_s.eval(self.left_s.eval_arc_length_param(ss)))
+        for i in range(iterations + 1):
+            left, _, left_s, left_idx = self.left_segments.nearest(points)
+            right, _, right_s, right_idx = self.right_segments.nearest(points)
+            if i == iterations:
+                break
+            # only move across the track, so the points do not bunch up along it
+            tangent = np.roll(points, -1, axis=0) - np.roll(points, 1, axis=0)
+            tangent /= np.linalg.norm(tangent, axis=1)[:, np.newaxis]
+            delta = 0.5 * (left + right) - points
+            points = points + delta - np.sum(delta * tangent, axis=1)[:, np.newaxis] * tangent
+
+        # both boundaries start the lap elsewhere, so unwrap their progress before averaging
+        progress = 0.5 * (np.unwrap(left_s / self.left_segments.length, period=1.0)
+                          + np.unwrap(right_s / self.right_segments.length, period=1.0))
+        order = np.argsort(progress, kind="stable")
+        points = points[order]
+        if self.has_z:
+            z = 0.5 * (self.__boundary_z(self.left_segments, self.left_d, left_s, left_idx)
+                       + self.__boundary_z(self.right_segments, self.right_d, right_s, right_idx))
+            points = np.column_stack([points, z[order]])
+
+        # points that settled onto the same spot would be repeated points of the fit
+        step = np.hypot(*(points[:, :2] - np.roll(points[:, :2], 1, axis=0)).T)
+        points = points[step > 1e-3 * interval]
+        if s is None:
+            s = len(points) * 0.05 ** 2
+        return BSplineTrajectory(points, s, 5)
+
+    def __boundary_z(self, segments: SegmentSet, traj_d: Trajectory, s: np.ndarray, idx: np.ndarray):
+        # z of the closest points, linear along their segments like the points themselves
+        z = traj_d[:, Trajectory.Z]
+        v = np.divide(s - segments.s[idx], segments.lengths[idx], out=np.zeros_like(s), where=segments.lengths[idx] > 0.0)
+        return (1.0 - v) * z[idx] + v * np.roll(z, -1)[idx]
+
+    def ray_hit(self, points: np.ndarray, yaws: np.ndarray, side: str, max_dist=100.0):
+        """Casts a ray from each point perpendicular to its heading towards one boundary.
+
+        Args:
+            points (np.ndarray): N * 2 ray origins.
+            yaws (np.ndarray): N headings of the points.
+            side (str): "left" to cast to the left boundary, "right" to cast to the right boundary.
+            max_dist (float, optional): Length of the rays. Defaults to 100.0.
+
+        Returns:
+            tuple: (hits, dist, no_hit). N * 2 first boundary hits, their distances, and the mask
+                of the rays without a hit, whose hits are the origins and distances are inf.
+        """
+        if side == "left":
+            segments, normal = self.left_segments, np.pi / 2.0
+        elif side == "right":
+            segments, normal = self.right_segments, -np.pi / 2.0
+        else:
+            raise ValueError(f"Unknown boundary side {side}.")
+        directions = np.column_stack([np.cos(yaws + normal), np.sin(yaws + normal)])
+        return segments.intersect(points, directions, max_dist, two_sided=False)
+
+    def signed_lateral_offset(self, points: np.ndarray):
+        """Signed distances from each point to both boundaries, positive inside the track.
+
+        Args:
+            points (np.ndarray): N * 2 query points.
+
+        Returns:
+            np.ndarray: N * 2 offsets to the left (column 0) and right (column 1) boundaries.
+                A negative offset means the point is off the track beyond that boundary.
         """
-        traj.fill_bounds(self.left_r, self.right_r, max_dist=100.0)
+        points = np.asarray(points, dtype=np.float64)[:, :2]
+        left, left_dist, _, left_idx = self.left_segments.nearest(points)
+        right, right_dist, _, right_idx = self.right_segments.nearest(points)
+        # the track lies to the right of the left boundary and to the left of the right boundary
+        left_offset = -1.0 * self.left_segments.side(points, left, left_idx) * left_dist
+        right_offset = self.right_segments.side(points, right, right_idx) * right_dist
+        return np.column_stack([left_offset, right_offset])
@@ -0,0 +1,205 @@
+import warnings
+from dataclasses import dataclass
+import numpy as np
+
+
+@dataclass
+class IngestionStats:
+    """Counts of a point ingestion. `num_duplicates` only counts the repeats of their predecessor,
+    the last points of a loop dropped for being too close to the first one are `num_loop_trimmed`."""
+    num_read: int = 0
+    num_chunks: int = 0
+    num_duplicates: int = 0
+    num_outliers: int = 0
+    num_loop_trimmed: int = 0
+    num_kept: int = 0
+
+    def __str__(self):
+        return str(
+            f"Read {self.num_read} points in {self.num_chunks} chunks, kept {self.num_kept}, "
+            f"dropped {self.num_duplicates} duplicates, {self.num_outliers} outliers "
+            f"and {self.num_loop_trimmed} points closing the loop"
+        )
+
+
+class PointThinner:
+    # smallest number of points searched at once for the next point to keep
+    MIN_WINDOW = 16
+
+    def __init__(self, min_dist: float, max_step: float = None) -> None:
+        """Thins a stream of points along a path, one chunk at a time.
+
+        A point is an outlier if it is farther than `max_step` from both its predecessor and its
+        successor, like a single GNSS glitch. Of the other points, the first one at least `min_dist`
+        from the last kept point is kept next, so noise and repeated points below that distance are
+        dropped. The distances are taken in x and y, the other columns are carried along.
+
+        The last point of a chunk is held back until the successor it is checked against arrives,
+        see `flush`.
+
+        Args:
+            min_dist (float): Smallest distance between the kept points in meter. 0 keeps every point
+                that is not a repeat of its predecessor or an outlier.
+            max_step (float, optional): Largest plausible distance between consecutive points in meter.
+                Defaults to None, which rejects no outliers.
+        """
+        self.min_dist = min_dist
+        self.max_step = max_step
+        self.stats = IngestionStats()
+        # the point waiting for its successor, and the point before it
+        self._pending = None
+        self._before = None
+        # the last point that passed the outlier check, the last kept point, and the number
+        # of points searched at once for the next one
+        self._last_raw = None
+        self._last = None
+        self._window = PointThinner.MIN_WINDOW
+
+    def push(self, chunk: np.ndarray):
+        """Adds the next M * D points of the stream, D >= 2.
+
+        Returns:
+            np.ndarray: The points of the stream kept so far and not returned before.
+        """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        self.stats.num_read += len(chunk)
+        self.stats.num_chunks += 1
+        if len(chunk) == 0:
+            return chunk
+        points = chunk if self._pending is None else np.vstack([self._pending, chunk])
+        self._pending = points[-1:]
+        keep = self.__reject_outliers(points)
+        self._before = points[-2:-1] if len(points) > 1 else self._before
+        return self.__thin(points[:-1][keep])
+
+    def flush(self):
+        """Returns the last point of the stream, if kept. It has no successor to be an outlier against."""
+        if self._pending is None:
+            return np.zeros((0, 2))
+        points, self._pending = self._pending, None
+        return self.__thin(points)
+
+    def __reject_outliers(self, points):
+        # every point but the last one has its successor here
+        n = len(points) - 1
+        if self.max_step is None or n == 0:
+            return np.ones(n, dtype=bool)
+        step = np.hypot(*np.diff(points[:, :2], axis=0).T)
+        before = np.empty(n)
+        before[1:] = step[:-1]
+        before[0] = np.inf if self._before is None else np.hypot(*(points[0, :2] - self._before[0, :2]))
+        outlier = (before > self.max_step) & (step > self.max_step)
+        self.stats.num_outliers += int(np.count_nonzero(outlier))
+        return ~outlier
+
+    def __thin(self, points):
+        if len(points) == 0:
+            return points
+        xy = points[:, :2]
+        start = xy[:1] if self._last_raw is None else self._last_raw[:, :2]
+        duplicate = np.all(np.diff(np.vstack([start, xy]), axis=0) == 0.0, axis=1)
+        if self._last_raw is None:
+            duplicate[0] = False
+        self.stats.num_duplicates += int(np.count_nonzero(duplicate))
+        self._last_raw = points[-1:]
+
+        if self.min_dist <= 0.0:
+            kept = points[~duplicate]
+        else:
+            # keep the first point at least min_dist from the last kept one, searched in windows
+            # sized after the previous gap, so only the kept points cost a Python iteration
+            keep = []
+            pos, anchor = 0, None if self._last is None else self._last[0, :2]
+            if anchor is None:
+                keep.append(0)
+                pos, anchor = 1, xy[0]
+            while pos < len(xy):
+                window = xy[pos:pos + self._window]
+                hit = np.flatnonzero(np.hypot(*(window - anchor).T) >= self.min_dist)
+                if len(hit) == 0:
+                    pos += len(window)
+                    self._window *= 2
+                    continue
+                keep.append(pos + hit[0])
+                anchor = xy[pos + hit[0]]
+                pos += hit[0] + 1
+                self._window = max(PointThinner.MIN_WINDOW, 2 * (hit[0] + 1))
+            kept = points[keep]
+        if len(kept) > 0:
+            self._last = kept[-1:]
+        self.stats.num_kept += len(kept)
+        return kept
+
+
+def read_csv_chunks(f, chunk_size=1000000, columns=("x", "y", "z")):
+    """Reads a CSV file of points chunk by chunk.
+
+    Args:
+        f (str): Path of the file.
+        chunk_size (int, optional): Number of rows per chunk. Defaults to 1000000.
+        columns (tuple, optional): Names of the columns to read, looked up in the header, or their
+            indices. The first two, x and y, must be in the header, the others are skipped if missing,
+            so x,y files read with the default. Defaults to ("x", "y", "z").
+
+    Yields:
+        np.ndarray: Up to chunk_size * len(columns) points.
+    """
+    with open(f, "r") as input_file:
+        fields = [name.strip() for name in input_file.readline().split(",")]
+        try:
+            [float(v) for v in fields]
+            # no header, the first line is data
+            input_file.seek(0)
+            usecols = [int(c) for c in columns if isinstance(c, int) or c.isdigit()] or \
+                list(range(min(len(fields), len(columns))))
+        except ValueError:
+            missing = [c for c in columns[:2] if not isinstance(c, int) and c not in fields]
+            if len(missing) > 0:
+                raise ValueError(f"{f} has no columns {missing}, its header is {fields}")
+            usecols = [c if isinstance(c, int) else fields.index(c) for c in columns
+                       if isinstance(c, int) or c in fields]
+        while True:
+            with warnings.catch_warnings():
+                # the end of the file reads as an empty chunk, with a warning
+                warnings.simplefilter("ignore", UserWarning)
+                chunk = np.loadtxt(input_file, dtype=np.float64, delimiter=",", usecols=usecols,
+                                   max_rows=chunk_size, ndmin=2)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+
+def read_track_points(f, min_dist=0.5, max_step=None, chunk_size=1000000, columns=("x", "y", "z"),
+                      max_points=None, closed=True):
+    """Reads the points of a boundary or center line log, thinned while reading, so the memory is
+    bounded by the chunk size and the thinned line.
+
+    Args:
+        f (str): Path of the CSV file.
+        min_dist (float, optional): Smallest distance between the kept points in meter, see `PointThinner`. Defaults to 0.5.
+        max_step (float, optional): Largest plausible distance between consecutive points in meter, see
+            `PointThinner`. Defaults to None.
+        chunk_size (int, optional): Number of rows read at once. Defaults to 1000000.
+        columns (tuple, optional): Columns to read, see `read_csv_chunks`. Defaults to ("x", "y", "z").
+        max_points (int, optional): Evenly subsample the kept points down to at most this many. Defaults to None.
+        closed (bool, optional): The line is a loop, so the last points closer than `min_dist` to the first
+            one are dropped, which `BSplineTrajectory` would otherwise see as a repeated point. Defaults to True.
+
+    Returns:
+        tuple: (points, stats). The M * len(columns) points, and the `IngestionStats`.
+    """
+    thinner = PointThinner(min_dist, max_step)
+    kept = [thinner.push(chunk) for chunk in read_csv_chunks(f, chunk_size, columns)]
+    kept.append(thinner.flush())
+    points = np.vstack([k for k in kept if len(k) > 0]) if any(len(k) > 0 for k in kept) else np.zeros((0, 2))
+    if closed and len(points) > 1:
+        to_first = np.hypot(*(points[:, :2] - points[0, :2]).T)
+        end = len(points)
+        while end > 1 and to_first[end - 1] < max(min_dist, 1e-9):
+            end -= 1
+        thinner.stats.num_loop_trimmed = len(points) - end
+        points = points[:end]
+    if max_points is not None and len(points) > max_points:
+        points = points[np.linspace(0, len(points), max_points, endpoint=False).astype(int)]
+    thinner.stats.num_kept = len(points)
+    return points, thinner.stats
@@ -1,10 +1,16 @@
 import numpy as np
 import copy
-from scipy import interpolate
+from scipy import interpolate, sparse
 from scipy.interpolate import BSpline
 from scipy.integrate import quad
 from shapely.geometry import Point, LinearRing, GeometryCollection, LineString, MultiPoint
 import pickle
+import json
+import struct
+import warnings
+
+from spline_traj_optm.models.geometry import SegmentSet, normal_intersections
+from spline_traj_optm.instrumentation.profiler import profiler
 
 class Trajectory:
     X = 0
@@ -27,42 +33,203 @@ class Trajectory:
     IDX = 17
     ITERATION_FLAG = 18
 
+    # lower case, so it is not taken for a column by `columns`
+    _num_columns = 19
+
     def __init__(self, num_point: int) -> None:
-        self.points = np.zeros((num_point, 19), dtype=np.float64)
-        self.points[:, Trajectory.IDX] = np.arange(0, len(self.points), 1)
-        self.points[:, Trajectory.ITERATION_FLAG] = -1
+        """Waypoints of a trajectory, stored column by column.
+
+        A column is only allocated when it is first written, until then it reads as its default:
+        the waypoint index for IDX, -1 for ITERATION_FLAG and 0 otherwise. Copies share their
+        columns until one of them writes a column, which then copies only that column.
+
+        Indexing works like on an N * 19 array. `traj[rows, Trajectory.X]` is a read-only view of
+        the column, any other key gathers the columns into a new read-only array. Write through
+        `traj[key] = value`.
+
+        Args:
+            num_point (int): Number of waypoints.
+        """
+        self._num_point = num_point
+        self._columns = [None] * Trajectory._num_columns
+        # columns this trajectory may write in place, the others are shared with copies or read only files
+        self._owned = [False] * Trajectory._num_columns
+
+    def __key(self, key):
+        rows, cols = key if isinstance(key, tuple) and len(key) == 2 else (key, slice(None))
+        if isinstance(cols, (int, np.integer)):
+            return rows, range(Trajectory._num_columns)[cols]
+        if not isinstance(cols, slice) and not isinstance(rows, slice) and np.ndim(rows) > 0:
+            # index arrays for both rows and columns pick single elements, like on an array
+            rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else rows
+            rows, cols = np.broadcast_arrays(rows, np.arange(Trajectory._num_columns)[cols])
+            return list(zip(rows.ravel(), cols.ravel())), rows.shape
+        return rows, np.arange(Trajectory._num_columns)[cols]
+
+    def __default(self, col):
+        return -1.0 if col == Trajectory.ITERATION_FLAG else 0.0
+
+    def __writable(self, col):
+        values = self._columns[col]
+        if values is None:
+            if col == Trajectory.IDX:
+                values = np.arange(0, self._num_point, 1, dtype=np.float64)
+            else:
+                values = np.full(self._num_point, self.__default(col))
+        elif not self._owned[col]:
+            values = np.array(values, dtype=np.float64)
+        self._columns[col] = values
+        self._owned[col] = True
+        return values
+
+    def column(self, col: int):
+        """Read-only view of a column, without copying it."""
+        values = self._columns[col]
+        if values is None:
+            if col != Trajectory.IDX:
+                return np.broadcast_to(self.__default(col), (self._num_point,))
+            values = self.__writable(col)
+        view = values.view(np.ndarray)
+        view.flags.writeable = False
+        return view
+
+    def num_allocated(self):
+        """Number of columns allocated, and of those owned by this trajectory rather than shared."""
+        return sum(c is not None for c in self._columns), sum(self._owned)
 
     def __getitem__(self, key):
-        return self.points[key]
+        # single elements and rows are read in loops, so they skip the key parsing
+        if type(key) is tuple and len(key) == 2:
+            row, col = key
+            if isinstance(row, (int, np.integer)) and isinstance(col, (int, np.integer)):
+                values = self._columns[col]
+                if values is None:
+                    row, col = range(self._num_point)[row], range(Trajectory._num_columns)[col]
+                    return np.float64(row if col == Trajectory.IDX else self.__default(col))
+                return values[row]
+        elif isinstance(key, (int, np.integer)):
+            row = np.array([self[key, col] for col in range(Trajectory._num_columns)])
+            row.flags.writeable = False
+            return row
+        rows, cols = self.__key(key)
+        if isinstance(cols, tuple):
+            return np.array([self.column(col)[row] for row, col in rows]).reshape(cols)
+        if np.ndim(cols) == 0:
+            return self.column(cols)[rows]
+        gathered = np.stack([self.column(c)[rows] for c in cols], axis=-1)
+        gathered.flags.writeable = False
+        return gathered
 
     def __setitem__(self, key, val):
-        self.points[key] = val
+        rows, cols = self.__key(key)
+        if isinstance(cols, tuple):
+            for (row, col), v in zip(rows, np.broadcast_to(val, cols).ravel()):
+                self.__writable(col)[row] = v
+            return
+        if np.ndim(cols) == 0:
+            self.__writable(cols)[rows] = val
+            return
+        val = np.asarray(val, dtype=np.float64)
+        if val.ndim == 0:
+            val = np.full(len(cols), val)
+        for i, col in enumerate(cols):
+            self.__writable(col)[rows] = val[..., i]
 
     def __len__(self):
-        return len(self.points)
+        return self._num_point
 
     def __iter__(self):
-        for pt in self.points:
-            yield pt
+        for i in range(self._num_point):
+            yield self[i]
+
+    @property
+    def points(self):
+        """All columns gathered into a new read-only N * 19 array. Assigning an array replaces the columns."""
+        points = self.to_array()
+        points.flags.writeable = False
+        return points
+
+    @points.setter
+    def points(self, arr):
+        source = arr
+        arr = np.asarray(arr, dtype=np.float64)
+        assert arr.ndim == 2 and arr.shape[1] == Trajectory._num_columns, "points should be N * 19"
+        # the columns of a row major array are copied once to be contiguous, those of a column major one,
+        # like a memory-mapped file, are used in place and copied before their first write, so the caller's
+        # array is never written
+        columns = np.ascontiguousarray(arr.T)
+        owned = columns.flags.writeable and not np.shares_memory(columns, source)
+        self._num_point = len(arr)
+        self._columns = list(columns)
+        self._owned = [owned] * Trajectory._num_columns
+
+    def to_array(self):
+        """All columns gathered into a new writable N * 19 array."""
+        points = np.empty((self._num_point, Trajectory._num_columns), dtype=np.float64)
+        for col in range(Trajectory._num_columns):
+            points[:, col] = self.column(col)
+        return points
 
     def copy(self):
-        new_traj = Trajectory(len(self.points))
-        new_traj.points = self.points.copy()
+        new_traj = Trajectory(self._num_point)
+        new_traj._columns = list(self._columns)
+        # both write the shared columns to copies of their own
+        self._owned = [False] * Trajectory._num_columns
         return new_traj
 
     def inc(self, idx: int):
-        if idx + 1 == len(self.points):
+        if idx + 1 == len(self):
             return 0
         else:
             return idx + 1
 
     def dec(self, idx: int):
         if idx - 1 < 0:
-            return len(self.points) - 1
+            return len(self) - 1
         else:
             return idx - 1
 
-    def fill_bounds(self, left_poly, right_poly, max_dist=100.0):
+    def fill_bounds(self, left_poly, right_poly, max_dist=100.0, rows=None):
+        """Fills the left and right boundary columns with the closest intersections
+        between the normal line of each waypoint and the boundaries.
+
+        Args:
+            left_poly: Left boundary, as a `SegmentSet`, a `LinearRing` or M * 2 vertices.
+            right_poly: Right boundary, as a `SegmentSet`, a `LinearRing` or M * 2 vertices.
+            max_dist (float, optional): Half length of the normal line. Defaults to 100.0.
+            rows (np.ndarray, optional): Indices of the waypoints to fill. Defaults to all.
+
+        Returns:
+            np.ndarray: N * 2 mask of the waypoints without a left (column 0) or right
+                (column 1) intersection. Their bounds are set to the waypoints themselves,
+                which is counted as "bound_no_hit" by the profiler and warned about.
+        """
+        def as_segments(poly):
+            if isinstance(poly, SegmentSet):
+                return poly
+            if isinstance(poly, LinearRing):
+                return SegmentSet(np.array(poly.coords))
+            return SegmentSet(poly)
+
+        if rows is None:
+            rows = slice(None)
+        points = self[rows, Trajectory.X:Trajectory.Y+1]
+        yaws = self[rows, Trajectory.YAW]
+        left, left_no_hit = normal_intersections(points, yaws, as_segments(left_poly), max_dist)
+        right, right_no_hit = normal_intersections(points, yaws, as_segments(right_poly), max_dist)
+        self[rows, Trajectory.LEFT_BOUND_X:Trajectory.LEFT_BOUND_Y+1] = left
+        self[rows, Trajectory.RIGHT_BOUND_X:Trajectory.RIGHT_BOUND_Y+1] = right
+        no_hit = np.column_stack([left_no_hit, right_no_hit])
+        if np.any(no_hit):
+            profiler().count("bound_no_hit", int(no_hit.sum()))
+            missed = np.arange(len(self))[rows][np.any(no_hit, axis=1)]
+            warnings.warn(
+                f"No boundary intersection within {max_dist} m of the normal line at {len(missed)} waypoints "
+                f"(indices {missed[:10].tolist()}{'...' if len(missed) > 10 else ''}), "
+                f"their bounds are set to the waypoints themselves.", stacklevel=2)
+        return no_hit
+
+    def fill_bounds_shapely(self, left_poly, right_poly, max_dist=100.0):
         def find_intersect(wp:np.ndarray, poly: LinearRing, norm, max_dist):
             yaw_tan, x, y = wp[Trajectory.YAW], wp[Trajectory.X], wp[Trajectory.Y]
             traj_pt = Point(x, y)
@@ -116,31 +283,23 @@ class Trajectory:
             wp[Trajectory.RIGHT_BOUND_X] = right_bound.x
             wp[Trajectory.RIGHT_BOUND_Y] = right_bound.y
 
-        np.apply_along_axis(calc_left_right_bounds, 1, self.points)
+        points = self.to_array()
+        np.apply_along_axis(calc_left_right_bounds, 1, points)
+        self[:, Trajectory.LEFT_BOUND_X:Trajectory.RIGHT_BOUND_Y+1] = points[:, Trajectory.LEFT_BOUND_X:Trajectory.RIGHT_BOUND_Y+1]
 
     def fill_time(self):
         # Check for zero speeds
-        for pt in self.points:
-            if pt[Trajectory.SPEED] == 0.0 and pt[Trajectory.LON_ACC == 0.0]:
-                raise Exception(
-                    "Zero speed and lon_acc encoutered. Cannot fill time.")
-
-        self.points[0, Trajectory.TIME] = 0.0
-        for i in range(len(self.points)):
-            this, next = i, i + 1
-            if next == len(self.points):
-                next = 0
-            # x = 1/2 * (v_0 + v) * t
-            x = self.distance(self.points[this], self.points[next])
-            self.points[next, Trajectory.TIME] = x / (
-                0.5
-                * (
-                    self.points[this, Trajectory.SPEED]
-                    + self.points[next, Trajectory.SPEED]
-                )
-            )
-            self.points[next, Trajectory.TIME] += self.points[this,
-                                                              Trajectory.TIME]
+        speed = self[:, Trajectory.SPEED]
+        if np.any((speed == 0.0) & (self[:, Trajectory.LON_ACC] == 0.0)):
+            raise Exception(
+                "Zero speed and lon_acc encoutered. Cannot fill time.")
+
+        # x = 1/2 * (v_0 + v) * t, the time of the closing segment goes to the first waypoint
+        xy = self[:, :2]
+        x = np.hypot(*(np.roll(xy, -1, axis=0) - xy).T)
+        t = np.cumsum(x / (0.5 * (speed + np.roll(speed, -1))))
+        self[1:, Trajectory.TIME] = t[:-1]
+        self[0, Trajectory.TIME] = t[-1]
 
     def distance(self, pt1, pt2):
         return np.sqrt(
@@ -160,27 +319,304 @@ class Trajectory:
         traj.points = arr
         return traj
 
+    def columns():
+        """Names of the columns of the points, in order, from the column constants of the class."""
+        cols = {v: k for k, v in vars(Trajectory).items() if k.isupper() and isinstance(v, int)}
+        return [cols[i] for i in range(len(cols))]
+
+    def save_binary(f, traj):
+        """Saves the points to a versioned binary container, column by column, see `_save_container`."""
+        columns = [traj.column(col) for col in range(Trajectory._num_columns)]
+        _save_container(f, "trajectory", {"points": columns}, columns=Trajectory.columns())
+
+    def load_binary(f, mmap=False):
+        """Loads the points of a binary container written by `save_binary`.
+
+        Columns are matched by name, so a container of an older schema loads with the defaults
+        of `Trajectory` in the columns it lacks.
+
+        Args:
+            f (str): Path of the container.
+            mmap (bool or str, optional): Memory-map the points instead of reading them. The columns are
+                stored contiguously, so `traj[:, Trajectory.X]` only reads that column from disk. True maps
+                the file read only, otherwise a `np.memmap` mode like 'c' or 'r+'. Writing a column of a
+                read only map copies the column, a writable map is written in place. The schema must match
+                the class. Defaults to False.
+
+        Returns:
+            Trajectory: The trajectory.
+        """
+        header, blocks = _load_container(f, "trajectory", mmap)
+        points = blocks["points"].T
+        columns = header["columns"]
+        if mmap:
+            if columns != Trajectory.columns():
+                raise ValueError(f"Cannot memory-map {f}, its columns {columns} differ from {Trajectory.columns()}")
+            traj = Trajectory(0)
+            traj.points = points
+            # the map belongs to the trajectory, so a writable one is written in place, through to the file for 'r+'
+            traj._owned = [points.flags.writeable] * Trajectory._num_columns
+            return traj
+        traj = Trajectory(len(points))
+        for i, name in enumerate(columns):
+            if hasattr(Trajectory, name):
+                traj[:, getattr(Trajectory, name)] = points[:, i]
+        return traj
+
+
+# layout of the binary containers: magic, format version and header size, then the JSON header,
+# padded so the float64 blocks start aligned, see `_save_container`
+CONTAINER_MAGIC = b"STOBIN\x00\x00"
+CONTAINER_VERSION = 1
+CONTAINER_ALIGNMENT = 64
+_CONTAINER_PREFIX = struct.Struct("<8sII")
+
+
+def _save_container(f, kind, blocks, **meta):
+    """Writes float64 arrays to a versioned binary container.
+
+    The file starts with the magic, the version and the size of a JSON header, which holds the kind
+    of the container, `meta` and the offset and shape of every block. The blocks follow as raw
+    little-endian float64 in C order, each aligned to `CONTAINER_ALIGNMENT` bytes, so they can be
+    memory-mapped.
+
+    Args:
+        f (str): Path of the container.
+        kind (str): What the container holds, checked when loading.
+        blocks (dict): Name to array, or to a sequence of equally long 1-D arrays, written one
+            after the other as the rows of a 2-D block without stacking them.
+        **meta: Other JSON serializable entries of the header.
+    """
+    def align(n):
+        return -(-n // CONTAINER_ALIGNMENT) * CONTAINER_ALIGNMENT
+
+    def rows(block):
+        if isinstance(block, (list, tuple)):
+            return block
+        block = np.asarray(block)
+        return block.reshape(-1, block.shape[-1]) if block.ndim > 1 else [block]
+
+    def shape(block):
+        if isinstance(block, (list, tuple)):
+            return [len(block)] + (list(np.shape(block[0])) if len(block) > 0 else [0])
+        return list(np.shape(block))
+
+    block_headers = {}
+    offset = 0
+    for name, block in blocks.items():
+        block_headers[name] = {"offset": offset, "shape": shape(block)}
+        offset = align(offset + int(np.prod(block_headers[name]["shape"])) * 8)
+    header = {"kind": kind, "dtype": "<f8", "blocks": block_headers, **meta}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_offset = align(_CONTAINER_PREFIX.size + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_offset - _CONTAINER_PREFIX.size)
+    with open(f, "wb") as output_file:
+        output_file.write(_CONTAINER_PREFIX.pack(CONTAINER_MAGIC, CONTAINER_VERSION, len(header_bytes)))
+        output_file.write(header_bytes)
+        for name, block in blocks.items():
+            output_file.seek(data_offset + block_headers[name]["offset"])
+            # row by row, to not copy large transposed or stacked arrays at once
+            for row in rows(block):
+                output_file.write(np.ascontiguousarray(row, dtype="<f8").tobytes())
+
+
+def _load_container(f, kind, mmap=False):
+    """Reads a binary container written by `_save_container`.
+
+    Args:
+        f (str): Path of the container.
+        kind (str): The expected kind.
+        mmap (bool or str, optional): Memory-map the blocks, True for read only or a `np.memmap` mode.
+            Defaults to False.
+
+    Returns:
+        tuple: (header, blocks). The JSON header, and the name to array of the blocks.
+    """
+    with open(f, "rb") as input_file:
+        prefix = input_file.read(_CONTAINER_PREFIX.size)
+        if len(prefix) != _CONTAINER_PREFIX.size:
+            raise ValueError(f"{f} is not a binary container")
+        magic, version, header_size = _CONTAINER_PREFIX.unpack(prefix)
+        if magic != CONTAINER_MAGIC:
+            raise ValueError(f"{f} is not a binary container")
+        if version > CONTAINER_VERSION:
+            raise ValueError(f"{f} has container version {version}, only up to {CONTAINER_VERSION} is supported")
+        header = json.loads(input_file.read(header_size).decode("utf-8"))
+    if header["kind"] != kind:
+        raise ValueError(f"{f} holds a {header['kind']}, not a {kind}")
+    data_offset = _CONTAINER_PREFIX.size + header_size
+    mode = "r" if mmap is True else mmap
+    blocks = {}
+    for name, block in header["blocks"].items():
+        shape = tuple(block["shape"])
+        if mmap and np.prod(shape) > 0:
+            blocks[name] = np.memmap(f, dtype=header["dtype"], mode=mode, offset=data_offset + block["offset"], shape=shape)
+        else:
+            blocks[name] = np.fromfile(f, dtype=header["dtype"], count=int(np.prod(shape)),
+                                       offset=data_offset + block["offset"]).reshape(shape)
+    return header, blocks
+
+class BSplineBasisCache:
+    def __init__(self) -> None:
+        """Sparse collocation matrices of a spline at one parameter grid, built once per
+        derivative order and kept until the knots or the grid change.
+
+        Every matrix is kept in CSR format for evaluating the spline, and in CSC format for
+        slicing out the values of a single basis function.
+        """
+        self.reset_stats()
+        self.clear()
+
+    def reset_stats(self):
+        self.num_built = 0
+        self.num_hits = 0
+
+    def clear(self):
+        self._knots = None
+        self._ts = None
+        self._matrices = {}
+
+    def __len__(self):
+        return len(self._matrices)
+
+    @property
+    def nbytes(self):
+        """Memory of the cached matrices and of their knots and grid, in bytes."""
+        total = 0
+        for mats in self._matrices.values():
+            for m in mats:
+                total += m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+        if self._knots is not None:
+            total += self._knots.nbytes + self._ts.nbytes
+        return total
+
+    def get(self, spline, ts, nu=0):
+        """Gets the collocation matrices of the spline at the parameters, building them if needed.
+
+        Args:
+            spline (BSplineTrajectory): The spline, whose knots are checked against the cached ones.
+            ts (np.ndarray): M parameters in [0, 1], checked against the cached grid.
+            nu (int, optional): Order of the derivative. Defaults to 0.
+
+        Returns:
+            tuple: (csr, csc). The same M * num_ctrl_pt matrix in both formats.
+        """
+        knots = spline._spl_x.t
+        ts = np.asarray(ts, dtype=np.float64)
+        if self._knots is None or not np.array_equal(self._knots, knots) or not np.array_equal(self._ts, ts):
+            self.clear()
+            self._knots = knots.copy()
+            self._ts = ts.copy()
+        mats = self._matrices.get(nu)
+        if mats is None:
+            csr = spline.collocation_matrix(ts, nu)
+            mats = (csr, sparse.csc_array(csr))
+            self._matrices[nu] = mats
+            self.num_built += 1
+        else:
+            self.num_hits += 1
+        return mats
+
+    def __str__(self):
+        return str(
+            f"B-spline basis matrices built: {self.num_built}, hits: {self.num_hits}, "
+            f"cached: {len(self)} ({self.nbytes / 1024:.1f} KiB)"
+        )
+
+
 class BSplineTrajectory:
+    # Gauss-Legendre order and number of pieces per knot span of the arc length table
+    ARC_LENGTH_ORDER = 8
+    ARC_LENGTH_PIECES = 2
+
     def __init__(self, coordinates: np.ndarray, s: float, k: int):
-        assert coordinates.shape[0] >= 3 and coordinates.shape[1] == 2 and len(
-            coordinates.shape) == 2, "coordinates should be N * 2"
+        assert coordinates.shape[0] >= 3 and coordinates.shape[1] in (2, 3) and len(
+            coordinates.shape) == 2, "coordinates should be N * 2, or N * 3 with z"
         # close the loop
         coordinates_close_loop = np.vstack([coordinates, coordinates[0, np.newaxis, :]])
         tck, u = interpolate.splprep(
             [coordinates_close_loop[:, 0], coordinates_close_loop[:, 1]], s=s, per=True, k=k)
         self._spl_x = BSpline(tck[0], tck[1][0], tck[2])
         self._spl_y = BSpline(tck[0], tck[1][1], tck[2])
-        self._length = self.__get_section_length(0.0, 1.0)
-
-    def __integrate_length(self, t: float):
+        # z is a least squares fit on the knots of x and y, so it does not change their shape
+        self._spl_z = None
+        if coordinates.shape[1] == 3:
+            tck_z, _ = interpolate.splprep([coordinates_close_loop[:, 2]], u=u, t=tck[0], task=-1, per=True, k=k)
+            self._spl_z = BSpline(tck[0], tck_z[1][0], tck[2])
+        self._arc_length_table = None
+        # control points moved since the last `sample_along` or `resample_dirty`
+        self._dirty_ctrl_pts = set()
+        self._basis_cache = BSplineBasisCache()
+
+    def __integrate_length(self, t):
         return np.sqrt(interpolate.splev(t, self._spl_x, der=1) ** 2 + interpolate.splev(t, self._spl_y, der=1) ** 2)
 
-    def __get_section_length(self, t_min: float, t_max: float):
-        length, err = quad(self.__integrate_length, t_min, t_max, limit=200)
-        return length
+    def __gauss_legendre_length(self, t_min, t_max):
+        x, w = np.polynomial.legendre.leggauss(BSplineTrajectory.ARC_LENGTH_ORDER)
+        half = 0.5 * (np.asarray(t_max) - np.asarray(t_min))
+        t = half[..., np.newaxis] * (x + 1.0) + np.asarray(t_min)[..., np.newaxis]
+        return half * np.sum(w * self.__integrate_length(t), axis=-1)
+
+    def __get_arc_length_table(self):
+        # built on demand and patched locally whenever a control point moves
+        if self._arc_length_table is None:
+            knots = self._spl_x.t
+            knots = np.unique(knots[(knots >= 0.0) & (knots <= 1.0)])
+            # split every knot span so the fixed order quadrature stays accurate on long spans
+            pieces = np.arange(BSplineTrajectory.ARC_LENGTH_PIECES) / BSplineTrajectory.ARC_LENGTH_PIECES
+            breaks = knots[:-1, np.newaxis] + np.diff(knots)[:, np.newaxis] * pieces
+            breaks = np.append(breaks.ravel(), knots[-1])
+            lengths = self.__gauss_legendre_length(breaks[:-1], breaks[1:])
+            self._arc_length_table = (breaks, np.concatenate([[0.0], np.cumsum(lengths)]), lengths)
+        return self._arc_length_table
+
+    def __update_arc_length_table(self, idx):
+        if self._arc_length_table is None:
+            return
+        breaks, _, lengths = self._arc_length_table
+        t_min, t_max = self.get_control_point_support(idx)
+        pieces = np.flatnonzero((breaks[1:] > t_min) & (breaks[:-1] < t_max))
+        lengths[pieces] = self.__gauss_legendre_length(breaks[pieces], breaks[pieces + 1])
+        self._arc_length_table = (breaks, np.concatenate([[0.0], np.cumsum(lengths)]), lengths)
+
+    def eval_arc_length(self, ts):
+        """Arc length from the start of the spline to each parameter.
+
+        Args:
+            ts (np.ndarray): Parameters in [0, 1].
+
+        Returns:
+            np.ndarray: Arc lengths in meter.
+        """
+        breaks, cum_length, _ = self.__get_arc_length_table()
+        ts = np.clip(np.asarray(ts, dtype=np.float64), breaks[0], breaks[-1])
+        i = np.clip(np.searchsorted(breaks, ts, side='right') - 1, 0, len(breaks) - 2)
+        return cum_length[i] + self.__gauss_legendre_length(breaks[i], ts)
+
+    def eval_arc_length_param(self, ss, tol=1e-9, max_iter=10):
+        """Parameter at each arc length from the start of the spline, the inverse of `eval_arc_length`.
+
+        Args:
+            ss (np.ndarray): Arc lengths in [0, `get_length()`].
+            tol (float, optional): Tolerance of the arc length in meter. Defaults to 1e-9.
+            max_iter (int, optional): Maximum number of Newton iterations. Defaults to 10.
+
+        Returns:
+            np.ndarray: Parameters in [0, 1].
+        """
+        breaks, cum_length, _ = self.__get_arc_length_table()
+        ss = np.clip(np.asarray(ss, dtype=np.float64), 0.0, cum_length[-1])
+        ts = np.interp(ss, cum_length, breaks)
+        for _ in range(max_iter):
+            err = self.eval_arc_length(ts) - ss
+            if np.all(np.abs(err) < tol):
+                break
+            ts = np.clip(ts - err / self.__integrate_length(ts), breaks[0], breaks[-1])
+        return ts
 
     def eval_sectional_length(self, ts):
-        return self.__get_section_length(ts[0], ts[1])
+        s0, s1 = self.eval_arc_length(ts[:2])
+        return s1 - s0
 
     def eval_dx_sectional_length(self, ts):
         def to_integrate(t):
@@ -197,6 +633,12 @@ class BSplineTrajectory:
     def eval(self, t, der=0):
         return interpolate.splev(t, self._spl_x, der=der), interpolate.splev(t, self._spl_y, der=der)
 
+    def eval_z(self, t, der=0):
+        """z, or its der-th derivative, at the parameters. 0 if the spline was made without z."""
+        if self._spl_z is None:
+            return np.zeros_like(np.asarray(t, dtype=np.float64))
+        return interpolate.splev(t, self._spl_z, der=der)
+
     def __get_yaw(self, t):
         return np.arctan2(interpolate.splev(t, self._spl_y, der=1), interpolate.splev(t, self._spl_x, der=1))
 
@@ -209,12 +651,16 @@ class BSplineTrajectory:
         return 1.0 / (np.abs(curvature))
 
     def get_length(self):
-        return self._length
+        return self.__get_arc_length_table()[1][-1]
 
     def eval_yaw(self, t):
         return self.__get_yaw(t)
 
     def sample_along(self, interval: float=None, ts=None) -> Trajectory:
+        with profiler().phase("resample"):
+            return self.__sample_along(interval, ts)
+
+    def __sample_along(self, interval, ts):
         if interval is not None:
             total_length = self.get_length()
             num_sample = int(total_length // interval)
@@ -224,29 +670,183 @@ class BSplineTrajectory:
         else:
             traj = Trajectory(len(ts))
 
-        traj[:, Trajectory.X] = interpolate.splev(ts, self._spl_x)
-        traj[:, Trajectory.Y] = interpolate.splev(ts, self._spl_y)
-        traj[:, Trajectory.YAW] = self.__get_yaw(ts)
-        traj[:, Trajectory.CURVATURE] = self.__get_turn_radius(ts)
+        self.__fill_geometry(traj, slice(None), ts)
+        self._dirty_ctrl_pts = set()
 
-        for i in range(len(traj)):
-            if i == 0:
-                continue
-            traj[i, Trajectory.DIST_TO_SF_BWD] = traj[i-1, Trajectory.DIST_TO_SF_BWD] + self.__get_section_length(ts[i-1], ts[i])
-        traj[:, Trajectory.DIST_TO_SF_FWD] = self._length - traj[:, Trajectory.DIST_TO_SF_BWD]
+        dist = self.eval_arc_length(ts)
+        traj[:, Trajectory.DIST_TO_SF_BWD] = dist - dist[0]
+        traj[:, Trajectory.DIST_TO_SF_FWD] = self.get_length() - traj[:, Trajectory.DIST_TO_SF_BWD]
    
         return traj
 
+    def __fill_geometry(self, traj: Trajectory, rows, ts):
+        traj[rows, Trajectory.X] = interpolate.splev(ts, self._spl_x)
+        traj[rows, Trajectory.Y] = interpolate.splev(ts, self._spl_y)
+        traj[rows, Trajectory.YAW] = self.__get_yaw(ts)
+        traj[rows, Trajectory.CURVATURE] = self.__get_turn_radius(ts)
+        if self._spl_z is not None:
+            traj[rows, Trajectory.Z] = interpolate.splev(ts, self._spl_z)
+
+    def resample_dirty(self, traj_d: Trajectory):
+        """Resamples a trajectory only where the control points moved since the last
+        `sample_along` or `resample_dirty`.
+
+        Only the waypoints on the knot spans of the moved control points get new X, Y, YAW
+        and CURVATURE. The distances after each of these windows are shifted by one offset.
+
+        Args:
+            traj_d (Trajectory): Trajectory sampled from this spline at `traj_d.ts()`, before the
+                control points moved. Modified in-place.
+
+        Returns:
+            np.ndarray: Indices of the resampled waypoints.
+        """
+        with profiler().phase("resample"):
+            return self.__resample_dirty(traj_d)
+
+    def __resample_dirty(self, traj_d: Trajectory):
+        dirty = sorted(self._dirty_ctrl_pts)
+        self._dirty_ctrl_pts = set()
+        ts = traj_d.ts()
+        if len(dirty) == 0:
+            return np.zeros(0, dtype=int)
+
+        # merge the waypoint windows of the dirty control points
+        supports = np.array([self.get_control_point_support(idx) for idx in dirty])
+        lo = np.searchsorted(ts, supports[:, 0], side='left')
+        hi = np.searchsorted(ts, supports[:, 1], side='left')
+        windows = []
+        for l, h in sorted(zip(lo, hi)):
+            if l == h:
+                continue
+            if len(windows) > 0 and l <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], h)
+            else:
+                windows.append([l, h])
+        if len(windows) == 0:
+            return np.zeros(0, dtype=int)
+
+        rows = np.concatenate([np.arange(l, h) for l, h in windows])
+        self.__fill_geometry(traj_d, rows, ts[rows])
+
+        next_lo = [w[0] for w in windows[1:]] + [len(ts)]
+        for (l, h), next_l in zip(windows, next_lo):
+            if h < next_l:
+                # everything up to the next window shifts by the length change of this window
+                offset = self.eval_arc_length(ts[h]) - traj_d[h, Trajectory.DIST_TO_SF_BWD]
+                traj_d[h:next_l, Trajectory.DIST_TO_SF_BWD] = traj_d[h:next_l, Trajectory.DIST_TO_SF_BWD] + offset
+            traj_d[l:h, Trajectory.DIST_TO_SF_BWD] = self.eval_arc_length(ts[l:h]) - self.eval_arc_length(ts[0])
+        traj_d[:, Trajectory.DIST_TO_SF_FWD] = self.get_length() - traj_d[:, Trajectory.DIST_TO_SF_BWD]
+        return rows
+
     def copy(self):
         return copy.deepcopy(self)
 
     def set_control_point(self, idx, coord):
-        self._spl_x.c[idx] = coord[0]
-        self._spl_y.c[idx] = coord[1]
+        idx = idx % len(self._spl_x.c)
+        x, y = np.ravel(coord)[:2]
+        if self._spl_x.c[idx] == x and self._spl_y.c[idx] == y:
+            return
+        self._spl_x.c[idx] = x
+        self._spl_y.c[idx] = y
+        self._dirty_ctrl_pts.add(idx)
+        self.__update_arc_length_table(idx)
+
+    def get_control_point_support(self, idx):
+        """Parameter range in [0, 1] where a control point has an influence.
+
+        Args:
+            idx (int): Index of the control point.
+
+        Returns:
+            tuple: (t_min, t_max).
+        """
+        idx = idx % len(self._spl_x.c)
+        k = self._spl_x.k
+        return max(self._spl_x.t[idx], 0.0), min(self._spl_x.t[idx+k+1], 1.0)
 
     def get_control_point(self, idx):
         return self._spl_x.c[idx], self._spl_y.c[idx]
 
+    def collocation_matrix(self, ts, nu=0):
+        """Sparse matrix of the B-spline basis functions, or of their nu-th derivatives, at the
+        parameters. Multiplied with the control points, it evaluates the spline.
+
+        The derivatives are the basis of the lower degree spline on the inner knots, times the
+        sparse difference operator that maps the control points to its coefficients.
+
+        Args:
+            ts (np.ndarray): M parameters in [0, 1].
+            nu (int, optional): Order of the derivative. Defaults to 0.
+
+        Returns:
+            scipy.sparse.csr_array: M * num_ctrl_pt matrix with at most k + 1 non-zeros per row.
+        """
+        t, k = self._spl_x.t, self._spl_x.k
+        diff = sparse.identity(len(self._spl_x.c), format='csr')
+        for d in range(nu):
+            # c'[i] = (k - d) * (c[i + 1] - c[i]) / (t[i + k + 1] - t[i + 1]) on the knots t[d + 1:-d - 1]
+            kd, td = k - d, t[d:len(t) - d]
+            n = len(td) - kd - 1
+            dt = td[kd + 1:kd + n] - td[1:n]
+            scale = np.divide(kd, dt, out=np.zeros_like(dt), where=dt > 0.0)
+            diff = sparse.diags([-scale, scale], [0, 1], shape=(n - 1, n), format='csr') @ diff
+        basis = BSpline.design_matrix(ts, t[nu:len(t) - nu], k - nu)
+        return sparse.csr_array(basis @ diff)
+
+    def __getstate__(self):
+        # the basis matrices are rebuilt on demand rather than pickled or deep copied
+        state = self.__dict__.copy()
+        state.pop("_basis_cache", None)
+        return state
+
+    def __setstate__(self, state):
+        # splines pickled by older versions lack the attributes added since, which are filled with their defaults
+        state.setdefault("_spl_z", None)
+        state.setdefault("_arc_length_table", None)
+        state.setdefault("_dirty_ctrl_pts", set())
+        state["_basis_cache"] = BSplineBasisCache()
+        self.__dict__.update(state)
+
+    @property
+    def basis_cache(self):
+        return self._basis_cache
+
+    def basis_matrix(self, ts, nu=0):
+        """Cached `collocation_matrix`, valid as long as the knots and the parameters stay the same.
+        Moving control points does not invalidate it.
+
+        Args:
+            ts (np.ndarray): M parameters in [0, 1].
+            nu (int, optional): Order of the derivative. Defaults to 0.
+
+        Returns:
+            scipy.sparse.csr_array: M * num_ctrl_pt matrix. Read only.
+        """
+        return self.basis_cache.get(self, ts, nu)[0]
+
+    def basis_column(self, ts, idx, nu=0):
+        """Values of one basis function, or of its nu-th derivative, at the parameters within
+        the support of its control point, from the cached collocation matrix.
+
+        Args:
+            ts (np.ndarray): M sorted parameters in [0, 1].
+            idx (int): Index of the control point.
+            nu (int, optional): Order of the derivative. Defaults to 0.
+
+        Returns:
+            tuple: (lo, hi, values). The parameters ts[lo:hi] in the support, and the hi - lo values at them.
+        """
+        _, csc = self.basis_cache.get(self, ts, nu)
+        k = self._spl_x.k
+        t = self._spl_x.t
+        lo = np.searchsorted(ts, t[idx], side='left')
+        hi = np.searchsorted(ts, t[idx + k + 1], side='left')
+        values = np.zeros(hi - lo, np.float64)
+        start, end = csc.indptr[idx], csc.indptr[idx + 1]
+        values[csc.indices[start:end] - lo] = csc.data[start:end]
+        return lo, hi, values
+
     def save(f, traj):
         with open(f, "wb") as output_file:
             pickle.dump(traj, output_file)
@@ -254,3 +854,168 @@ class BSplineTrajectory:
     def load(f):
         with open(f, "rb") as input_file:
             return pickle.load(input_file)
+
+    def save_binary(f, traj):
+        """Saves the knots, control points and degree of the spline to a binary container, instead
+        of pickling the whole object."""
+        splines = [traj._spl_x, traj._spl_y] + ([traj._spl_z] if traj._spl_z is not None else [])
+        _save_container(f, "bspline", {"t": traj._spl_x.t, "c": np.vstack([spl.c for spl in splines])},
+                        k=int(traj._spl_x.k))
+
+    def load_binary(f):
+        """Loads a spline saved by `save_binary`. The arc length table and the basis matrices are
+        rebuilt on demand."""
+        header, blocks = _load_container(f, "bspline")
+        traj = BSplineTrajectory.__new__(BSplineTrajectory)
+        t, c, k = blocks["t"], blocks["c"], header["k"]
+        traj._spl_x = BSpline(t, c[0].copy(), k)
+        traj._spl_y = BSpline(t.copy(), c[1].copy(), k)
+        traj._spl_z = BSpline(t.copy(), c[2].copy(), k) if len(c) > 2 else None
+        traj._arc_length_table = None
+        traj._dirty_ctrl_pts = set()
+        traj._basis_cache = BSplineBasisCache()
+        return traj
+
+
+class BSplineBatch:
+    def __init__(self, base: BSplineTrajectory, cx: np.ndarray = None, cy: np.ndarray = None) -> None:
+        """K candidate splines on the knots and degree of one spline, evaluated all at once.
+
+        Every evaluation is one sparse product of a cached collocation matrix with the control
+        points of all candidates, instead of `splev` calls per candidate and coordinate.
+
+        Args:
+            base (BSplineTrajectory): The spline whose knots and degree the candidates share.
+            cx (np.ndarray, optional): K * num_ctrl_pt x of the control points of the candidates.
+                Defaults to those of `base`, as a batch of one.
+            cy (np.ndarray, optional): K * num_ctrl_pt y of the control points of the candidates.
+                Defaults to those of `base`, as a batch of one.
+        """
+        self.base = base
+        # the evaluation grid, the quadrature nodes of the arc length table and those up to the grid
+        self._grid_cache = BSplineBasisCache()
+        self._table_cache = BSplineBasisCache()
+        self._partial_cache = BSplineBasisCache()
+        self.set_control_points(base._spl_x.c if cx is None else cx, base._spl_y.c if cy is None else cy)
+
+    def set_control_points(self, cx: np.ndarray, cy: np.ndarray):
+        """Replaces the candidates, keeping the cached basis matrices.
+
+        Args:
+            cx (np.ndarray): K * num_ctrl_pt x of the control points of the candidates.
+            cy (np.ndarray): K * num_ctrl_pt y of the control points of the candidates.
+        """
+        cx = np.atleast_2d(np.asarray(cx, dtype=np.float64))
+        cy = np.atleast_2d(np.asarray(cy, dtype=np.float64))
+        assert cx.shape == cy.shape and cx.shape[1] == len(self.base._spl_x.c), \
+            "control points should be K * num_ctrl_pt, like those of the base spline"
+        # num_ctrl_pt * 2K, the x of all candidates, then their y
+        self._coeffs = np.hstack([cx.T, cy.T])
+        self._table = None
+
+    def __len__(self):
+        return self._coeffs.shape[1] // 2
+
+    def control_points(self):
+        """The control points of the candidates.
+
+        Returns:
+            tuple: (cx, cy), both K * num_ctrl_pt.
+        """
+        k = len(self)
+        return self._coeffs[:, :k].T, self._coeffs[:, k:].T
+
+    def candidate(self, i: int) -> BSplineTrajectory:
+        """A copy of the base spline with the control points of one candidate."""
+        cx, cy = self.control_points()
+        traj = self.base.copy()
+        moved = np.flatnonzero((traj._spl_x.c != cx[i]) | (traj._spl_y.c != cy[i]))
+        traj._spl_x.c[:] = cx[i]
+        traj._spl_y.c[:] = cy[i]
+        traj._arc_length_table = None
+        traj._dirty_ctrl_pts = traj._dirty_ctrl_pts | set(moved.tolist())
+        return traj
+
+    def __eval(self, cache, ts, der):
+        values = cache.get(self.base, ts, der)[0] @ self._coeffs
+        return values[:, :len(self)].T, values[:, len(self):].T
+
+    def eval(self, ts, der=0):
+        """Positions, or their der-th derivatives, of all candidates.
+
+        Args:
+            ts (np.ndarray): M parameters in [0, 1].
+            der (int, optional): Order of the derivative. Defaults to 0.
+
+        Returns:
+            tuple: (x, y), both K * M.
+        """
+        return self.__eval(self._grid_cache, ts, der)
+
+    def eval_yaw(self, ts):
+        dx, dy = self.eval(ts, 1)
+        return np.arctan2(dy, dx)
+
+    def eval_turn_radius(self, ts):
+        dx, dy = self.eval(ts, 1)
+        d2x, d2y = self.eval(ts, 2)
+        curvature = (dx * d2y - dy * d2x) / np.sqrt((dx ** 2 + dy ** 2) ** 3)
+        return 1.0 / np.abs(curvature)
+
+    def __gauss_legendre(self, t_min, t_max):
+        x, w = np.polynomial.legendre.leggauss(BSplineTrajectory.ARC_LENGTH_ORDER)
+        half = 0.5 * (t_max - t_min)
+        return (half[:, np.newaxis] * (x + 1.0) + t_min[:, np.newaxis]).ravel(), half[:, np.newaxis] * w
+
+    def __lengths(self, cache, t_min, t_max):
+        # K * len(t_min) lengths of the pieces, from the speeds at their quadrature nodes
+        nodes, weights = self.__gauss_legendre(t_min, t_max)
+        d = cache.get(self.base, nodes, 1)[0] @ self._coeffs
+        speed = np.hypot(d[:, :len(self)], d[:, len(self):]).reshape((len(t_min), -1, len(self)))
+        return np.einsum('pok,po->kp', speed, weights)
+
+    def __get_arc_length_table(self):
+        # the pieces of `BSplineTrajectory`, integrated for all candidates at once
+        if self._table is None:
+            knots = self.base._spl_x.t
+            knots = np.unique(knots[(knots >= 0.0) & (knots <= 1.0)])
+            pieces = np.arange(BSplineTrajectory.ARC_LENGTH_PIECES) / BSplineTrajectory.ARC_LENGTH_PIECES
+            breaks = knots[:-1, np.newaxis] + np.diff(knots)[:, np.newaxis] * pieces
+            breaks = np.append(breaks.ravel(), knots[-1])
+            lengths = self.__lengths(self._table_cache, breaks[:-1], breaks[1:])
+            self._table = (breaks, np.hstack([np.zeros((len(self), 1)), np.cumsum(lengths, axis=1)]))
+        return self._table
+
+    def eval_arc_length(self, ts):
+        """Arc lengths from the start of every candidate to each parameter.
+
+        Args:
+            ts (np.ndarray): M parameters in [0, 1].
+
+        Returns:
+            np.ndarray: K * M arc lengths in meter.
+        """
+        breaks, cum_length = self.__get_arc_length_table()
+        ts = np.clip(np.asarray(ts, dtype=np.float64), breaks[0], breaks[-1])
+        i = np.clip(np.searchsorted(breaks, ts, side='right') - 1, 0, len(breaks) - 2)
+        return cum_length[:, i] + self.__lengths(self._partial_cache, breaks[i], ts)
+
+    def get_length(self):
+        """Lengths of the candidates in meter, K."""
+        return self.__get_arc_length_table()[1][:, -1]
+
+    def eval_geometry(self, ts):
+        """What `BSplineTrajectory.sample_along` fills, for all candidates.
+
+        Args:
+            ts (np.ndarray): M parameters in [0, 1], like `Trajectory.ts`.
+
+        Returns:
+            tuple: (x, y, yaw, turn_radius, dist_to_sf_bwd), all K * M.
+        """
+        x, y = self.eval(ts)
+        dx, dy = self.eval(ts, 1)
+        d2x, d2y = self.eval(ts, 2)
+        curvature = (dx * d2y - dy * d2x) / np.sqrt((dx ** 2 + dy ** 2) ** 3)
+        dist = self.eval_arc_length(ts)
+        return x, y, np.arctan2(dy, dx), 1.0 / np.abs(curvature), dist - dist[:, :1]
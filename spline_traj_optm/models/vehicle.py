@@ -15,13 +15,151 @@ class VehicleParams:
     max_jerk: float
 
 
+class VehicleEnvelope:
+    MODELS = ('ellipse', 'diamond', 'polar')
+    NUM_SPEED = 401
+    NUM_ACC = 401
+    NUM_ANGLE = 2881
+
+    def __init__(self, param: VehicleParams, acc_intp, dcc_intp, model='ellipse', polar=None) -> None:
+        """Pre-tabulated GG-V performance envelope with batched queries.
+
+        The lon acc limits of the speed lookups are tabulated over speed, and the boundary
+        of the friction model is tabulated over lon and lat acc. Both are linearly interpolated,
+        and every query accepts arrays of any broadcastable shape.
+
+        Args:
+            param (VehicleParams): Vehicle parameters.
+            acc_intp (callable): Max lon acc at a speed.
+            dcc_intp (callable): Max lon dcc at a speed.
+            model (str, optional): Friction model, one of `VehicleEnvelope.MODELS`. 'ellipse' and
+                'diamond' are normalized by the max lon and lat accs of the parameters, 'polar'
+                uses the measured combined accs. Defaults to 'ellipse'.
+            polar (np.ndarray, optional): M * 2 measured (angle, acc) samples for the 'polar'
+                model, the angle being atan2(lon, lat) in rad. Defaults to None.
+        """
+        if model not in VehicleEnvelope.MODELS:
+            raise ValueError(f"Unknown friction model {model}, expected one of {VehicleEnvelope.MODELS}.")
+        if model == 'polar' and polar is None:
+            raise ValueError("The polar friction model needs the measured polar.")
+        self.param = param
+        self.model = model
+
+        # speed axis
+        self.speeds = np.linspace(0.0, param.max_speed_mps, VehicleEnvelope.NUM_SPEED)
+        self.acc_table = np.asarray(acc_intp(self.speeds), dtype=np.float64)
+        self.dcc_table = np.asarray(dcc_intp(self.speeds), dtype=np.float64)
+
+        # boundary of the friction model in the (lat, lon) plane, counter-clockwise from the left
+        angles = np.linspace(-np.pi, np.pi, VehicleEnvelope.NUM_ANGLE)
+        lat_dir, lon_dir = np.cos(angles), np.sin(angles)
+        # the axes belong to both of their halves
+        lat_dir[np.abs(lat_dir) < 1e-12] = 0.0
+        lon_dir[np.abs(lon_dir) < 1e-12] = 0.0
+        if model == 'polar':
+            polar = np.asarray(polar, dtype=np.float64)
+            radius = np.interp(angles, polar[:, 0], polar[:, 1], period=2.0 * np.pi)
+            lat, lon = radius * lat_dir, radius * lon_dir
+        else:
+            if model == 'ellipse':
+                norm = np.hypot(lat_dir, lon_dir)
+            else:
+                norm = np.abs(lat_dir) + np.abs(lon_dir)
+            lat = lat_dir / norm * np.where(lat_dir >= 0.0, param.max_left_acc_mpss, -param.max_right_acc_mpss)
+            lon = lon_dir / norm * np.where(lon_dir >= 0.0, param.max_lon_acc_mpss, -param.max_lon_dcc_mpss)
+        self.boundary = np.column_stack([lat, lon])
+
+        # lat acc limits over lon acc, and lon acc limits over lat acc, on the boundary samples
+        # which are dense where the boundary is steep
+        left, right = lat >= 0.0, lat <= 0.0
+        up, down = lon >= 0.0, lon <= 0.0
+        self.left_table = self.__tabulate(lon[left], lat[left])
+        self.right_table = self.__tabulate(lon[right], lat[right])
+        self.lon_acc_table = self.__tabulate(lat[up], lon[up])
+        self.lon_dcc_table = self.__tabulate(lat[down], lon[down])
+        num = VehicleEnvelope.NUM_ACC // 2 + 1
+        self.lon_accs = np.concatenate([np.linspace(np.min(lon), 0.0, num), np.linspace(0.0, np.max(lon), num)[1:]])
+
+    def __tabulate(self, x, y):
+        order = np.argsort(x, kind='stable')
+        return x[order], y[order]
+
+    def gg_v(self):
+        """The GG-V table, the lat acc limits at every tabulated speed and lon acc.
+
+        Returns:
+            np.ndarray: NUM_SPEED * NUM_ACC * 2 (left, right) lat acc limits at (`speeds`, `lon_accs`).
+                Lon accs out of the limits at a speed are nan.
+        """
+        table = np.empty((len(self.speeds), len(self.lon_accs), 2))
+        table[:, :, 0], table[:, :, 1] = self.lat_limits(self.lon_accs)
+        out = (self.lon_accs[np.newaxis, :] > self.acc_table[:, np.newaxis]) | \
+            (self.lon_accs[np.newaxis, :] < self.dcc_table[:, np.newaxis])
+        table[out] = np.nan
+        return table
+
+    def lon_limits(self, speed):
+        """Lon acc limits of the speed lookups.
+
+        Args:
+            speed (float or np.ndarray): Speeds in m/s.
+
+        Returns:
+            tuple: (acc, dcc). Max acc (positive) and max dcc (negative).
+        """
+        return np.interp(speed, self.speeds, self.acc_table), np.interp(speed, self.speeds, self.dcc_table)
+
+    def lat_limits(self, lon, speed=None):
+        """Lat acc limits at a lon acc, on the friction model.
+
+        Args:
+            lon (float or np.ndarray): Lon accs, clipped to the envelope (and to the speed lookups if speed is given).
+            speed (float or np.ndarray, optional): Speeds in m/s. Defaults to None.
+
+        Returns:
+            tuple: (left, right). Max left acc (positive) and max right acc (negative).
+        """
+        if speed is not None:
+            acc, dcc = self.lon_limits(speed)
+            lon = np.clip(lon, dcc, acc)
+        return np.interp(lon, *self.left_table), np.interp(lon, *self.right_table)
+
+    def lon_limits_given_lat(self, lat, speed=None):
+        """Lon acc limits at a lat acc, on the friction model and the speed lookups.
+
+        Args:
+            lat (float or np.ndarray): Lat accs, clipped to the envelope.
+            speed (float or np.ndarray, optional): Speeds in m/s. Defaults to None.
+
+        Returns:
+            tuple: (acc, dcc). Max acc (positive) and max dcc (negative).
+        """
+        acc = np.interp(lat, *self.lon_acc_table)
+        dcc = np.interp(lat, *self.lon_dcc_table)
+        if speed is not None:
+            speed_acc, speed_dcc = self.lon_limits(speed)
+            acc, dcc = np.minimum(acc, speed_acc), np.maximum(dcc, speed_dcc)
+        return acc, dcc
+
+    def contains(self, speed, lon, lat, tol=1e-6):
+        """Whether the accs are within the envelope at the speeds.
+
+        Returns:
+            np.ndarray: Mask of the feasible (speed, lon, lat) states.
+        """
+        acc, dcc = self.lon_limits_given_lat(lat, speed)
+        left, right = self.lat_limits(lon)
+        return (lon <= acc + tol) & (lon >= dcc - tol) & (lat <= left + tol) & (lat >= right - tol)
+
+
 class Vehicle:
-    def __init__(self, param: VehicleParams):
+    def __init__(self, param: VehicleParams, model='ellipse', polar=None):
         self.param = param
         self.acc_intp = interpolate.CubicSpline(
             self.param.acc_speed_lookup[:, 0], self.param.acc_speed_lookup[:, 1])
         self.dcc_intp = interpolate.CubicSpline(
             self.param.dcc_speed_lookup[:, 0], self.param.dcc_speed_lookup[:, 1])
+        self.envelope = VehicleEnvelope(self.param, self.acc_intp, self.dcc_intp, model, polar)
 
     def lookup_acc_from_speed(self, speed_mps: float) -> tuple:
         return self.acc_intp(speed_mps)
@@ -1,16 +1,38 @@
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 
-from scipy.interpolate import BSpline
+from scipy import sparse
 from scipy.optimize import LinearConstraint, minimize
-from casadi import *
 import matplotlib.pyplot as plt
 
-from spline_traj_optm.models.trajectory import BSplineTrajectory, Trajectory
+from spline_traj_optm.models.trajectory import BSplineTrajectory, BSplineBasisCache, Trajectory
 from spline_traj_optm.models.vehicle import Vehicle, VehicleParams
 from spline_traj_optm.simulator.simulator import Simulator
 from spline_traj_optm.models.race_track import RaceTrack
 from spline_traj_optm.optimization.visualization import OptimizationVisualizer
+from spline_traj_optm.optimization.qp_solver import QPSolverCache
+from spline_traj_optm.instrumentation.profiler import profiler
+
+# optimizer and spline basis matrices of a worker process in the parallel sweeps
+_worker_optimizer = None
+_worker_basis_cache = None
+
+
+def _init_worker(optimizer):
+    global _worker_optimizer, _worker_basis_cache
+    _worker_optimizer = optimizer
+    _worker_basis_cache = BSplineBasisCache()
+    # hot starts would depend on which QPs a worker happened to solve before
+    _worker_optimizer.qp_solvers = QPSolverCache(hot_start=False)
+
+
+def _solve_min_curvature_qps(args):
+    indices, traj_s, traj_d = args
+    # the splines arrive without their basis matrices, which stay valid across the sweeps
+    traj_s._basis_cache = _worker_basis_cache
+    return [_worker_optimizer.solve_min_curvature_qp(i, traj_s, traj_d) for i in indices]
+
 
 class TrajectoryOptimizer:
     def __init__(self, race_track:RaceTrack, center_line: BSplineTrajectory, vehicle:Vehicle) -> None:
@@ -20,69 +42,73 @@ class TrajectoryOptimizer:
         self.center_line = center_line
         self.vehicle = vehicle
         self.sim = Simulator(self.vehicle)
+        self.qp_solvers = QPSolverCache()
 
     def min_curvature_cost(self, z:np.ndarray, idx:int, traj_s: BSplineTrajectory, traj_d: Trajectory):
+        H, g = self.min_curvature_costs(traj_s, traj_d, [idx], np.reshape(z, (1, 2)))
+        return H[0], g[0]
+
+    def min_curvature_costs(self, traj_s: BSplineTrajectory, traj_d: Trajectory, indices=None, zs=None):
+        """Min curvature QP costs of many control points at once, each with the others fixed.
+
+        Every sample in the support of a control point adds its curvature weights times the
+        basis function values to the cost of the point, which is summed per point from the
+        non-zeros of the cached basis matrix, without any dense M * M diagonals.
+
+        Args:
+            traj_s (BSplineTrajectory): The spline.
+            traj_d (Trajectory): The spline sampled along.
+            indices (np.ndarray, optional): N control point indices. Defaults to all the free ones.
+            zs (np.ndarray, optional): N * 2 control points the costs are taken around. Defaults to the current ones.
+
+        Returns:
+            tuple: (H, g). N * 2 * 2 Hessians and N * 2 gradients.
+        """
         ts = traj_d.ts()
-        k = traj_s._spl_x.k
-        t_start = traj_s._spl_x.t[idx]
-        t_end = traj_s._spl_x.t[idx+k+1]
-        t_mask = (ts >= t_start) & (ts < t_end)
-        ti = ts[t_mask]
-        M = len(ti)
-
-        dTx = traj_s._spl_x.derivative()(ti)
-        dTy = traj_s._spl_y.derivative()(ti)
-        d2Tx= traj_s._spl_x.derivative(2)(ti)
-        d2Ty = traj_s._spl_y.derivative(2)(ti)
-
-        # d2Bj = BSpline.basis_element(traj_s._spl_x.t[idx+1:idx+k+2-1])(ti)
-        # d2Bj1_mask = (ti <= traj_s._spl_x.t[idx+1]) | (ti > traj_s._spl_x.t[idx+k+2-1])
-        # d2Bj[d2Bj1_mask] = 0.0
-
-        # d2Bj1 = BSpline.basis_element(traj_s._spl_x.t[idx+2:idx+k+3-1])(ti)
-        # d2Bj1_mask = (ti <= traj_s._spl_x.t[idx+2]) | (ti > traj_s._spl_x.t[idx+k+3-1])
-        # d2Bj1[d2Bj1_mask] = 0.0
-
-        # d2Bj2 = BSpline.basis_element(traj_s._spl_x.t[idx+3:idx+k+4-1])(ti)
-        # d2Bj2_mask = (ti <= traj_s._spl_x.t[idx+3]) | (ti > traj_s._spl_x.t[idx+k+4-1])
-        # d2Bj2[d2Bj2_mask] = 0.0
-
-        # tj = traj_s._spl_x.t[idx]
-        # tj1 = traj_s._spl_x.t[idx+1]
-        # tj2 = traj_s._spl_x.t[idx+2]
-        # tj4 = traj_s._spl_x.t[idx+4]
-        # tj5 = traj_s._spl_x.t[idx+5]
-        # tj6 = traj_s._spl_x.t[idx+6]
-        # beta_j = 5.0 / (tj5 - tj)
-        # beta_j1 = -5.0 / (tj6 - tj1)
-        # gamma_j = 4.0 / (tj4 - tj) * beta_j
-        # gamma_j1 = 4.0 / (tj5 - tj1) * (beta_j1 - beta_j)
-        # gamma_j2 = -4.0/ (tj6 - tj2) * beta_j1
-
-        # B = d2Bj * gamma_j + d2Bj1 * gamma_j1 + d2Bj2 * gamma_j2
-
-        B = BSpline.basis_element(traj_s._spl_x.t[idx:idx+k+2])(ti, 2)
-
-        Bx = np.column_stack([B, np.zeros(M, B.dtype)])
-        By = np.column_stack([np.zeros(M, B.dtype), B])
-        Fx = d2Tx - Bx @ z
-        Fy = d2Ty - By @ z
-
-        # v = 1/traj_d[t_mask, Trajectory.SPEED]
-        v = np.ones(M, np.float64)
+        if indices is None:
+            _, i_min, i_max = self.periodic_control_point_map(traj_s)
+            indices = np.arange(i_min, i_max)
+        indices = np.asarray(indices, dtype=int)
+        N = len(indices)
+        if zs is None:
+            zs = np.column_stack([traj_s._spl_x.c[indices], traj_s._spl_y.c[indices]])
+
+        # gather the non-zeros of the columns of the control points, segment by segment
+        _, D2 = traj_s.basis_cache.get(traj_s, ts, 2)
+        counts = D2.indptr[indices + 1] - D2.indptr[indices]
+        seg = np.repeat(np.arange(N), counts)
+        offsets = np.repeat(D2.indptr[indices] - (np.cumsum(counts) - counts), counts)
+        nz = np.arange(len(seg)) + offsets
+        rows = D2.indices[nz]
+        B = D2.data[nz]
+
+        # derivatives and curvature weights of the samples in the supports only
+        lo, hi = (np.min(rows), np.max(rows) + 1) if len(rows) > 0 else (0, 0)
+        rows = rows - lo
+        D1 = traj_s.basis_matrix(ts, 1)[lo:hi]
+        D2 = traj_s.basis_matrix(ts, 2)[lo:hi]
+        dTx = D1 @ traj_s._spl_x.c
+        dTy = D1 @ traj_s._spl_y.c
+        d2Tx = D2 @ traj_s._spl_x.c
+        d2Ty = D2 @ traj_s._spl_y.c
+        # v = 1/traj_d[lo:hi, Trajectory.SPEED]
         denom = (dTx ** 2 + dTy ** 2) ** 3
-        Pxx = (dTy ** 2 * v) / denom
-        Pxy = (-2.0 * dTx * dTy * v) / denom
-        Pyy = (dTx ** 2 * v) / denom
-
-        Pxx = np.diag(Pxx)
-        Pxy = np.diag(Pxy)
-        Pyy = np.diag(Pyy)
-
-        # H = 2.0 * (Bx.T @ Pxx @ Bx + By.T @ Pxy @ Bx + By.T @ Pyy @ By)
-        H = 2.0 * (Bx.T @ Pxx @ Bx + By.T @ Pyy @ By)
-        # H[0, 1] = H[1, 0]
-        g = (Fx.T @ Pxx @ Bx + Fy.T @ Pxy @ By + Fy.T @ Pyy @ By) + (Bx.T @ Pxx @ Fx + By.T @ Pxy @ Fx + By.T @ Pyy @ Fy).T
+        Pxx = (dTy ** 2 / denom)[rows]
+        Pxy = (-2.0 * dTx * dTy / denom)[rows]
+        Pyy = (dTx ** 2 / denom)[rows]
+
+        # the second derivatives without the contributions of the control points
+        Fx = d2Tx[rows] - B * zs[seg, 0]
+        Fy = d2Ty[rows] - B * zs[seg, 1]
+
+        # H = 2.0 * (Bx.T @ Pxx @ Bx + By.T @ Pyy @ By), with Bx = [B, 0] and By = [0, B]
+        H = np.zeros((N, 2, 2), np.float64)
+        H[:, 0, 0] = 2.0 * np.bincount(seg, Pxx * B * B, N)
+        H[:, 1, 1] = 2.0 * np.bincount(seg, Pyy * B * B, N)
+        # g = (Fx.T @ Pxx @ Bx + Fy.T @ Pxy @ By + Fy.T @ Pyy @ By) + (Bx.T @ Pxx @ Fx + By.T @ Pxy @ Fx + By.T @ Pyy @ Fy).T
+        g = np.zeros((N, 2), np.float64)
+        g[:, 0] = 2.0 * np.bincount(seg, Pxx * B * Fx, N)
+        g[:, 1] = np.bincount(seg, Pxy * B * (Fx + Fy), N) + 2.0 * np.bincount(seg, Pyy * B * Fy, N)
         return H, g
 
     def joint_min_curvature_cost(self, traj_s: BSplineTrajectory, traj_d: Trajectory, start_idx=None, span=None):
@@ -99,13 +125,10 @@ class TrajectoryOptimizer:
             i_max = start_idx + span
         N = i_max - i_min
         joint_H = np.zeros((N * 2, N * 2), np.float64)
-        joint_g = np.zeros(N * 2, np.float64)
-        for i in range(i_min, i_max):
-            j = i - i_min
-            z0 = np.array(traj_s.get_control_point(i))
-            H, g = self.min_curvature_cost(z0, i, traj_s, traj_d)
+        Hs, gs = self.min_curvature_costs(traj_s, traj_d, np.arange(i_min, i_max))
+        for j, H in enumerate(Hs):
             joint_H[2*j:2*j+2, 2*j:2*j+2] = H
-            joint_g[2*j:2*j+2] = g
+        joint_g = gs.reshape((-1,))
             
         return joint_H, joint_g
 
@@ -115,7 +138,6 @@ class TrajectoryOptimizer:
         ignore_front = ignore_ctrl_pt // 2
         ignore_rear = ignore_ctrl_pt - ignore_front
         ts = traj_d.ts()
-        k = traj_s._spl_x.k
 
         if start_idx is None:
             i_min = ignore_front
@@ -131,18 +153,10 @@ class TrajectoryOptimizer:
 
         for i in range(i_min, i_max):
             j = i - i_min
-            t_start = traj_s._spl_x.t[i]
-            t_end = traj_s._spl_x.t[i+k+1]
-            t_mask = (ts >= t_start) & (ts < t_end)
-            ti = ts[t_mask]
-            slice_start = np.argmax(t_mask)
-            slice_end = np.argmax(np.invert(t_mask[slice_start:])) + slice_start
-            if slice_end == slice_start:
-                slice_end = len(t_mask)
-            b = BSpline.basis_element(traj_s._spl_x.t[i:i+k+2])
-            A = joint_A[slice_start*2:slice_end*2, j*2:j*2+2]
-            A[0::2, 0] = b(ti)
-            A[1::2, 1] = b(ti)
+            lo, hi, b = traj_s.basis_column(ts, i)
+            A = joint_A[lo*2:hi*2, j*2:j*2+2]
+            A[0::2, 0] = b
+            A[1::2, 1] = b
             z[2*j:2*j+2] = np.array(traj_s.get_control_point(i))
             
         non_z = traj_d[:, :2] - (joint_A @ z).reshape((-1, 2))
@@ -182,23 +196,16 @@ class TrajectoryOptimizer:
                 if k >= i_max:
                     k = k - i_max + i_min
 
-                H, g = self.joint_min_curvature_cost(traj_out_s, traj_out_d, k, span)
-                A, lba, uba = self.joint_track_constraint(traj_out_s, traj_out_d, k, span)
-
-                DM_H = DM(H)
-                DM_A = DM(A)
-                qp = {
-                    'h': DM_H.sparsity(),
-                    'a': DM_A.sparsity(),
-                }
-                opts = {'printLevel': 'none'}
-                qp_solver = conic('solver','qpoases', qp, opts)
+                with profiler().phase("qp_build"):
+                    H, g = self.joint_min_curvature_cost(traj_out_s, traj_out_d, k, span)
+                    A, lba, uba = self.joint_track_constraint(traj_out_s, traj_out_d, k, span)
+
                 try:
-                    r = qp_solver(h=DM_H, g=DM(g), a=DM_A, lba=DM(lba), uba=DM(uba))
+                    r = self.qp_solvers.solve(H, g, A, lba, uba)
                     new_zs = np.array(r['x'])
                     new_zs = new_zs.reshape((-1, 2))
-                    for j, new_z in enumerate(new_zs):
-                        traj_out_s.set_control_point(k+j, new_z)
+                    for m, new_z in enumerate(new_zs):
+                        traj_out_s.set_control_point(k+m, new_z)
                     traj_out_s.set_control_point(0, traj_out_s.get_control_point(-5))
                     traj_out_s.set_control_point(1, traj_out_s.get_control_point(-4))
                     traj_out_s.set_control_point(-3, traj_out_s.get_control_point(2))
@@ -213,33 +220,172 @@ class TrajectoryOptimizer:
                     print(e)
                     pass
 
+            print(self.qp_solvers)
+            self.qp_solvers.reset_stats()
+            profiler().progress(optimizer="joint_min_curvature_qp", iteration=j+1, lap_time=traj_out_d[0, Trajectory.TIME])
             if (visualize):
                 visualizer.visualize(traj_out_s, traj_out_d)
 
         visualizer.visualize(traj_out_s, traj_out_d)
         return traj_out_s 
         
+    def periodic_control_point_map(self, traj_s: BSplineTrajectory):
+        """Sparse map from the free control points of the closed spline to all of them,
+        including the copies that wrap around the start.
+
+        Args:
+            traj_s (BSplineTrajectory): The spline.
+
+        Returns:
+            tuple: (W, i_min, i_max). num_ctrl_pt * (i_max - i_min) 0-1 matrix in CSR format,
+                and the range of the free control points.
+        """
+        num_ctrl_pt = len(traj_s._spl_x.c)
+        k = traj_s._spl_x.k
+        i_min = k // 2
+        i_max = num_ctrl_pt - (k - k // 2)
+        num_free = i_max - i_min
+        rows = np.arange(num_ctrl_pt)
+        cols = (rows - i_min) % num_free
+        W = sparse.csr_array((np.ones(num_ctrl_pt), (rows, cols)), shape=(num_ctrl_pt, num_free))
+        return W, i_min, i_max
+
+    def global_min_curvature_cost(self, traj_s: BSplineTrajectory, traj_d: Trajectory):
+        """Curvature cost of all the free control points at once, the sum of the squared curvatures
+        at `traj_d.ts()` with the first derivatives fixed at the current spline.
+
+        The variables are interleaved (x, y) pairs of the free control points. As every sample only
+        depends on k + 1 control points, H is banded with the periodic wrap in its corners.
+
+        Args:
+            traj_s (BSplineTrajectory): The spline.
+            traj_d (Trajectory): The spline sampled along.
+
+        Returns:
+            tuple: (H, g). 2P * 2P sparse Hessian in CSC format, normalized to a max of 1, and the zero gradient.
+        """
+        ts = traj_d.ts()
+        W, i_min, i_max = self.periodic_control_point_map(traj_s)
+        B = traj_s.basis_matrix(ts, 2) @ W
+        D1 = traj_s.basis_matrix(ts, 1)
+        dTx = D1 @ traj_s._spl_x.c
+        dTy = D1 @ traj_s._spl_y.c
+
+        # curvature = (dTx * d2Ty - dTy * d2Tx) / |dT| ** 3, linear in the control points
+        w = 1.0 / (dTx ** 2 + dTy ** 2) ** 3
+        Hxx = B.T @ sparse.diags(w * dTy ** 2) @ B
+        Hxy = B.T @ sparse.diags(-w * dTx * dTy) @ B
+        Hyy = B.T @ sparse.diags(w * dTx ** 2) @ B
+        H = (sparse.kron(Hxx, [[1.0, 0.0], [0.0, 0.0]])
+             + sparse.kron(Hxy, [[0.0, 1.0], [1.0, 0.0]])
+             + sparse.kron(Hyy, [[0.0, 0.0], [0.0, 1.0]]))
+        # the scale does not change the minimizer but keeps the solver tolerances meaningful
+        H = sparse.csc_array((H + H.T) / np.max(np.abs(H.data)))
+        H.eliminate_zeros()
+        g = np.zeros(H.shape[0], np.float64)
+        return H, g
+
+    def global_track_constraint(self, traj_s: BSplineTrajectory, traj_d: Trajectory):
+        """Track constraint of all the free control points at once, keeping every sample at
+        `traj_d.ts()` within the box of its boundary points.
+
+        Args:
+            traj_s (BSplineTrajectory): The spline.
+            traj_d (Trajectory): The spline sampled along, with the boundaries filled.
+
+        Returns:
+            tuple: (A, lba, uba). 2M * 2P sparse matrix in CSC format with k + 1 non-zeros per row, and its bounds.
+        """
+        ts = traj_d.ts()
+        W, i_min, i_max = self.periodic_control_point_map(traj_s)
+        A = sparse.csc_array(sparse.kron(traj_s.basis_matrix(ts) @ W, sparse.identity(2)))
+        A.eliminate_zeros()
+
+        left_x = traj_d[:, Trajectory.LEFT_BOUND_X]
+        left_y = traj_d[:, Trajectory.LEFT_BOUND_Y]
+        right_x = traj_d[:, Trajectory.RIGHT_BOUND_X]
+        right_y = traj_d[:, Trajectory.RIGHT_BOUND_Y]
+        min_bound = np.empty(2 * len(ts), dtype=left_x.dtype)
+        min_bound[0::2] = np.minimum(left_x, right_x)
+        min_bound[1::2] = np.minimum(left_y, right_y)
+        max_bound = np.empty(2 * len(ts), dtype=left_x.dtype)
+        max_bound[0::2] = np.maximum(left_x, right_x)
+        max_bound[1::2] = np.maximum(left_y, right_y)
+        return A, min_bound, max_bound
+
+    def run_global_min_curvature_qp(self, traj_in_s: BSplineTrajectory, traj_in_d: Trajectory, max_iter=3, visualize=False):
+        """Moves all the control points at once to minimize the curvature within the track, solving
+        one sparse QP of the whole lap per iteration.
+
+        Args:
+            traj_in_s (BSplineTrajectory): Initial spline.
+            traj_in_d (Trajectory): Initial spline sampled with speeds.
+            max_iter (int, optional): Number of QPs, each linearized at the previous solution. Defaults to 3.
+            visualize (bool, optional): Plot every iteration. Defaults to False.
+
+        Returns:
+            BSplineTrajectory: The optimized spline.
+        """
+        traj_out_s = traj_in_s.copy()
+        traj_out_d = traj_in_d.copy()
+        self.track.fill_trajectory_boundaries(traj_out_d)
+        qp_solvers = QPSolverCache(plugin='osqp')
+
+        visualizer = OptimizationVisualizer(self.track, traj_in_s, traj_in_d)
+
+        for j in range(max_iter):
+            W, i_min, i_max = self.periodic_control_point_map(traj_out_s)
+            with profiler().phase("qp_build"):
+                H, g = self.global_min_curvature_cost(traj_out_s, traj_out_d)
+                A, lba, uba = self.global_track_constraint(traj_out_s, traj_out_d)
+            z0 = np.column_stack([traj_out_s._spl_x.c[i_min:i_max], traj_out_s._spl_y.c[i_min:i_max]]).reshape((-1,))
+            print(f"Global QP: {len(z0)} variables, {A.shape[0]} constraints, {H.nnz + A.nnz} non-zeros.")
+            # solve for the steps of the control points, which are much better scaled than the coordinates
+            Az0 = A @ z0
+            try:
+                r = qp_solvers.solve(H, g + H @ z0, A, lba - Az0, uba - Az0, np.zeros_like(z0))
+            except Exception as e:
+                print(e)
+                break
+            print(qp_solvers)
+            print(traj_out_s.basis_cache)
+            zs = W @ (z0 + np.array(r['x']).reshape((-1,))).reshape((-1, 2))
+            for i, z in enumerate(zs):
+                traj_out_s.set_control_point(i, z)
+
+            new_traj_out_d = traj_out_s.sample_along(ts = traj_out_d.ts())
+            new_traj_out_d[:, Trajectory.SPEED] = traj_out_d[:, Trajectory.SPEED]
+            self.track.fill_trajectory_boundaries(new_traj_out_d)
+            traj_out_d = new_traj_out_d
+
+            if (visualize):
+                visualizer.visualize(traj_out_s, traj_out_d)
+            sim_result = self.sim.run_simulation(traj_out_d, enable_vis=visualize)
+            print(f"Iteration {j+1}")
+            print(sim_result)
+            profiler().progress(optimizer="global_min_curvature_qp", iteration=j+1, lap_time=sim_result.total_time)
+            traj_out_d = sim_result.trajectory
+            self.track.fill_trajectory_boundaries(traj_out_d)
+
+        visualizer.visualize(traj_out_s, traj_out_d)
+        return traj_out_s
+
     def track_constraint(self, idx:int, traj_s: BSplineTrajectory, traj_d: Trajectory):
         ts = traj_d.ts()
-        k = traj_s._spl_x.k
-        t_start = traj_s._spl_x.t[idx]
-        t_end = traj_s._spl_x.t[idx+k+1]
-        t_mask = (ts >= t_start) & (ts < t_end)
-        ti = ts[t_mask]
-        M = len(ti)
+        lo, hi, b = traj_s.basis_column(ts, idx)
+        rows = slice(lo, hi)
+        M = hi - lo
 
-        b_x = BSpline.basis_element(traj_s._spl_x.t[idx:idx+k+2])
-        b_y = BSpline.basis_element(traj_s._spl_y.t[idx:idx+k+2])
-        bi = np.column_stack([b_x(ti), b_y(ti)])
+        bi = np.column_stack([b, b])
 
         old_z = np.array(traj_s.get_control_point(idx))
-        non_z = traj_d[t_mask, :2] - bi * old_z[np.newaxis, :]
+        non_z = traj_d[rows, :2] - bi * old_z[np.newaxis, :]
 
         # find the boundries
-        left_x = traj_d[t_mask, Trajectory.LEFT_BOUND_X]
-        left_y = traj_d[t_mask, Trajectory.LEFT_BOUND_Y]
-        right_x = traj_d[t_mask, Trajectory.RIGHT_BOUND_X]
-        right_y = traj_d[t_mask, Trajectory.RIGHT_BOUND_Y]
+        left_x = traj_d[rows, Trajectory.LEFT_BOUND_X]
+        left_y = traj_d[rows, Trajectory.LEFT_BOUND_Y]
+        right_x = traj_d[rows, Trajectory.RIGHT_BOUND_X]
+        right_y = traj_d[rows, Trajectory.RIGHT_BOUND_Y]
         min_bound = np.empty(2 * M, dtype=left_x.dtype)
         min_bound[0::2] = np.minimum(left_x, right_x) - non_z[:, 0]
         min_bound[1::2] = np.minimum(left_y, right_y) - non_z[:, 1]
@@ -249,11 +395,135 @@ class TrajectoryOptimizer:
 
         # find the A matrix
         A = np.zeros((2 * M, 2), dtype=left_x.dtype)
-        A[0::2, 0] = b_x(ti)
-        A[1::2, 1] = b_y(ti)
+        A[0::2, 0] = b
+        A[1::2, 1] = b
         return A, min_bound, max_bound
 
-    def run_min_curvature_qp(self, traj_in_s: BSplineTrajectory, traj_in_d: Trajectory, visualize=False, max_iter=5):
+    def solve_min_curvature_qp(self, idx: int, traj_s: BSplineTrajectory, traj_d: Trajectory):
+        """Solves the min curvature QP of one control point, without moving it.
+
+        Args:
+            idx (int): Index of the control point.
+            traj_s (BSplineTrajectory): The spline.
+            traj_d (Trajectory): The spline sampled at `traj_d.ts()`, with the boundaries filled.
+
+        Returns:
+            np.ndarray: The new control point, or None if the QP failed.
+        """
+        z0 = np.array(traj_s.get_control_point(idx))
+        with profiler().phase("qp_build"):
+            H, g = self.min_curvature_cost(z0, idx, traj_s, traj_d)
+            A, lba, uba = self.track_constraint(idx, traj_s, traj_d)
+        try:
+            r = self.qp_solvers.solve(H, g, A, lba, uba)
+        except Exception:
+            # the reason is recorded by the solver cache
+            return None
+        return np.array(r['x']).reshape((-1,))
+
+    def __wrap_control_points(self, traj_s: BSplineTrajectory):
+        traj_s.set_control_point(0, traj_s.get_control_point(-5))
+        traj_s.set_control_point(1, traj_s.get_control_point(-4))
+        traj_s.set_control_point(-3, traj_s.get_control_point(2))
+        traj_s.set_control_point(-2, traj_s.get_control_point(3))
+        traj_s.set_control_point(-1, traj_s.get_control_point(4))
+
+    def color_control_points(self, i_min: int, i_max: int, k: int):
+        """Colors the control points so that the ones of a color are more than k apart
+        around the closed spline, and have disjoint supports.
+
+        Args:
+            i_min (int): First control point to color.
+            i_max (int): End of the control points to color, which wrap around to `i_min`.
+            k (int): Degree of the spline.
+
+        Returns:
+            list: Arrays of the control point indices of every color.
+        """
+        num = i_max - i_min
+        num_colors = min(k + 1, num)
+        pos = np.arange(num)
+        colors = pos % num_colors
+        # the control points after the last full round would be too close to the first ones
+        tail = pos >= num - num % num_colors
+        colors[tail] = num_colors + pos[tail] % num_colors
+        return [pos[colors == c] + i_min for c in np.unique(colors)]
+
+    def __run_parallel_min_curvature_qp(self, traj_out_s: BSplineTrajectory, traj_out_d: Trajectory, visualizer, visualize, max_iter, num_workers, seed):
+        rng = np.random.default_rng(seed)
+        k = traj_out_s._spl_x.k
+        i_min = k // 2
+        i_max = len(traj_out_s._spl_x.c) - (k - k // 2)
+        colors = self.color_control_points(i_min, i_max, k)
+
+        def sweep(executor, color, ts, td):
+            chunks = [c for c in np.array_split(color, num_workers) if len(c) > 0]
+            num_success = 0
+            results = executor.map(_solve_min_curvature_qps, [(chunk, ts, td) for chunk in chunks])
+            # merge in index order, independently of the worker timing
+            for chunk, new_zs in zip(chunks, results):
+                for i, new_z in zip(chunk, new_zs):
+                    if new_z is not None:
+                        ts.set_control_point(i, new_z)
+                        num_success += 1
+            # the workers do not report to the profiler, so only their failures are counted
+            profiler().count("worker_qp_failed", sum(len(c) for c in chunks) - num_success)
+            self.__wrap_control_points(ts)
+            rows = ts.resample_dirty(td)
+            self.track.fill_trajectory_boundaries(td, rows)
+            return num_success
+
+        with ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=(self,)) as executor:
+            for j in range(max_iter):
+                c_start = rng.integers(len(colors))
+                print(f'Starting from color {c_start} of {len(colors)}.')
+
+                new_traj_out_d = traj_out_s.sample_along(ts = traj_out_d.ts())
+                new_traj_out_d[:, Trajectory.SPEED] = traj_out_d[:, Trajectory.SPEED]
+                self.track.fill_trajectory_boundaries(new_traj_out_d)
+                traj_out_d = new_traj_out_d
+
+                order = [(c_start + c) % len(colors) for c in range(len(colors))]
+                num_success = 0
+                for c in order:
+                    num_success += sweep(executor, colors[c], traj_out_s, traj_out_d)
+                print(f"Forward pass: number of control points successfully updated: {num_success}")
+                num_forward = num_success
+                num_success = 0
+                for c in reversed(order):
+                    num_success += sweep(executor, colors[c], traj_out_s, traj_out_d)
+                print(f"Backward pass: number of control points successfully updated: {num_success}")
+                num_success += num_forward
+
+                if (visualize):
+                    visualizer.visualize(traj_out_s, traj_out_d)
+                sim_result = self.sim.run_simulation(traj_out_d, enable_vis=visualize)
+                print(f"Iteration {j+1}")
+                print(sim_result)
+                profiler().progress(optimizer="min_curvature_qp", iteration=j+1, lap_time=sim_result.total_time,
+                                    num_success=num_success)
+                traj_out_d = sim_result.trajectory
+
+        sim_result = self.sim.run_simulation(traj_out_d, enable_vis=True)
+        print(sim_result)
+        visualizer.visualize(traj_out_s, traj_out_d)
+        return traj_out_s
+
+    def run_min_curvature_qp(self, traj_in_s: BSplineTrajectory, traj_in_d: Trajectory, visualize=False, max_iter=5, num_workers=None, seed=None):
+        """Moves the control points one by one to minimize the curvature within the track.
+
+        Args:
+            traj_in_s (BSplineTrajectory): Initial spline.
+            traj_in_d (Trajectory): Initial spline sampled with speeds.
+            visualize (bool, optional): Plot every iteration. Defaults to False.
+            max_iter (int, optional): Number of forward and backward sweeps. Defaults to 5.
+            num_workers (int, optional): If given, solve the control points of one color at a
+                time, in parallel on this many processes. Defaults to None, sweeping them serially.
+            seed (int, optional): Seed of the starting colors of the parallel sweeps. Defaults to None.
+
+        Returns:
+            BSplineTrajectory: The optimized spline.
+        """
         traj_out_s = traj_in_s.copy()
         traj_out_d = traj_in_d.copy()
         self.track.fill_trajectory_boundaries(traj_out_d)
@@ -261,36 +531,18 @@ class TrajectoryOptimizer:
         visualizer = OptimizationVisualizer(self.track, traj_in_s, traj_in_d)
 
         def optimize(i, ts, td):
-            z0 = np.array(ts.get_control_point(i))
-            H, g = self.min_curvature_cost(z0, i, ts, td)
-            A, lba, uba = self.track_constraint(i, ts, td)
-
-            DM_H = DM(H)
-            DM_A = DM(A)
-            qp = {
-                'h': DM_H.sparsity(),
-                'a': DM_A.sparsity(),
-            }
-            opts = {'printLevel': 'none'}
-            qp_solver = conic('solver','qpoases', qp, opts)
-            try:
-                r = qp_solver(h=DM_H, g=DM(g), a=DM_A, lba=DM(lba), uba=DM(uba))
-                new_z = np.array(r['x'])
-
-                ts.set_control_point(i, new_z)
-                ts.set_control_point(0, ts.get_control_point(-5))
-                ts.set_control_point(1, ts.get_control_point(-4))
-                ts.set_control_point(-3, ts.get_control_point(2))
-                ts.set_control_point(-2, ts.get_control_point(3))
-                ts.set_control_point(-1, ts.get_control_point(4))
-                new_td = ts.sample_along(ts = td.ts())
-                new_td[:, Trajectory.SPEED] = td[:, Trajectory.SPEED]
-                self.track.fill_trajectory_boundaries(new_td)
-                td = new_td
-                return ts, td
-            except Exception as e:
-                # print(e)
+            new_z = self.solve_min_curvature_qp(i, ts, td)
+            if new_z is None:
                 return None, None
+            ts.set_control_point(i, new_z)
+            self.__wrap_control_points(ts)
+            # only the knot spans of the moved control points need resampling
+            rows = ts.resample_dirty(td)
+            self.track.fill_trajectory_boundaries(td, rows)
+            return ts, td
+
+        if num_workers is not None:
+            return self.__run_parallel_min_curvature_qp(traj_out_s, traj_out_d, visualizer, visualize, max_iter, num_workers, seed)
 
         for j in range(max_iter):
             num_ctrl_pt = len(traj_out_s._spl_x.c)
@@ -302,6 +554,13 @@ class TrajectoryOptimizer:
             i_min = ignore_front
             i_start = np.random.randint(i_min, i_max)
             print(f'Starting from {i_start}-th control point.')
+
+            # every pass starts from a freshly sampled trajectory, which each step then patches
+            new_traj_out_d = traj_out_s.sample_along(ts = traj_out_d.ts())
+            new_traj_out_d[:, Trajectory.SPEED] = traj_out_d[:, Trajectory.SPEED]
+            self.track.fill_trajectory_boundaries(new_traj_out_d)
+            traj_out_d = new_traj_out_d
+
             for i in tqdm(range(i_max - i_min)):
                 k = i + i_start
                 if k >= i_max:
@@ -312,6 +571,9 @@ class TrajectoryOptimizer:
                     traj_out_s = new_traj_out_s
                     traj_out_d = new_traj_out_d
             print(f"Forward pass: number of control points successfully updated: {num_success}")
+            print(self.qp_solvers)
+            self.qp_solvers.reset_stats()
+            num_forward = num_success
             num_success = 0
             for i in tqdm(range(i_max - i_min, 0, -1)):
                 k = i + i_start
@@ -323,6 +585,10 @@ class TrajectoryOptimizer:
                     traj_out_s = new_traj_out_s
                     traj_out_d = new_traj_out_d
             print(f"Backward pass: number of control points successfully updated: {num_success}")
+            print(self.qp_solvers)
+            self.qp_solvers.reset_stats()
+            num_success += num_forward
+            print(traj_out_s.basis_cache)
 
             # traj_out_s = BSplineTrajectory(traj_out_d[:, :2], s=50.0, k=5)
             # traj_out_d = traj_out_s.sample_along(3.0)
@@ -333,6 +599,8 @@ class TrajectoryOptimizer:
             sim_result = self.sim.run_simulation(traj_out_d, enable_vis=visualize)
             print(f"Iteration {j+1}")
             print(sim_result)
+            profiler().progress(optimizer="min_curvature_qp", iteration=j+1, lap_time=sim_result.total_time,
+                                num_success=num_success)
             traj_out_d = sim_result.trajectory
 
         sim_result = self.sim.run_simulation(traj_out_d, enable_vis=True)
@@ -506,7 +774,7 @@ class TrajectoryOptimizer:
     #     bi = np.column_stack([b_x(ti), b_y(ti)])
 
     #     old_z = np.array(traj_s.get_control_point(idx))
-    #     non_z = traj_d[t_mask, :2] - bi * old_z[np.newaxis, :]
+    #     non_z = traj_d[rows, :2] - bi * old_z[np.newaxis, :]
 
     #     # find the boundries
     #     left_x = self.left_bound._spl_x(ti)
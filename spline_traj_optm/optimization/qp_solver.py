@@ -0,0 +1,124 @@
+import time
+import numpy as np
+from scipy import sparse
+from casadi import DM, Sparsity, conic
+
+from spline_traj_optm.instrumentation.profiler import profiler
+
+
+def to_dm(M):
+    """Converts a dense array or a scipy sparse matrix to a CasADi DM, keeping the sparsity."""
+    if sparse.issparse(M):
+        M = sparse.csc_array(M)
+        M.sort_indices()
+        sp = Sparsity(M.shape[0], M.shape[1], M.indptr.tolist(), M.indices.tolist())
+        return DM(sp, M.data.astype(np.float64))
+    return DM(M)
+
+
+class QPSolverCache:
+    DEFAULT_OPTS = {
+        'qpoases': {'printLevel': 'none'},
+        'osqp': {'osqp': {'verbose': False, 'polish': True}},
+    }
+
+    def __init__(self, plugin='qpoases', opts=None, hot_start=True) -> None:
+        """Reusable CasADi QP solvers, one per (H, A) sparsity pattern.
+
+        CasADi keeps the qpOASES instance in the memory of the solver function, so calling a
+        cached solver again hot starts from the working set of its previous solve.
+
+        Args:
+            plugin (str, optional): CasADi conic plugin. Defaults to 'qpoases'.
+            opts (dict, optional): Solver options. Defaults to `DEFAULT_OPTS` of the plugin.
+            hot_start (bool, optional): Reuse the solvers. When False, a new solver is built
+                for every problem, which always cold starts. Defaults to True.
+        """
+        self.plugin = plugin
+        self.opts = self.DEFAULT_OPTS.get(plugin, {}) if opts is None else opts
+        self.hot_start = hot_start
+        self._solvers = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_built = 0
+        self.build_time = 0.0
+        self.num_solved = 0
+        self.num_failed = 0
+        self.solve_time = 0.0
+
+    def __len__(self):
+        return len(self._solvers)
+
+    def __key(self, DM_H: DM, DM_A: DM):
+        def pattern(sp):
+            return (sp.size1(), sp.size2(), tuple(sp.colind()), tuple(sp.row()))
+        return pattern(DM_H.sparsity()), pattern(DM_A.sparsity())
+
+    def get_solver(self, DM_H: DM, DM_A: DM):
+        key = self.__key(DM_H, DM_A)
+        qp_solver = self._solvers.get(key) if self.hot_start else None
+        if qp_solver is None:
+            start = time.perf_counter()
+            qp = {
+                'h': DM_H.sparsity(),
+                'a': DM_A.sparsity(),
+            }
+            qp_solver = conic('solver', self.plugin, qp, self.opts)
+            duration = time.perf_counter() - start
+            self.build_time += duration
+            profiler().add_time('qp_solver_build', duration)
+            self.num_built += 1
+            if self.hot_start:
+                self._solvers[key] = qp_solver
+        return key, qp_solver
+
+    def __failure_reason(self, qp_solver, error):
+        # the status of a failed solve says more than the error of the CasADi call
+        try:
+            stats = qp_solver.stats()
+        except RuntimeError:
+            return error
+        if stats.get('success', True) or 'return_status' not in stats:
+            return error
+        return f"{self.plugin}: {stats['return_status']}"
+
+    def solve(self, H, g, A, lba, uba, x0=None):
+        """Solves min 0.5 x'Hx + g'x s.t. lba <= Ax <= uba.
+
+        H and A can be dense arrays or scipy sparse matrices, whose sparsity is kept.
+        The initial guess x0 is only used by the solvers that warm start from it, like OSQP.
+
+        Raises the solver error on failure, like calling the CasADi solver directly.
+        A solver that failed is dropped, so the next problem of its shape cold starts.
+
+        Returns:
+            dict: The CasADi solver output.
+        """
+        DM_H = to_dm(H)
+        DM_A = to_dm(A)
+        key, qp_solver = self.get_solver(DM_H, DM_A)
+        start = time.perf_counter()
+        try:
+            args = dict(h=DM_H, g=DM(g), a=DM_A, lba=DM(lba), uba=DM(uba))
+            if x0 is not None:
+                args['x0'] = DM(x0)
+            r = qp_solver(**args)
+        except Exception as e:
+            self.num_failed += 1
+            self._solvers.pop(key, None)
+            profiler().failure('qp_solve', self.__failure_reason(qp_solver, e))
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.solve_time += duration
+            profiler().add_time('qp_solve', duration)
+        self.num_solved += 1
+        return r
+
+    def __str__(self):
+        return str(
+            f"QP solvers built: {self.num_built} ({self.build_time:.3f} s), "
+            f"solves: {self.num_solved} ok / {self.num_failed} failed ({self.solve_time:.3f} s), "
+            f"cached: {len(self)}"
+        )
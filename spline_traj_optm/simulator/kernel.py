@@ -0,0 +1,188 @@
+from math import sqrt
+import numpy as np
+
+from spline_traj_optm.models.trajectory import Trajectory
+
+try:
+    from numba import njit
+    JIT_AVAILABLE = True
+except ImportError:
+    JIT_AVAILABLE = False
+
+# the kernel works on a scratch array of only the trajectory columns it reads and writes, in this order
+KERNEL_COLUMNS = (
+    Trajectory.X, Trajectory.Y, Trajectory.SPEED, Trajectory.CURVATURE, Trajectory.BANK,
+    Trajectory.LON_ACC, Trajectory.LAT_ACC, Trajectory.IDX, Trajectory.ITERATION_FLAG,
+)
+X, Y, SPEED, CURVATURE, BANK, LON_ACC, LAT_ACC, IDX, ITERATION_FLAG = range(len(KERNEL_COLUMNS))
+# the scratch columns the kernel writes
+KERNEL_OUTPUT_COLUMNS = (SPEED, LON_ACC, LAT_ACC, ITERATION_FLAG)
+
+
+def to_kernel_points(trajectory: Trajectory):
+    """Gathers the columns of `KERNEL_COLUMNS` into a new N * 9 scratch array for the kernel."""
+    points = np.empty((len(trajectory), len(KERNEL_COLUMNS)), dtype=np.float64)
+    for i, col in enumerate(KERNEL_COLUMNS):
+        points[:, i] = trajectory[:, col]
+    return points
+
+
+def from_kernel_points(trajectory: Trajectory, points: np.ndarray):
+    """Writes the columns of `KERNEL_OUTPUT_COLUMNS` of a scratch array back to the trajectory."""
+    for i in KERNEL_OUTPUT_COLUMNS:
+        trajectory[:, KERNEL_COLUMNS[i]] = points[:, i]
+
+
+def eval_ppoly(breaks: np.ndarray, coeffs: np.ndarray, x: float):
+    """Evaluates a tabulated piecewise polynomial the same way as `scipy.interpolate.PPoly`,
+    extrapolating with the first and the last pieces.
+
+    Args:
+        breaks (np.ndarray): M break points, `PPoly.x`.
+        coeffs (np.ndarray): K * (M - 1) coefficients, highest order first, `PPoly.c`.
+        x (float): Point to evaluate at.
+
+    Returns:
+        float: The polynomial value.
+    """
+    i = np.searchsorted(breaks, x, side='right') - 1
+    i = min(max(i, 0), len(breaks) - 2)
+    s = x - breaks[i]
+    res = 0.0
+    z = 1.0
+    k = coeffs.shape[0]
+    for kp in range(k):
+        res = res + coeffs[k - kp - 1, i] * z
+        z *= s
+    return res
+
+
+def make_propagate_fronts(eval_ppoly):
+    """Builds the front propagation kernel around an evaluator of the speed lookups, so the
+    compiled kernel calls a compiled evaluator and the Python kernel stays plain Python.
+
+    Args:
+        eval_ppoly (function): Evaluator of the lookups, with the arguments of `eval_ppoly`.
+
+    Returns:
+        function: The kernel, see `propagate_fronts`.
+    """
+    def propagate_fronts(points: np.ndarray, flags: np.ndarray, backward: bool,
+                         acc_breaks: np.ndarray, acc_coeffs: np.ndarray,
+                         dcc_breaks: np.ndarray, dcc_coeffs: np.ndarray,
+                         max_lon_acc: float, max_lon_dcc: float, max_lat_acc: float,
+                         max_speed: float, max_jerk: float):
+        """Moves the entry (or exit) front of every turn by one waypoint.
+
+        This is one half of an iteration of the front simulation, on plain arrays only so that
+        it can be compiled. The speed lookups are passed as tabulated piecewise polynomials.
+
+        Args:
+            points (np.ndarray): N * 9 trajectory points, with the columns of `KERNEL_COLUMNS`. Modified in-place.
+            flags (np.ndarray): T * 5 iteration flags of the turns, see `Simulator.run_simulation`. Modified in-place.
+            backward (bool): Move the entry fronts backward instead of the exit fronts forward.
+            acc_breaks (np.ndarray): Break points of the acceleration lookup.
+            acc_coeffs (np.ndarray): Coefficients of the acceleration lookup.
+            dcc_breaks (np.ndarray): Break points of the deceleration lookup.
+            dcc_coeffs (np.ndarray): Coefficients of the deceleration lookup.
+            max_lon_acc (float): Max lon acc of the friction ellipse (positive).
+            max_lon_dcc (float): Max lon dcc of the friction ellipse (negative).
+            max_lat_acc (float): Max lat acc of the friction ellipse (positive).
+            max_speed (float): Max speed of the vehicle.
+            max_jerk (float): Max jerk of the vehicle.
+
+        Returns:
+            np.ndarray: M * 5 flags of the turns added where the curvature is too high.
+        """
+        n = points.shape[0]
+        stop_col = 3 if backward else 4
+        front_col = 0 if backward else 2
+        new_flags = np.zeros((flags.shape[0], 5), dtype=flags.dtype)
+        num_new = 0
+        for f in range(flags.shape[0]):
+            if flags[f, stop_col] == 1:
+                continue
+            last = flags[f, front_col]
+            if backward:
+                this = last - 1 if last - 1 >= 0 else n - 1
+            else:
+                this = last + 1 if last + 1 < n else 0
+            flags[f, front_col] = this
+            dd = sqrt((points[last, X] - points[this, X]) ** 2 + (points[last, Y] - points[this, Y]) ** 2)
+
+            # Get the possible speed ranges from the last state
+            last_speed = points[last, SPEED]
+            last_lon_acc = points[last, LON_ACC]
+            dt = dd / last_speed
+            max_dacc = dt * max_jerk
+            max_acc = last_lon_acc + max_dacc
+            min_acc = last_lon_acc - max_dacc
+            vehicle_max_acc = eval_ppoly(acc_breaks, acc_coeffs, last_speed)
+            vehicle_max_dcc = eval_ppoly(dcc_breaks, dcc_coeffs, last_speed)
+            max_acc = min(max(max_acc, vehicle_max_dcc), vehicle_max_acc)
+            min_acc = min(max(min_acc, vehicle_max_dcc), vehicle_max_acc)
+            if backward:
+                # v_0^2 = 2ax - v^2
+                min_state_speed = sqrt(max(last_speed ** 2 - 2 * max_acc * dd, 0.0))
+                max_state_speed = sqrt(max(last_speed ** 2 - 2 * min_acc * dd, 0.0))
+            else:
+                # v^2 = 2ax + v_0^2
+                max_state_speed = sqrt(max(2 * max_acc * dd + last_speed ** 2, 0.0))
+                min_state_speed = sqrt(max(2 * min_acc * dd + last_speed ** 2, 0.0))
+
+            # Get the max possible speed from the curvature, on the friction ellipse
+            lon = min(max(last_lon_acc, max_lon_dcc), max_lon_acc)
+            max_lon = max_lon_acc if lon > 0.0 else max_lon_dcc
+            max_lat = max_lat_acc * np.sqrt(1.0 - lon ** 2 / max_lon ** 2)
+            max_curve_speed = np.sqrt(np.abs(np.abs(max_lat) - 9.81 * np.sin(points[this, BANK])) * points[this, CURVATURE])
+            # Find the minimum of the three maximum speeds
+            max_greedy_speed = min(max_state_speed, max_curve_speed, max_speed)
+            # Check if this speed is valid in all constraints
+            if (
+                min_state_speed <= max_greedy_speed <= max_state_speed
+                and 0.0 <= max_greedy_speed <= max_curve_speed
+                and 0.0 <= max_greedy_speed <= max_speed
+            ):
+                # If another turn populated a slower speed here, wait for it to overwrite ours
+                if points[this, ITERATION_FLAG] != -1 and points[this, SPEED] < max_greedy_speed:
+                    flags[f, stop_col] = 1
+                else:
+                    if not (min_acc <= points[this, LON_ACC] <= max_acc):
+                        # Signal the merge mode flag
+                        flags[f, stop_col] = -1
+                    points[this, SPEED] = max_greedy_speed
+                    # a = (v^2 - v_0^2) / (2x)
+                    if backward:
+                        points[this, LON_ACC] = (last_speed ** 2 - max_greedy_speed ** 2) / (2 * dd)
+                    else:
+                        points[this, LON_ACC] = (max_greedy_speed ** 2 - last_speed ** 2) / (2 * dd)
+                    points[this, LAT_ACC] = max_greedy_speed ** 2 / points[this, CURVATURE] + 9.81 * np.sin(points[this, BANK])
+                    points[this, ITERATION_FLAG] = flags[f, 1]
+            else:
+                # Stop for another constraint to handle it, and make this point an additional turn
+                # if the curvature is too high
+                flags[f, stop_col] = 1
+                if max_greedy_speed > max_curve_speed or (backward and max_greedy_speed < min_state_speed):
+                    idx = int(points[this, IDX])
+                    new_flags[num_new, 0] = idx
+                    new_flags[num_new, 1] = idx
+                    new_flags[num_new, 2] = idx
+                    num_new += 1
+                    if backward:
+                        points[this, SPEED] = min(max_curve_speed, max_greedy_speed)
+                    else:
+                        points[this, SPEED] = max_curve_speed
+                    points[this, LON_ACC] = last_lon_acc
+                    points[this, LAT_ACC] = points[this, SPEED] ** 2 / points[this, CURVATURE] + 9.81 * np.sin(points[this, BANK])
+                    points[this, ITERATION_FLAG] = idx
+        return new_flags[:num_new]
+
+    return propagate_fronts
+
+
+# the plain Python kernel, and the compiled one if numba is installed
+propagate_fronts = make_propagate_fronts(eval_ppoly)
+if JIT_AVAILABLE:
+    propagate_fronts_jit = njit(cache=True)(make_propagate_fronts(njit(cache=True)(eval_ppoly)))
+else:
+    propagate_fronts_jit = propagate_fronts
@@ -1,7 +1,9 @@
-from math import sqrt
 from spline_traj_optm.models.trajectory import Trajectory
 from spline_traj_optm.models.vehicle import Vehicle, VehicleParams
 from spline_traj_optm.simulator.visualization import SimulatorVisualization, SimulatorVelocityVisualization
+from spline_traj_optm.simulator import kernel
+from spline_traj_optm.simulator.kernel import JIT_AVAILABLE, propagate_fronts, propagate_fronts_jit
+from spline_traj_optm.instrumentation.profiler import profiler
 from dataclasses import dataclass
 import numpy as np
 from scipy.ndimage import gaussian_filter1d
@@ -45,14 +47,33 @@ class SimulationResult:
         )
 
 class Simulator:
-    def __init__(self, vehicle: Vehicle) -> None:
+    # "front" grows entry and exit fronts from every turn point by point,
+    # "sweep" solves the whole lap with array-based forward and backward passes
+    MODES = ("front", "sweep")
+    # Fixed-point iterations of the speed dependent limits in a sweep pass
+    SWEEP_MAX_ITER = 50
+    SWEEP_TOL = 1e-6
+
+    def __init__(self, vehicle: Vehicle, mode="front", jit=True) -> None:
+        """Lap simulator of a vehicle on a trajectory.
+
+        Args:
+            vehicle (Vehicle): The vehicle to simulate.
+            mode (str, optional): Simulation engine, one of `Simulator.MODES`. Defaults to "front".
+            jit (bool, optional): Compile the propagation kernel of the "front" engine, if numba
+                is installed. The plain Python kernel gives identical results. Defaults to True.
+        """
+        if mode not in Simulator.MODES:
+            raise ValueError(f"Unknown simulation mode {mode}, expected one of {Simulator.MODES}.")
         self.vehicle = vehicle
+        self.mode = mode
+        self.jit = jit and JIT_AVAILABLE
 
     def calc_lat_acc(self, v: float, r: float, bank: float):
         return v**2 / r + 9.81 * np.sin(bank)
 
     def calc_v(self, lat_acc: float, r: float, bank: float):
-        return sqrt(np.abs(np.abs(lat_acc) - 9.81 * np.sin(bank)) * r)
+        return np.sqrt(np.abs(np.abs(lat_acc) - 9.81 * np.sin(bank)) * r)
 
     def calc_r(self, lat_acc: float, v: float, bank: float):
         return v**2 / np.abs(np.abs(lat_acc) - 9.81 * np.sin(bank))
@@ -76,6 +97,13 @@ class Simulator:
         # )
         # trajectory_out[:, Trajectory.CURVATURE] = gaussian_filter1d(trajectory_out[:, Trajectory.CURVATURE], 1.0, mode='wrap')
 
+        if self.mode == "sweep":
+            self.__sweep(trajectory_out)
+            trajectory_out.fill_time()
+            if enable_vis:
+                SimulatorVelocityVisualization(trajectory_out).latch_plot()
+            return self.__make_result(trajectory_out, start_time)
+
         if enable_vis:
             vis = SimulatorVelocityVisualization(trajectory_out)
 
@@ -89,15 +117,8 @@ class Simulator:
                 full_speed_lat_acc, self.vehicle.param.max_speed_mps, 0.0
             )
 
-            bottle_necks = []
-            for i in range(len(trajectory_out)):
-                last_curvature = trajectory_out[trajectory_out.dec(i), Trajectory.CURVATURE]
-                this_curvature = trajectory_out[i, Trajectory.CURVATURE]
-                next_curvature = trajectory_out[trajectory_out.inc(i), Trajectory.CURVATURE]
-                # if last_curvature > this_curvature or next_curvature > this_curvature:
-                if this_curvature < min_curvature_for_full_speed:
-                    bottle_necks.append(i)
-            return np.array(bottle_necks, dtype=int)
+            # a single column read, not one `Trajectory` lookup per point
+            return np.flatnonzero(trajectory_out[:, Trajectory.CURVATURE] < min_curvature_for_full_speed)
             # return np.random.choice(np.arange(len(trajectory_out)), size=int(len(trajectory_out) * 0.7), replace=False)
             # return np.random.choice(np.arange(len(trajectory_out)), size=len(trajectory_out), replace=False)
 
@@ -110,243 +131,73 @@ class Simulator:
         iteration_flags = np.repeat(turns[:, np.newaxis], 5, axis=1)
         iteration_flags[:, 3:] = 0
 
-        def calc_distance(pt1, pt2):
-            return sqrt(
-                (pt1[Trajectory.X] - pt2[Trajectory.X]) ** 2
-                + (pt1[Trajectory.Y] - pt2[Trajectory.Y]) ** 2
-            )
+        dist_to_sf_fwd = trajectory_out[:, Trajectory.DIST_TO_SF_FWD]
 
         def calc_distance_along_trajectory(pt1, pt2):
-            i = pt1[Trajectory.IDX]
+            i = int(pt1[Trajectory.IDX])
             dist = 0.0
             while (i != pt2[Trajectory.IDX]):
                 next_i = trajectory_out.inc(i)
                 if next_i != 0.0:
-                    dist += trajectory_out[i, Trajectory.DIST_TO_SF_FWD] - trajectory_out[next_i, trajectory_out.DIST_TO_SF_FWD]
+                    dist += dist_to_sf_fwd[i] - dist_to_sf_fwd[next_i]
                 else:
-                    dist += trajectory_out[i, Trajectory.DIST_TO_SF_FWD]
+                    dist += dist_to_sf_fwd[i]
                 i = next_i
             return dist
 
+        # The kernel works on a scratch copy of the columns it reads and writes, see `kernel.KERNEL_COLUMNS`
+        points = kernel.to_kernel_points(trajectory_out)
+
+        def write_back():
+            kernel.from_kernel_points(trajectory_out, points)
+
         # For every turn, assume zero lon acc, populate initial conditions
         for turn in turns:
-            turn_pt = trajectory_out[turn]
-            turn_pt[Trajectory.SPEED] = min(
+            turn_pt = points[turn]
+            turn_pt[kernel.SPEED] = min(
                 self.calc_v(
                     self.vehicle.lookup_acc_circle(lon=0.0)[0],
-                    turn_pt[Trajectory.CURVATURE],
-                    turn_pt[Trajectory.BANK]
+                    turn_pt[kernel.CURVATURE],
+                    turn_pt[kernel.BANK]
                 ),
                 self.vehicle.param.max_speed_mps,
             )
-            turn_pt[Trajectory.LON_ACC] = 0.0
-            turn_pt[Trajectory.LAT_ACC] = self.calc_lat_acc(
-                turn_pt[Trajectory.SPEED], turn_pt[Trajectory.CURVATURE], turn_pt[Trajectory.BANK]
+            turn_pt[kernel.LON_ACC] = 0.0
+            turn_pt[kernel.LAT_ACC] = self.calc_lat_acc(
+                turn_pt[kernel.SPEED], turn_pt[kernel.CURVATURE], turn_pt[kernel.BANK]
             )
-            turn_pt[Trajectory.ITERATION_FLAG] = turn
+            turn_pt[kernel.ITERATION_FLAG] = turn
         
+        # The vehicle lookups are passed to the propagation kernel as tabulated polynomials
+        propagate = propagate_fronts_jit if self.jit else propagate_fronts
+        kernel_args = (
+            self.vehicle.acc_intp.x, np.ascontiguousarray(self.vehicle.acc_intp.c),
+            self.vehicle.dcc_intp.x, np.ascontiguousarray(self.vehicle.dcc_intp.c),
+            self.vehicle.param.max_lon_acc_mpss, self.vehicle.param.max_lon_dcc_mpss,
+            self.vehicle.param.max_left_acc_mpss, self.vehicle.param.max_speed_mps,
+            self.vehicle.param.max_jerk,
+        )
+
         def iterate(iteration_flags):
             itr = 0
             while True:
-                # For every turn, enter it as fast as possible
-                new_flags = []
-                for flags in iteration_flags:
-                    stopped = flags[3] == 1
-                    if stopped:
-                        continue
-                    last_enter_pt = trajectory_out[flags[0]]
-                    flags[0] = trajectory_out.dec(flags[0])
-                    enter_pt = trajectory_out[flags[0]]
-                    dd = calc_distance(last_enter_pt, enter_pt)
-
-                    # Get the possible speed ranges from the last state
-                    dt = dd / last_enter_pt[Trajectory.SPEED]
-                    max_dacc = dt * self.vehicle.param.max_jerk
-                    max_acc = last_enter_pt[Trajectory.LON_ACC] + max_dacc
-                    min_acc = last_enter_pt[Trajectory.LON_ACC] - max_dacc
-                    vehicle_max_acc = self.vehicle.lookup_acc_from_speed(
-                        last_enter_pt[Trajectory.SPEED]
-                    )
-                    vehicle_max_dcc = self.vehicle.lookup_dcc_from_speed(
-                        last_enter_pt[Trajectory.SPEED]
-                    )
-                    max_acc = np.clip(max_acc, vehicle_max_dcc, vehicle_max_acc)
-                    min_acc = np.clip(min_acc, vehicle_max_dcc, vehicle_max_acc)
-                    # v_0^2 = 2ax - v^2
-                    min_state_speed = sqrt(
-                        max(last_enter_pt[Trajectory.SPEED] ** 2 - 2 * max_acc * dd, 0.0)
-                    )
-                    max_state_speed = sqrt(
-                        max(last_enter_pt[Trajectory.SPEED] ** 2 - 2 * min_acc * dd, 0.0)
-                    )
-                    # Get the max possible speed from the curvature
-                    max_lat_acc = self.vehicle.lookup_acc_circle(
-                        lon=last_enter_pt[Trajectory.LON_ACC]
-                    )[0]
-                    max_curve_speed = self.calc_v(
-                        max_lat_acc, enter_pt[Trajectory.CURVATURE],
-                        enter_pt[Trajectory.BANK]
-                    )
-                    min_curve_speed = 0.0
-                    # Get the max possible speed from vehicle constraint
-                    max_vehicle_speed = self.vehicle.param.max_speed_mps
-                    min_vehicle_speed = 0.0
-                    # Find the minimum of the three maximum speeds
-                    max_greedy_speed = min(
-                        max_state_speed, max_curve_speed, max_vehicle_speed
-                    )
-                    # Check if this speed is valid in all constraints
-                    if (
-                        min_state_speed <= max_greedy_speed <= max_state_speed
-                        and min_curve_speed <= max_greedy_speed <= max_curve_speed
-                        and min_vehicle_speed <= max_greedy_speed <= max_vehicle_speed
-                    ):
-
-                        # Check if another turn has populated a speed at this point
-                        # If their speed is slower, do not overwrite because it will not meet their kinematic constraint
-                        # Instead, wait for them to overwrite our speed
-                        # If our speed is slower, overwrite becuase their speed will not meet our kinematic constraint
-                        if (
-                            enter_pt[Trajectory.ITERATION_FLAG] != -1
-                            and enter_pt[Trajectory.SPEED] < max_greedy_speed
-                        ):
-                            # Signal the stop flag
-                            flags[3] = 1
-                        else:
-                            if not (min_acc <= enter_pt[Trajectory.LON_ACC] <= max_acc):
-                                # Signal the merge mode flag
-                                flags[3] = -1
-                            # if valid, make it final
-                            enter_pt[Trajectory.SPEED] = max_greedy_speed
-                            # a = (v^2 - v_0^2) / (2x)
-                            enter_pt[Trajectory.LON_ACC] = (
-                                last_enter_pt[Trajectory.SPEED] ** 2
-                                - enter_pt[Trajectory.SPEED] ** 2
-                            ) / (2 * dd)
-                            enter_pt[Trajectory.LAT_ACC] = self.calc_lat_acc(
-                                enter_pt[Trajectory.SPEED], enter_pt[Trajectory.CURVATURE], enter_pt[Trajectory.BANK]
-                            )
-                            enter_pt[Trajectory.ITERATION_FLAG] = flags[1]
-                    else:
-                        # if constraint failed because the curvature is too high
-                        # make this point an additional turn
-
-                        # If not valid (meaning the car will fly off), stop for another constraint to handle it
-                        # Signal the stop flag
-                        flags[3] = 1
-                        if max_greedy_speed > max_curve_speed or max_greedy_speed < min_state_speed:
-                            idx = enter_pt[Trajectory.IDX]
-                            new_flags.append(np.array([idx, idx, idx, 0, 0]))
-                            enter_pt[Trajectory.SPEED] = min(max_curve_speed, max_greedy_speed)
-                            enter_pt[Trajectory.LON_ACC] = last_enter_pt[Trajectory.LON_ACC]
-                            enter_pt[Trajectory.LAT_ACC] = self.calc_lat_acc(
-                                enter_pt[Trajectory.SPEED], enter_pt[Trajectory.CURVATURE], enter_pt[Trajectory.BANK]
-                            )
-                            enter_pt[Trajectory.ITERATION_FLAG] = idx
-
-                # For every turn, exit it as fast as possible
-                for flags in iteration_flags:
-                    stopped = flags[4] == 1
-                    if stopped:
-                        continue
-                    last_exit_pt = trajectory_out[flags[2]]
-                    flags[2] = trajectory_out.inc(flags[2])
-                    exit_pt = trajectory_out[flags[2]]
-                    dd = calc_distance(last_exit_pt, exit_pt)
-
-                    # Get the possible speed ranges from the last state
-                    dt = dd / last_exit_pt[Trajectory.SPEED]
-                    max_dacc = dt * self.vehicle.param.max_jerk
-                    max_acc = last_exit_pt[Trajectory.LON_ACC] + max_dacc
-                    min_acc = last_exit_pt[Trajectory.LON_ACC] - max_dacc
-                    vehicle_max_acc = self.vehicle.lookup_acc_from_speed(
-                        last_exit_pt[Trajectory.SPEED]
-                    )
-                    vehicle_max_dcc = self.vehicle.lookup_dcc_from_speed(
-                        last_exit_pt[Trajectory.SPEED]
-                    )
-                    max_acc = np.clip(max_acc, vehicle_max_dcc, vehicle_max_acc)
-                    min_acc = np.clip(min_acc, vehicle_max_dcc, vehicle_max_acc)
-                    # v^2 = 2ax + v_0^2
-                    max_state_speed = sqrt(
-                        max(2 * max_acc * dd + last_exit_pt[Trajectory.SPEED] ** 2, 0.0)
-                    )
-                    min_state_speed = sqrt(
-                        max(2 * min_acc * dd + last_exit_pt[Trajectory.SPEED] ** 2, 0.0)
-                    )
-                    # Get the max possible speed from the curvature
-                    max_lat_acc = self.vehicle.lookup_acc_circle(
-                        lon=last_exit_pt[Trajectory.LON_ACC]
-                    )[0]
-                    max_curve_speed = self.calc_v(
-                        max_lat_acc, exit_pt[Trajectory.CURVATURE],
-                        exit_pt[Trajectory.BANK]
-                    )
-                    min_curve_speed = 0.0
-                    # Get the max possible speed from vehicle constraint
-                    max_vehicle_speed = self.vehicle.param.max_speed_mps
-                    min_vehicle_speed = 0.0
-                    # Find the minimum of the three maximum speeds
-                    max_greedy_speed = min(
-                        max_state_speed, max_curve_speed, max_vehicle_speed
-                    )
-                    # Check if this speed is valid in all constraints
-                    if (
-                        min_state_speed <= max_greedy_speed <= max_state_speed
-                        and min_curve_speed <= max_greedy_speed <= max_curve_speed
-                        and min_vehicle_speed <= max_greedy_speed <= max_vehicle_speed
-                    ):
-
-                        # Check if another turn has populated a speed at this point
-                        # If their speed is slower, do not overwrite because it will not meet their kinematic constraint
-                        # Instead, wait for them to overwrite our speed
-                        # If our speed is slower, overwrite becuase their speed will not meet our kinematic constraint
-                        if (
-                            exit_pt[Trajectory.ITERATION_FLAG] != -1
-                            and exit_pt[Trajectory.SPEED] < max_greedy_speed
-                        ):
-                            # Signal the stop flag
-                            flags[4] = 1
-                        else:
-                            if not (min_acc <= exit_pt[Trajectory.LON_ACC] <= max_acc):
-                                # Signal the merge mode flag
-                                flags[4] = -1
-                            # if valid, make it final
-                            exit_pt[Trajectory.SPEED] = max_greedy_speed
-                            # a = (v^2 - v_0^2) / (2x)
-                            exit_pt[Trajectory.LON_ACC] = (
-                                exit_pt[Trajectory.SPEED] ** 2
-                                - last_exit_pt[Trajectory.SPEED] ** 2
-                            ) / (2 * dd)
-                            exit_pt[Trajectory.LAT_ACC] = self.calc_lat_acc(
-                                exit_pt[Trajectory.SPEED], exit_pt[Trajectory.CURVATURE], exit_pt[Trajectory.BANK]
-                            )
-                            exit_pt[Trajectory.ITERATION_FLAG] = flags[1]
-                    else:
-                        # If not valid (meaning the car will fly off), stop for another constraint to handle it
-                        # Signal the stop flag
-                        flags[4] = 1
-                        # if constraint failed because the curvature is too high
-                        # make this point an additional turn
-                        if max_greedy_speed > max_curve_speed:
-                            idx = exit_pt[Trajectory.IDX]
-                            new_flags.append(np.array([idx, idx, idx, 0, 0]))
-                            exit_pt[Trajectory.SPEED] = max_curve_speed
-                            exit_pt[Trajectory.LON_ACC] = last_exit_pt[Trajectory.LON_ACC]
-                            exit_pt[Trajectory.LAT_ACC] = self.calc_lat_acc(
-                                exit_pt[Trajectory.SPEED], exit_pt[Trajectory.CURVATURE], exit_pt[Trajectory.BANK]
-                            )
-                            exit_pt[Trajectory.ITERATION_FLAG] = idx
+                # For every turn, enter it as fast as possible, then exit it as fast as possible
+                new_flags = [
+                    propagate(points, iteration_flags, True, *kernel_args),
+                    propagate(points, iteration_flags, False, *kernel_args),
+                ]
+                new_flags = [f for f in new_flags if len(f) > 0]
 
                 # add new flags at end of iteration
                 if len(new_flags) > 0:
-                    iteration_flags = np.vstack([iteration_flags, np.array(new_flags, dtype=int)])
+                    iteration_flags = np.vstack([iteration_flags, *new_flags])
 
                 # remove done iterations
                 mask = (iteration_flags[:, 3] != 1) | (iteration_flags[:, 4] != 1)
                 iteration_flags = iteration_flags[mask, :]
 
                 if enable_vis and itr % 100 == 0:
+                    write_back()
                     vis.update_plot(0.001)
                 # Check if all iterations are stopped
                 # if np.all(iteration_flags[:, 3:] == 1):
@@ -356,6 +207,7 @@ class Simulator:
                 itr += 1      
 
         iterate(iteration_flags)
+        write_back()
 
         # Populate the time and distance fields
         trajectory_out.fill_time()
@@ -363,9 +215,113 @@ class Simulator:
         if enable_vis:
             vis.latch_plot()
 
+        return self.__make_result(trajectory_out, start_time)
+
+    def __sweep(self, trajectory_out: Trajectory):
+        """Quasi-steady-state speed profile of the closed lap, solved with array-based passes.
+
+        The curvature-limited speeds are first lowered by a forward (acceleration) and a
+        backward (braking) pass under the speed lookups and the friction ellipse. The
+        resulting acceleration profile is then turned into jerk-limited acceleration and
+        braking envelopes, and both passes are repeated under them. The lon acc may still
+        step where the final acceleration and braking profiles meet.
+
+        Args:
+            trajectory_out (Trajectory): Trajectory to fill SPEED, LON_ACC and LAT_ACC of. Modified in-place.
+        """
+        r = trajectory_out[:, Trajectory.CURVATURE]
+        bank = trajectory_out[:, Trajectory.BANK]
+        xy = trajectory_out[:, :2]
+        ds = np.hypot(*(np.roll(xy, -1, axis=0) - xy).T)
+
+        # Curvature-limited speed, assuming zero lon acc
+        v = np.minimum(
+            self.calc_v(self.vehicle.param.max_left_acc_mpss, r, bank),
+            self.vehicle.param.max_speed_mps,
+        )
+        v = self.__sweep_pass(v, ds, r, bank, braking=False)
+        v = self.__sweep_pass(v, ds, r, bank, braking=True)
+
+        # Jerk limits: the acceleration and braking envelopes may only change by max_jerk * dt
+        lon_acc = (np.roll(v, -1) ** 2 - v ** 2) / (2.0 * ds)
+        dt = 2.0 * ds / (v + np.roll(v, -1))
+        dacc = self.vehicle.param.max_jerk * 0.5 * (dt + np.roll(dt, -1))
+        acc_cap = self.__ramp_envelope(np.maximum(lon_acc, 0.0), dacc)
+        dcc_cap = self.__ramp_envelope(np.maximum(-lon_acc, 0.0), dacc)
+        v = self.__sweep_pass(v, ds, r, bank, braking=False, cap=acc_cap)
+        v = self.__sweep_pass(v, ds, r, bank, braking=True, cap=dcc_cap)
+
+        trajectory_out[:, Trajectory.SPEED] = v
+        # a = (v^2 - v_0^2) / (2x)
+        trajectory_out[:, Trajectory.LON_ACC] = (np.roll(v, -1) ** 2 - v ** 2) / (2.0 * ds)
+        trajectory_out[:, Trajectory.LAT_ACC] = self.calc_lat_acc(v, r, bank)
+
+    def __sweep_pass(self, v_max: np.ndarray, ds: np.ndarray, r: np.ndarray, bank: np.ndarray, braking: bool, cap=None):
+        """Lowers a speed profile until every segment is reachable with the available lon acc.
+
+        The available lon acc of a segment depends on the speed at its start, so the pass is
+        solved by fixed-point iteration, each being one closed-form min-plus recurrence.
+
+        Args:
+            v_max (np.ndarray): N speed limits of the waypoints.
+            ds (np.ndarray): N distances from every waypoint to the next one.
+            r (np.ndarray): N turn radii.
+            bank (np.ndarray): N bank angles.
+            braking (bool): Propagate braking backward instead of acceleration forward.
+            cap (np.ndarray, optional): N limits of the lon acc magnitude per segment. Defaults to None.
+
+        Returns:
+            np.ndarray: N speeds no higher than `v_max`.
+        """
+        if braking:
+            # in reverse, segment i goes from waypoint i to waypoint i - 1
+            v_max, r, bank = v_max[::-1], r[::-1], bank[::-1]
+            ds = self.__reverse_segments(ds)
+            cap = None if cap is None else self.__reverse_segments(cap)
+
+        u_max = v_max ** 2
+        v = v_max
+        for _ in range(Simulator.SWEEP_MAX_ITER):
+            # lon acc left by the friction model, capped by the speed lookup
+            acc, dcc = self.vehicle.envelope.lon_limits_given_lat(self.calc_lat_acc(v, r, bank), v)
+            lon_acc = -dcc if braking else acc
+            if cap is not None:
+                lon_acc = np.minimum(lon_acc, cap)
+            # v^2 = 2ax + v_0^2
+            v_new = np.sqrt(self.__min_plus(u_max, 2.0 * lon_acc * ds))
+            converged = np.max(np.abs(v_new - v)) < Simulator.SWEEP_TOL
+            v = v_new
+            if converged:
+                break
+        return v[::-1] if braking else v
+
+    def __ramp_envelope(self, values: np.ndarray, step: np.ndarray):
+        """Largest envelope below `values` that changes by at most `step` between neighbours, both ways around the lap."""
+        envelope = self.__min_plus(values, step)
+        return self.__min_plus(envelope[::-1], self.__reverse_segments(step))[::-1]
+
+    def __reverse_segments(self, values: np.ndarray):
+        # what joins waypoints i and i + 1 joins waypoints N - 1 - i and N - 2 - i in reverse
+        return np.roll(values[::-1], -1)
+
+    def __min_plus(self, c: np.ndarray, b: np.ndarray):
+        """Solves u[i + 1] = min(c[i + 1], u[i] + b[i]) around a closed lap.
+
+        u[i] = min over j <= i of c[j] + b[j] + ... + b[i - 1], evaluated with a cumulative sum
+        and a cumulative minimum over two laps, so that every j within one lap before i counts.
+        """
+        n = len(c)
+        c = np.concatenate([c, c])
+        b_sum = np.concatenate([[0.0], np.cumsum(np.concatenate([b, b[:-1]]))])
+        u = b_sum + np.minimum.accumulate(c - b_sum)
+        return u[n:]
+
+    def __make_result(self, trajectory_out: Trajectory, start_time: float) -> SimulationResult:
+        run_time = time.time() - start_time
+        profiler().add_time("simulation", run_time)
         return SimulationResult(
             trajectory=trajectory_out,
-            run_time=time.time() - start_time,
+            run_time=run_time,
             total_time=trajectory_out[0, Trajectory.TIME],
             average_speed=trajectory_out[0, Trajectory.DIST_TO_SF_FWD]
             / trajectory_out[0, Trajectory.TIME],
@@ -0,0 +1,168 @@
+"""Benchmarks of the spline, boundary, simulator and QP hot paths on the example tracks.
+
+Not collected with the tests, run them with pytest-benchmark (`pip install -e .[benchmark]`):
+
+    pytest spline_traj_optm/tests/bench_hot_paths.py --benchmark-autosave
+
+saves the results as JSON under `.benchmarks/`, and
+
+    pytest spline_traj_optm/tests/bench_hot_paths.py --benchmark-compare --benchmark-compare-fail=median:25%
+
+fails when any benchmark got slower than 25 % over the last saved run of the same machine.
+"""
+from functools import lru_cache
+from importlib_resources import files
+import matplotlib
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+# the optimizers plot their results, which must not open windows
+matplotlib.use("Agg")
+
+from spline_traj_optm.tests.test_trajectory import get_trajectory_array
+from spline_traj_optm.tests.test_min_time_optm import get_maui_params
+from spline_traj_optm.optimization.optimizer import TrajectoryOptimizer
+from spline_traj_optm.models.trajectory import Trajectory, BSplineTrajectory
+from spline_traj_optm.models.vehicle import VehicleParams, Vehicle
+from spline_traj_optm.models.race_track import RaceTrack
+from spline_traj_optm.simulator.simulator import Simulator
+import spline_traj_optm.min_time_optm.min_time_optimizer as min_time
+import spline_traj_optm.examples.race_track.monza
+import spline_traj_optm.examples.race_track.uh_maui
+
+# center line, boundaries and smoothing of the center line of every track
+TRACKS = {
+    "monza": (spline_traj_optm.examples.race_track.monza,
+              "MONZA_UNOPTIMIZED_LINE_enu.csv", "MONZA_LEFT_BOUNDARY_enu.csv", "MONZA_RIGHT_BOUNDARY_enu.csv", 100.0),
+    "uh_maui": (spline_traj_optm.examples.race_track.uh_maui,
+                "uh_maui_center.csv", "uh_maui_left.csv", "uh_maui_right.csv", 3.0),
+}
+# sampling intervals in meter of every track
+INTERVALS = {
+    "monza": (3.0, 1.0),
+    "uh_maui": (1.0, 0.2),
+}
+TRACK_INTERVALS = [(track, interval) for track, intervals in INTERVALS.items() for interval in intervals]
+
+
+@lru_cache()
+def center_line_points(track):
+    package, center, _, _, _ = TRACKS[track]
+    return get_trajectory_array(files(package).joinpath(center))[:, :2]
+
+
+@lru_cache()
+def race_track(track):
+    package, _, left, right, _ = TRACKS[track]
+    return RaceTrack(track, get_trajectory_array(files(package).joinpath(left)),
+                     get_trajectory_array(files(package).joinpath(right)))
+
+
+def center_line(track):
+    return BSplineTrajectory(center_line_points(track), TRACKS[track][4], 5)
+
+
+def sampled(track, interval):
+    traj_d = center_line(track).sample_along(interval)
+    race_track(track).fill_trajectory_boundaries(traj_d)
+    return traj_d
+
+
+def vehicle():
+    acc_speed_lookup = np.array([[0.0, 10.0], [50.0, 7.0], [100.0, 0.5]])
+    dcc_speed_lookup = np.array([[0.0, -13.0], [50.0, -15.0], [100.0, -20.0]])
+    return Vehicle(VehicleParams(acc_speed_lookup, dcc_speed_lookup, 10.0, -20.0, 15.0, -15.0, 100.0, 30.0))
+
+
+@pytest.mark.parametrize("track", TRACKS.keys())
+def test_bspline_init(benchmark, track):
+    points = center_line_points(track)
+    benchmark(BSplineTrajectory, points, TRACKS[track][4], 5)
+
+
+@pytest.mark.parametrize("track,interval", TRACK_INTERVALS)
+def test_sample_along(benchmark, track, interval):
+    traj_s = center_line(track)
+    traj_s.sample_along(interval)
+    benchmark(traj_s.sample_along, interval)
+
+
+@pytest.mark.parametrize("track,interval", TRACK_INTERVALS)
+def test_fill_bounds(benchmark, track, interval):
+    traj_d = center_line(track).sample_along(interval)
+    benchmark(race_track(track).fill_trajectory_boundaries, traj_d)
+
+
+@pytest.mark.parametrize("mode", Simulator.MODES)
+@pytest.mark.parametrize("track,interval", TRACK_INTERVALS)
+def test_run_simulation(benchmark, track, interval, mode):
+    traj_d = sampled(track, interval)
+    sim = Simulator(vehicle(), mode=mode)
+    # the first run compiles the kernel, if numba is installed
+    sim.run_simulation(traj_d)
+    benchmark.pedantic(sim.run_simulation, args=(traj_d,), rounds=3, iterations=1)
+
+
+@pytest.mark.parametrize("track", TRACKS.keys())
+def test_min_curvature_qp_step(benchmark, track):
+    traj_s = center_line(track)
+    traj_d = sampled(track, INTERVALS[track][0])
+    optm = TrajectoryOptimizer(race_track(track), traj_s.copy(), vehicle())
+    idx = len(traj_s._spl_x.c) // 2
+    optm.solve_min_curvature_qp(idx, traj_s, traj_d)
+    new_z = benchmark(optm.solve_min_curvature_qp, idx, traj_s, traj_d)
+    assert new_z is not None
+
+
+@pytest.mark.parametrize("track", TRACKS.keys())
+def test_min_curvature_sweep(benchmark, track):
+    traj_s = center_line(track)
+    traj_d = Simulator(vehicle()).run_simulation(sampled(track, INTERVALS[track][0])).trajectory
+    optm = TrajectoryOptimizer(race_track(track), traj_s.copy(), vehicle())
+    benchmark.pedantic(optm.run_min_curvature_qp, args=(traj_s, traj_d), kwargs=dict(max_iter=1, seed=0),
+                       rounds=1, iterations=1)
+
+
+@pytest.mark.parametrize("interval", INTERVALS["uh_maui"])
+def test_min_time_problem_build(benchmark, interval):
+    params = get_maui_params(interval, 100)
+    benchmark.pedantic(min_time.set_up_problem, args=(params,), rounds=3, iterations=1)
+
+
+@pytest.mark.parametrize("interval", INTERVALS["uh_maui"])
+def test_min_time_problem_solve(benchmark, interval):
+    params = get_maui_params(interval, 100)
+    X, U, T, opti = min_time.set_up_problem(params)
+    sol = benchmark.pedantic(opti.solve, rounds=3, iterations=1)
+    assert sol.stats()["success"]
+
+
+@pytest.fixture(scope="module")
+def large_trajectory_files(tmp_path_factory):
+    # a million rows of random points, as CSV and as binary container
+    traj = Trajectory(1000000)
+    traj[:, :Trajectory.IDX] = np.random.default_rng(0).normal(size=(len(traj), Trajectory.IDX))
+    tmp_dir = tmp_path_factory.mktemp("trajectory_io")
+    Trajectory.save(str(tmp_dir / "traj.csv"), traj)
+    Trajectory.save_binary(str(tmp_dir / "traj.bin"), traj)
+    return traj, str(tmp_dir)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "bin"])
+def test_trajectory_save(benchmark, large_trajectory_files, fmt):
+    traj, tmp_dir = large_trajectory_files
+    save = Trajectory.save if fmt == "csv" else Trajectory.save_binary
+    benchmark.pedantic(save, args=(f"{tmp_dir}/out.{fmt}", traj), rounds=1, iterations=1)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "bin", "mmap"])
+def test_trajectory_load(benchmark, large_trajectory_files, fmt):
+    _, tmp_dir = large_trajectory_files
+    if fmt == "csv":
+        benchmark.pedantic(Trajectory.load, args=(f"{tmp_dir}/traj.csv",), rounds=1, iterations=1)
+    elif fmt == "bin":
+        benchmark(Trajectory.load_binary, f"{tmp_dir}/traj.bin")
+    else:
+        # map the file and read a single column
+        benchmark(lambda: np.array(Trajectory.load_binary(f"{tmp_dir}/traj.bin", mmap=True)[:, Trajectory.X]))
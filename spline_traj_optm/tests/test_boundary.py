@@ -1,8 +1,12 @@
 from importlib_resources import files
+from shapely.geometry import Point
 import numpy as np
 import pickle
+import pytest
 import matplotlib.pyplot as plt
 import os
+import tempfile
+from time import time
 
 from spline_traj_optm.tests.test_trajectory import get_bspline, get_trajectory_array
 from spline_traj_optm.optimization.optimizer import TrajectoryOptimizer
@@ -10,6 +14,7 @@ from spline_traj_optm.models.trajectory import Trajectory, BSplineTrajectory
 from spline_traj_optm.models.vehicle import VehicleParams, Vehicle
 from spline_traj_optm.simulator.simulator import Simulator
 from spline_traj_optm.models.race_track import RaceTrack
+from spline_traj_optm.instrumentation.profiler import Profiler
 import spline_traj_optm.examples.race_track.monza
 
 traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath(
@@ -18,4 +23,78 @@ traj_discrete = traj_spline.sample_along(3.0)
 race_track = RaceTrack("Monza", get_trajectory_array(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_LEFT_BOUNDARY_enu.csv")), get_trajectory_array(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_RIGHT_BOUNDARY_enu.csv")))
 
 race_track.fill_trajectory_boundaries(traj_discrete)
-np.savetxt("test_traj.csv", traj_discrete.points, delimiter=",")
\ No newline at end of file
+np.savetxt("test_traj.csv", traj_discrete.points, delimiter=",")
+
+def test_fill_bounds():
+    traj_d = traj_spline.sample_along(1.0)
+    traj_shapely = traj_d.copy()
+
+    start = time()
+    traj_shapely.fill_bounds_shapely(race_track.left_r, race_track.right_r, max_dist=100.0)
+    duration_shapely = time() - start
+
+    start = time()
+    no_hit = race_track.fill_trajectory_boundaries(traj_d)
+    duration = time() - start
+    print(f"Boundary filling took {duration} sec (shapely: {duration_shapely} sec)")
+
+    assert not np.any(no_hit)
+    np.testing.assert_allclose(traj_d[:, Trajectory.LEFT_BOUND_X:Trajectory.RIGHT_BOUND_Y+1],
+                               traj_shapely[:, Trajectory.LEFT_BOUND_X:Trajectory.RIGHT_BOUND_Y+1], atol=1e-6)
+
+    # normal lines too short to reach the boundaries are counted and warned about
+    rows = np.arange(10, 20)
+    with Profiler() as prof, pytest.warns(UserWarning, match="No boundary intersection"):
+        no_hit = traj_d.fill_bounds(race_track.left_segments, race_track.right_segments, max_dist=0.1, rows=rows)
+    assert np.all(no_hit) and prof.counters["bound_no_hit"] == 2 * len(rows)
+    np.testing.assert_array_equal(traj_d[rows, Trajectory.LEFT_BOUND_X:Trajectory.LEFT_BOUND_Y+1],
+                                  traj_d[rows, Trajectory.X:Trajectory.Y+1])
+
+
+def test_boundary_queries():
+    traj_d = traj_spline.sample_along(1.0)
+    points = traj_d[:, Trajectory.X:Trajectory.Y+1]
+    race_track.fill_trajectory_boundaries(traj_d)
+
+    _, dist, _, is_left = race_track.nearest_boundary(points)
+    left_dist = np.array([race_track.left_r.distance(Point(p)) for p in points])
+    right_dist = np.array([race_track.right_r.distance(Point(p)) for p in points])
+    np.testing.assert_allclose(dist, np.minimum(left_dist, right_dist), atol=1e-6)
+    assert np.all(is_left == (left_dist <= right_dist))
+
+    # the center line is inside the track, and anything pushed past the left boundary is not
+    offset = race_track.signed_lateral_offset(points)
+    assert np.all(offset > 0.0)
+    np.testing.assert_allclose(offset, np.column_stack([left_dist, right_dist]), atol=1e-6)
+    left = traj_d[:, Trajectory.LEFT_BOUND_X:Trajectory.LEFT_BOUND_Y+1]
+    assert np.all(race_track.signed_lateral_offset(points + 1.5 * (left - points))[:, 0] < 0.0)
+
+    hits, _, no_hit = race_track.ray_hit(points, traj_d[:, Trajectory.YAW], "left")
+    assert not np.any(no_hit)
+    np.testing.assert_allclose(hits, left, atol=1e-6)
+
+
+def test_center_line():
+    start = time()
+    center_line = race_track.center_line(0.5)
+    print(f"Center line of Monza took {time() - start} sec")
+    traj_d = center_line.sample_along(1.0)
+    points = traj_d[:, Trajectory.X:Trajectory.Y+1]
+
+    # inside the track, and about as far from both boundaries
+    offset = race_track.signed_lateral_offset(points)
+    imbalance = np.abs(offset[:, 0] - offset[:, 1])
+    print(f"Left and right distances differ by {np.mean(imbalance):.3f} m on average, {np.max(imbalance):.3f} m at most")
+    assert np.all(offset > 0.0)
+    assert np.percentile(imbalance, 99) < 0.5
+    assert abs(center_line.get_length() - traj_spline.get_length()) < 0.01 * traj_spline.get_length()
+
+    # z between the boundaries, and kept through the binary format
+    z = traj_d[:, Trajectory.Z]
+    z_min = min(np.min(race_track.left_d[:, Trajectory.Z]), np.min(race_track.right_d[:, Trajectory.Z]))
+    z_max = max(np.max(race_track.left_d[:, Trajectory.Z]), np.max(race_track.right_d[:, Trajectory.Z]))
+    assert np.any(z != 0.0) and np.all((z > z_min - 0.5) & (z < z_max + 0.5))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        BSplineTrajectory.save_binary(os.path.join(tmp_dir, "center.bin"), center_line)
+        center_loaded = BSplineTrajectory.load_binary(os.path.join(tmp_dir, "center.bin"))
+    assert np.array_equal(center_loaded.sample_along(ts=traj_d.ts())[:, Trajectory.Z], z)
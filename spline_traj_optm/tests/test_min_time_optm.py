@@ -1,8 +1,14 @@
 from importlib_resources import files
+import numpy as np
 import matplotlib.pyplot as plt
+import os
+import tempfile
+from time import time
 
 from spline_traj_optm.tests.test_trajectory import get_bspline, get_trajectory_array
 from spline_traj_optm.models.trajectory import Trajectory
+from spline_traj_optm.models.vehicle import VehicleParams, Vehicle
+from spline_traj_optm.simulator.simulator import Simulator
 import spline_traj_optm.models.dynamic_bicycle as dyn
 import spline_traj_optm.examples.race_track.uh_maui
 import spline_traj_optm.examples.race_track.monza
@@ -120,5 +126,218 @@ def test_optimizer():
     plt.show()
 
 
+def get_maui_track():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.uh_maui).joinpath(
+        "uh_maui_center.csv"), s=3.0)
+    race_track = RaceTrack("Maui", get_trajectory_array(files(spline_traj_optm.examples.race_track.uh_maui).joinpath(
+        "uh_maui_left.csv")), get_trajectory_array(files(spline_traj_optm.examples.race_track.uh_maui).joinpath("uh_maui_right.csv")))
+    return traj_spline, race_track
+
+
+def get_maui_params(interval, max_iter, track=None):
+    traj_spline, race_track = get_maui_track() if track is None else track
+    traj_d = traj_spline.sample_along(interval)
+    race_track.fill_trajectory_boundaries(traj_d)
+    return {
+        "N": len(traj_d),
+        "traj_d": traj_d,
+        "nu": dyn.nu(),
+        "nx": dyn.nx(),
+        "model": {
+            "lr": 0.5,
+            "L": 1.0,
+            "delta_max": 0.314158999998341,
+            "v_max": 20.0,
+            "a_lon_max": 5.0,
+            "a_lon_min": -5.0,
+            "delta_dot_max": 1.0,
+            "acc_max": 20.0
+        },
+        "dynamics": dyn.dynamics,
+        "x_l": dyn.x_l,
+        "x_u": dyn.x_u,
+        "u_l": dyn.u_l,
+        "u_u": dyn.u_u,
+        "verbose": False,
+        "max_iter": max_iter,
+        "tol": 1e-2,
+        "constr_viol_tol": 1e-3,
+    }
+
+
+def test_problem_structure():
+    params = get_maui_params(1.0, 100)
+    X, U, T, opti, structure = optm.set_up_problem(params, report=True)
+    print(structure)
+    N = params["N"]
+    assert structure.num_variables == N * (params["nx"] + params["nu"] + 1)
+    assert structure.num_constraints % N == 0
+    # every waypoint only couples to the previous one, and the first one to the last one
+    assert structure.waypoint_bandwidth == 1
+    assert 0 < structure.jac_g_wrap_nnz < structure.jac_g_nnz // N
+    assert 0 < structure.hess_l_wrap_nnz < structure.hess_l_nnz // N
+
+    opti.solve()
+    t_ref = np.sum(opti.value(T))
+    params["linear_solver_opts"] = {"mumps_pivot_order": 2, "nlp_scaling_method": "none"}
+    X, U, T, opti = optm.set_up_problem(params)
+    opti.solve()
+    assert np.isclose(np.sum(opti.value(T)), t_ref, rtol=1e-3)
+    breakdown = optm.solver_time_breakdown(opti.stats())
+    print(", ".join(f"{key}: {value:.3f} s" for key, value in breakdown.items()))
+    assert 0.0 < breakdown["ipopt"] < breakdown["total"]
+
+
+def test_batched_problem():
+    # build time and first iteration time of the Opti and the mapped problems
+    params = get_maui_params(0.2, 1)
+    start = time()
+    X, U, T, opti = optm.set_up_problem(params)
+    opti_build = time() - start
+    start = time()
+    try:
+        opti.solve()
+    except Exception:
+        pass
+    opti_first = time() - start
+    start = time()
+    solver, args = optm.set_up_batched_problem(params)
+    batched_build = time() - start
+    start = time()
+    solver(**args)
+    batched_first = time() - start
+    print(f"{params['N']} waypoints, Opti: build {opti_build:.3f} s, first iteration {opti_first:.3f} s")
+    print(f"{params['N']} waypoints, batched: build {batched_build:.3f} s, first iteration {batched_first:.3f} s")
+
+    # both solve the same problem
+    params = get_maui_params(1.0, 100)
+    X, U, T, opti = optm.set_up_problem(params)
+    opti.solve()
+    solver, args = optm.set_up_batched_problem(params)
+    r = solver(**args)
+    assert solver.stats()["success"]
+    x, u, t = optm.unpack_solution(params, r["x"])
+    assert x.shape == (params["N"], params["nx"]) and u.shape == (params["N"], params["nu"])
+    assert np.isclose(np.sum(t), np.sum(opti.value(T)), rtol=1e-6)
+    assert np.allclose(x[:, 0:2], opti.value(X)[:, 0:2], atol=1e-3)
+
+
+def test_codegen_problem():
+    params = get_maui_params(1.0, 100)
+    solver, args = optm.set_up_batched_problem(params)
+    r = solver(**args)
+    t_ref = np.sum(optm.unpack_solution(params, r["x"])[2])
+
+    with tempfile.TemporaryDirectory() as codegen_dir:
+        params["codegen_dir"] = codegen_dir
+        start = time()
+        solver, args = optm.set_up_batched_problem(params)
+        print(f"Generated and compiled the NLP of {params['N']} waypoints in {time() - start:.3f} s")
+        libs = os.listdir(codegen_dir)
+        # only the finished library is left
+        assert len(libs) == 1 and libs[0].endswith(".so")
+        start = time()
+        r = solver(**args)
+        print(f"Compiled NLP solved in {time() - start:.3f} s")
+        assert np.isclose(np.sum(optm.unpack_solution(params, r["x"])[2]), t_ref, rtol=1e-6)
+
+        # another model reuses the library, with its values as parameters
+        params["model"] = dict(params["model"], lr=0.4, v_max=15.0, acc_max=15.0)
+        start = time()
+        solver, args = optm.set_up_batched_problem(params)
+        print(f"Loaded the compiled NLP in {time() - start:.3f} s")
+        assert os.listdir(codegen_dir) == libs
+        r = solver(**args)
+        t_codegen = np.sum(optm.unpack_solution(params, r["x"])[2])
+
+    params.pop("codegen_dir")
+    solver, args = optm.set_up_batched_problem(params)
+    r = solver(**args)
+    assert np.isclose(t_codegen, np.sum(optm.unpack_solution(params, r["x"])[2]), rtol=1e-6)
+    assert t_codegen > t_ref
+
+
+def test_warm_start():
+    params = get_maui_params(1.0, 300)
+    problem = optm.MinTimeProblem(params)
+    solution = problem.solve()
+    assert solution.success
+    print(f"Cold start: {solution.iterations} iterations, lap time {solution.lap_time:.3f} s")
+
+    # a sweep over the model converges faster from the previous solution
+    for key, value in (("acc_max", 18.0), ("v_max", 18.0), ("a_lon_max", 4.0)):
+        problem.update(model=dict(params["model"], **{key: value}))
+        cold = problem.solve()
+        warm = problem.solve(warm_start=solution)
+        print(f"{key} = {value}: cold start {cold.iterations} iterations, lap time {cold.lap_time:.3f} s, "
+              f"warm start {warm.iterations} iterations, lap time {warm.lap_time:.3f} s")
+        assert cold.success and warm.success
+        assert warm.iterations < cold.iterations
+        assert np.isclose(warm.lap_time, cold.lap_time, rtol=1e-2)
+
+    # initial guess from the speed profile of the simulator
+    problem.update(model=params["model"])
+    model = params["model"]
+    vp = VehicleParams(np.array([[0.0, model["a_lon_max"]], [100.0, model["a_lon_max"]]]),
+                       np.array([[0.0, model["a_lon_min"]], [100.0, model["a_lon_min"]]]),
+                       model["a_lon_max"], model["a_lon_min"], model["acc_max"], -model["acc_max"], model["v_max"], 100.0)
+    sim_traj = Simulator(Vehicle(vp), mode="sweep").run_simulation(params["traj_d"]).trajectory
+    guess = optm.initial_guess(params, sim_traj)
+    x, u, t = optm.unpack_solution(params, guess)
+    assert np.isclose(np.sum(t), sim_traj[0, Trajectory.TIME])
+    simulated = problem.solve(initial_guess=guess)
+    print(f"Simulator initial guess: {simulated.iterations} iterations, lap time {simulated.lap_time:.3f} s")
+    assert simulated.success
+    assert np.isclose(simulated.lap_time, solution.lap_time, rtol=1e-2)
+
+
+def test_coarse_to_fine():
+    traj_spline, race_track = get_maui_track()
+    params = get_maui_params(0.5, 300, (traj_spline, race_track))
+    start = time()
+    direct = optm.MinTimeProblem(params).solve()
+    print(f"Direct: {direct.iterations} iterations in {time() - start:.3f} s, lap time {direct.lap_time:.3f} s")
+
+    # interpolating onto the same waypoints keeps the solution
+    same = optm.interpolate_solution(params, direct, params["traj_d"], params["traj_d"])
+    assert np.allclose(same.w, direct.w)
+
+    start = time()
+    solution, fine_params, levels = optm.solve_coarse_to_fine(params, traj_spline, race_track, [2.0, 1.0, 0.5])
+    print(f"Coarse to fine in {time() - start:.3f} s")
+    for level in levels:
+        print(level)
+    assert all(level.success for level in levels)
+    assert fine_params["N"] == params["N"]
+    assert levels[-1].iterations < direct.iterations
+    assert np.isclose(solution.lap_time, direct.lap_time, rtol=1e-2)
+
+
+def test_receding_horizon():
+    params = get_maui_params(1.0, 300)
+    direct = optm.MinTimeProblem(params).solve()
+
+    # the horizons of a color never touch, and every waypoint is in a horizon
+    colors = optm.color_windows(params["N"], 40, 20)
+    starts = np.sort(np.concatenate(colors))
+    assert np.array_equal(starts, np.arange(0, params["N"], 20))
+    for color in colors:
+        gaps = np.diff(np.append(color, color[0] + params["N"]))
+        assert len(color) == 1 or np.all(gaps >= 41)
+
+    start = time()
+    solution, sweeps = optm.solve_receding_horizon(params, 40, 20)
+    print(f"Receding horizon of 40 waypoints in {time() - start:.3f} s, direct {direct.iterations} iterations")
+    for sweep in sweeps:
+        print(sweep)
+    assert solution.success
+    assert np.isclose(solution.lap_time, direct.lap_time, rtol=1e-2)
+    assert np.allclose(solution.x[:, 0:2], direct.x[:, 0:2], atol=0.2)
+
+    # the horizons of a color are merged in order, so the workers do not change the result
+    parallel, _ = optm.solve_receding_horizon(params, 40, 20, num_workers=2)
+    assert np.allclose(parallel.w, solution.w)
+
+
 if __name__ == "__main__":
     test_optimizer()
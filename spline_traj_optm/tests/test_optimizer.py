@@ -3,9 +3,12 @@ import numpy as np
 import pickle
 import matplotlib.pyplot as plt
 import os
+from time import time
+from scipy.interpolate import BSpline
 
 from spline_traj_optm.tests.test_trajectory import get_bspline, get_trajectory_array
 from spline_traj_optm.optimization.optimizer import TrajectoryOptimizer
+from spline_traj_optm.optimization.qp_solver import QPSolverCache
 from spline_traj_optm.models.trajectory import Trajectory, BSplineTrajectory
 from spline_traj_optm.models.vehicle import VehicleParams, Vehicle
 from spline_traj_optm.simulator.simulator import Simulator
@@ -77,5 +80,120 @@ def test_optimizer():
     # plt.legend()
     # plt.show()
 
+def get_monza_optimizer():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath(
+        "MONZA_UNOPTIMIZED_LINE_enu.csv"), s=100.0)
+    race_track = RaceTrack("Monza", get_trajectory_array(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_LEFT_BOUNDARY_enu.csv")), get_trajectory_array(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_RIGHT_BOUNDARY_enu.csv")))
+    acc_speed_lookup = np.array([[0.0, 10.0], [50.0, 7.0], [100.0, 0.5]])
+    dcc_speed_lookup = np.array([[0.0, -13.0], [50.0, -15.0], [100.0, -20.0]])
+    vp = VehicleParams(acc_speed_lookup, dcc_speed_lookup,
+                       10.0, -20.0, 15.0, -15.0, 100.0, 30.0)
+    return traj_spline, race_track, TrajectoryOptimizer(race_track, traj_spline.copy(), Vehicle(vp))
+
+def test_parallel_min_curvature_qp():
+    traj_spline, _, optm = get_monza_optimizer()
+
+    # control points of a color are more than k apart around the closed spline
+    k = traj_spline._spl_x.k
+    i_min, i_max = k // 2, len(traj_spline._spl_x.c) - (k - k // 2)
+    colors = optm.color_control_points(i_min, i_max, k)
+    assert np.array_equal(np.sort(np.concatenate(colors)), np.arange(i_min, i_max))
+    period = i_max - i_min
+    for color in colors:
+        gaps = np.diff(np.concatenate([color, [color[0] + period]]))
+        assert len(color) == 1 or np.all(gaps > k)
+
+    # the result does not depend on the number of workers
+    traj_discrete = optm.sim.run_simulation(traj_spline.sample_along(3.0)).trajectory
+    results = []
+    for num_workers in (1, 2):
+        start = time()
+        traj_optm = optm.run_min_curvature_qp(traj_spline, traj_discrete, max_iter=1, num_workers=num_workers, seed=0)
+        print(f"{num_workers} workers: {time() - start:.3f} s")
+        results.append(np.column_stack([traj_optm._spl_x.c, traj_optm._spl_y.c]))
+    assert np.array_equal(results[0], results[1])
+    assert not np.array_equal(results[0], np.column_stack([traj_spline._spl_x.c, traj_spline._spl_y.c]))
+
+def test_global_min_curvature_qp():
+    traj_spline, race_track, optm = get_monza_optimizer()
+    traj_discrete = traj_spline.sample_along(3.0)
+    race_track.fill_trajectory_boundaries(traj_discrete)
+
+    # the free control points determine all of them
+    W, i_min, i_max = optm.periodic_control_point_map(traj_spline)
+    zs = np.column_stack([traj_spline._spl_x.c, traj_spline._spl_y.c])
+    assert np.array_equal(W @ zs[i_min:i_max], zs)
+    z0 = zs[i_min:i_max].reshape((-1,))
+
+    start = time()
+    H, g = optm.global_min_curvature_cost(traj_spline, traj_discrete)
+    A, lba, uba = optm.global_track_constraint(traj_spline, traj_discrete)
+    print(f"Global QP: {A.shape[1]} variables, {A.shape[0]} constraints, {H.nnz + A.nnz} non-zeros, built in {time() - start:.3f} s")
+    # banded, with k + 1 non-zeros per constraint row
+    k = traj_spline._spl_x.k
+    assert abs(H - H.T).max() == 0.0
+    assert H.nnz <= 2 * (2 * k + 1) * H.shape[0]
+    assert A.nnz <= (k + 1) * A.shape[0]
+    assert np.allclose((A @ z0).reshape((-1, 2)), traj_discrete[:, :2])
+    assert np.all(lba <= A @ z0 + 1e-6) and np.all(A @ z0 <= uba + 1e-6)
+
+    traj_optm = optm.run_global_min_curvature_qp(traj_spline, traj_discrete, max_iter=1)
+    z1 = np.column_stack([traj_optm._spl_x.c, traj_optm._spl_y.c])[i_min:i_max].reshape((-1,))
+    assert z1 @ H @ z1 < z0 @ H @ z0
+    assert np.all(lba <= A @ z1 + 1e-2) and np.all(A @ z1 <= uba + 1e-2)
+
+def test_min_curvature_costs():
+    traj_spline, _, optm = get_monza_optimizer()
+    traj_discrete = traj_spline.sample_along(3.0)
+    ts = traj_discrete.ts()
+    k = traj_spline._spl_x.k
+
+    start = time()
+    Hs, gs = optm.min_curvature_costs(traj_spline, traj_discrete)
+    print(f"Batched costs of {len(Hs)} control points: {time() - start:.4f} s")
+    i_min = k // 2
+    for j, (H, g) in enumerate(zip(Hs, gs)):
+        idx = i_min + j
+        z = np.array(traj_spline.get_control_point(idx))
+        # the same cost one control point at a time
+        H1, g1 = optm.min_curvature_cost(z, idx, traj_spline, traj_discrete)
+        assert np.array_equal(H, H1) and np.array_equal(g, g1)
+
+        # reference with the dense diagonal weights
+        t_mask = (ts >= traj_spline._spl_x.t[idx]) & (ts < traj_spline._spl_x.t[idx+k+1])
+        ti = ts[t_mask]
+        M = len(ti)
+        dTx = traj_spline._spl_x.derivative()(ti)
+        dTy = traj_spline._spl_y.derivative()(ti)
+        B = BSpline.basis_element(traj_spline._spl_x.t[idx:idx+k+2])(ti, 2)
+        Bx = np.column_stack([B, np.zeros(M)])
+        By = np.column_stack([np.zeros(M), B])
+        Fx = traj_spline._spl_x.derivative(2)(ti) - Bx @ z
+        Fy = traj_spline._spl_y.derivative(2)(ti) - By @ z
+        denom = (dTx ** 2 + dTy ** 2) ** 3
+        Pxx = np.diag(dTy ** 2 / denom)
+        Pxy = np.diag(-2.0 * dTx * dTy / denom)
+        Pyy = np.diag(dTx ** 2 / denom)
+        H_ref = 2.0 * (Bx.T @ Pxx @ Bx + By.T @ Pyy @ By)
+        g_ref = (Fx.T @ Pxx @ Bx + Fy.T @ Pxy @ By + Fy.T @ Pyy @ By) + (Bx.T @ Pxx @ Fx + By.T @ Pxy @ Fx + By.T @ Pyy @ Fy).T
+        assert np.allclose(H, H_ref, rtol=1e-10, atol=0.0)
+        assert np.allclose(g, g_ref, rtol=1e-10, atol=1e-10 * np.max(np.abs(g_ref)))
+
+def test_qp_solver_cache():
+    cache = QPSolverCache()
+    H = np.diag([2.0, 2.0])
+    A = np.eye(2)
+    for target in ([1.0, 2.0], [-1.0, 0.5], [3.0, -2.0]):
+        g = -2.0 * np.array(target)
+        r = cache.solve(H, g, A, [-2.0, -2.0], [2.0, 2.0])
+        assert np.allclose(np.array(r['x']).ravel(), np.clip(target, -2.0, 2.0))
+    # same sparsity, one solver
+    assert cache.num_built == 1 and cache.num_solved == 3
+    H3 = np.diag([2.0, 2.0, 2.0])
+    r = cache.solve(H3, [0.0, 0.0, 0.0], np.ones((1, 3)), [3.0], [6.0])
+    assert np.allclose(np.array(r['x']).ravel(), [1.0, 1.0, 1.0])
+    assert cache.num_built == 2 and len(cache) == 2
+    print(cache)
+
 if __name__ == "__main__":
     test_optimizer()
@@ -0,0 +1,68 @@
+import numpy as np
+import json
+import os
+import tempfile
+from time import time
+
+from spline_traj_optm.tests.test_optimizer import get_monza_optimizer
+from spline_traj_optm.optimization.qp_solver import QPSolverCache
+from spline_traj_optm.instrumentation.profiler import Profiler, profiler, is_enabled
+
+
+def test_profiler():
+    traj_spline, _, optm = get_monza_optimizer()
+    traj_discrete = traj_spline.sample_along(3.0)
+
+    # nothing is recorded without an active profiler
+    assert not is_enabled()
+    start = time()
+    for _ in range(100000):
+        with profiler().phase("qp_build"):
+            pass
+    print(f"Disabled phase: {(time() - start) * 10:.3f} us per call")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        jsonl_path = os.path.join(tmp_dir, "profile.jsonl")
+        with Profiler(jsonl_path) as prof:
+            assert profiler() is prof
+            optm.run_global_min_curvature_qp(traj_spline, traj_discrete, max_iter=1)
+            # an infeasible QP fails with the reason of the solver
+            qp_solvers = QPSolverCache()
+            try:
+                qp_solvers.solve(np.eye(2), np.zeros(2), np.array([[1.0, 0.0], [1.0, 0.0]]),
+                                 np.array([1.0, -1.0]), np.array([2.0, -0.5]))
+            except Exception:
+                pass
+        assert not is_enabled()
+        print(prof)
+
+        for phase in ("qp_build", "qp_solver_build", "qp_solve", "resample", "bound_fill", "simulation"):
+            assert prof.phases[phase].count > 0
+            assert prof.phases[phase].total_time >= prof.phases[phase].max_time > 0.0
+        assert prof.phases["qp_solve"].count == 2
+        assert prof.counters["qp_solve_failed"] == 1
+        assert len(prof.failures) == 1 and "infeasib" in prof.failures[0].reason
+        assert len(prof.progress_records) == 1
+        assert prof.progress_records[0].fields["iteration"] == 1
+
+        with open(jsonl_path) as f:
+            records = [json.loads(line) for line in f]
+        assert [r["type"] for r in records] == ["progress", "failure", "summary"]
+        assert records[0]["fields"]["lap_time"] == prof.progress_records[0].fields["lap_time"]
+        assert records[-1]["phases"]["qp_solve"]["count"] == 2
+
+    # the fields can have the names of the record keys
+    with Profiler() as prof:
+        prof.progress(type="lap", time=81.5)
+    assert prof.to_dict()["progress"][0]["fields"] == {"type": "lap", "time": 81.5}
+
+
+def test_joint_qp_progress():
+    traj_spline, _, optm = get_monza_optimizer()
+    traj_discrete = traj_spline.sample_along(3.0)
+
+    # one progress record per outer pass, numbered by the pass
+    with Profiler() as prof:
+        optm.run_joint_min_curvature_qp(traj_spline, traj_discrete, max_iter=2)
+    assert prof.phases["qp_solve"].count > prof.counters.get("qp_solve_failed", 0)
+    assert [r.fields["iteration"] for r in prof.progress_records] == [1, 2]
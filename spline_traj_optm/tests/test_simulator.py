@@ -5,7 +5,9 @@ from spline_traj_optm.tests.test_trajectory import get_bspline
 from spline_traj_optm.models.trajectory import Trajectory, BSplineTrajectory
 from spline_traj_optm.models.vehicle import VehicleParams, Vehicle
 from spline_traj_optm.simulator.simulator import Simulator
+from spline_traj_optm.simulator.kernel import JIT_AVAILABLE, eval_ppoly
 import spline_traj_optm.examples.race_track.monza
+import spline_traj_optm.examples.race_track.uh_maui
 
 
 def test_simulator():
@@ -25,4 +27,63 @@ def test_simulator():
     return result
 
 
-test_simulator()
+def test_sweep_simulator():
+    acc_speed_lookup = np.array([[0.0, 10.0], [50.0, 7.0], [100.0, 0.5]])
+    dcc_speed_lookup = np.array([[0.0, -13.0], [50.0, -15.0], [100.0, -20.0]])
+    vp = VehicleParams(acc_speed_lookup, dcc_speed_lookup,
+                       10.0, -20.0, 15.0, -15.0, 100.0, 30.0)
+    v = Vehicle(vp)
+
+    # The front engine is not an exact reference: it limits the lateral grip by the lon acc of the
+    # previous point, and breaks the lon acc limits where its fronts meet. The sweep laps are 7.9 %
+    # (Monza) and 14.7 % (UH Maui) faster, with speeds 2.8 and 2.1 m/s rms apart, which bound the
+    # lap time gap and the speed difference of each track.
+    tracks = [
+        (files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), 30.0, 3.0, 0.09, 3.0),
+        (files(spline_traj_optm.examples.race_track.uh_maui).joinpath("uh_maui_center.csv"), 1.0, 0.1, 0.16, 2.5),
+    ]
+    for f, s, interval, max_lap_time_gap, max_speed_rms in tracks:
+        traj_discrete = get_bspline(f, s=s).sample_along(interval)
+        front = Simulator(v).run_simulation(traj_discrete)
+        sweep = Simulator(v, mode="sweep").run_simulation(traj_discrete)
+        speed = sweep.trajectory[:, Trajectory.SPEED]
+        speed_diff = speed - front.trajectory[:, Trajectory.SPEED]
+        print(f"{f.name}: front {front.run_time:.3f} s, sweep {sweep.run_time:.4f} s, "
+              f"lap time {front.total_time:.2f} s vs {sweep.total_time:.2f} s, "
+              f"speed difference rms {np.sqrt(np.mean(speed_diff ** 2)):.2f} m/s")
+
+        # the sweep profile respects the curvature and the lon acc limits
+        radius = traj_discrete[:, Trajectory.CURVATURE]
+        assert np.all(speed <= np.minimum(np.sqrt(vp.max_left_acc_mpss * radius), vp.max_speed_mps) + 1e-6)
+        lon_acc = sweep.trajectory[:, Trajectory.LON_ACC]
+        assert np.all(lon_acc <= v.envelope.lon_limits(speed)[0] + 1e-6)
+        assert np.all(lon_acc >= v.envelope.lon_limits(np.roll(speed, -1))[1] - 1e-6)
+        assert front.total_time * (1.0 - max_lap_time_gap) < sweep.total_time <= front.total_time
+        assert np.sqrt(np.mean(speed_diff ** 2)) < max_speed_rms
+
+
+def test_propagation_kernel():
+    acc_speed_lookup = np.array([[0.0, 10.0], [50.0, 7.0], [100.0, 0.5]])
+    dcc_speed_lookup = np.array([[0.0, -13.0], [50.0, -15.0], [100.0, -20.0]])
+    vp = VehicleParams(acc_speed_lookup, dcc_speed_lookup,
+                       10.0, -20.0, 15.0, -15.0, 100.0, 30.0)
+    v = Vehicle(vp)
+
+    # the tabulated lookups match the CubicSpline, extrapolation included
+    speeds = np.linspace(-10.0, 110.0, 241)
+    acc = np.array([eval_ppoly(v.acc_intp.x, v.acc_intp.c, speed) for speed in speeds])
+    assert np.array_equal(acc, v.lookup_acc_from_speed(speeds))
+
+    traj_discrete = get_bspline(files(spline_traj_optm.examples.race_track.uh_maui).joinpath(
+        "uh_maui_center.csv"), s=1.0).sample_along(0.1)
+    result = Simulator(v, jit=False).run_simulation(traj_discrete)
+    print(f"Python kernel: {result.run_time:.3f} s")
+    if JIT_AVAILABLE:
+        Simulator(v).run_simulation(traj_discrete)
+        result_jit = Simulator(v).run_simulation(traj_discrete)
+        print(f"Compiled kernel: {result_jit.run_time:.3f} s")
+        assert np.allclose(result.trajectory.points, result_jit.trajectory.points, rtol=0.0, atol=1e-9)
+
+
+if __name__ == "__main__":
+    test_simulator()
@@ -0,0 +1,65 @@
+from importlib_resources import files, as_file
+import numpy as np
+import os
+import tempfile
+from time import time
+
+from spline_traj_optm.tests.test_trajectory import get_trajectory_array
+from spline_traj_optm.models.trajectory import BSplineTrajectory
+from spline_traj_optm.models.track_ingestion import read_track_points
+import spline_traj_optm.examples.race_track.monza
+
+
+def test_track_ingestion():
+    # without thinning, every point of a clean log is read, whatever the chunk size
+    resource = files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_LEFT_BOUNDARY_enu.csv")
+    with as_file(resource) as f:
+        points, stats = read_track_points(f, min_dist=0.0, chunk_size=37)
+        assert stats.num_chunks > 10
+        assert np.array_equal(points, get_trajectory_array(resource))
+        thinned, _ = read_track_points(f, min_dist=20.0, chunk_size=37)
+        assert np.array_equal(thinned, read_track_points(f, min_dist=20.0)[0])
+        assert np.min(np.hypot(*np.diff(thinned[:, :2], axis=0).T)) >= 20.0
+
+    # a dense noisy survey of a closed oval, with repeated points and single point glitches
+    rng = np.random.default_rng(0)
+    n = 500000
+    theta = np.linspace(0.0, 2.0 * np.pi, n, endpoint=False)
+    survey = np.column_stack([800.0 * np.cos(theta), 400.0 * np.sin(theta), np.sin(3.0 * theta)])
+    survey += rng.normal(scale=0.01, size=survey.shape)
+    survey[1::7] = survey[0::7][:len(survey[1::7])]
+    glitches = rng.choice(np.arange(1, n - 1), 20, replace=False)
+    survey[glitches, :2] += 50.0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "survey.csv")
+        np.savetxt(path, survey, delimiter=",", header="x,y,z", comments="")
+        start = time()
+        points, stats = read_track_points(path, min_dist=0.5, max_step=5.0, chunk_size=100000)
+        print(f"Ingestion of {n} points took {time() - start:.3f} sec: {stats}")
+        assert stats.num_read == n and stats.num_outliers == len(glitches)
+        assert stats.num_duplicates >= n // 7 - len(glitches)
+        assert points.shape[1] == 3 and stats.num_kept == len(points)
+        step = np.hypot(*np.diff(points[:, :2], axis=0).T)
+        assert np.min(step) >= 0.5 and np.max(step) < 1.0
+        # the loop closes without a repeated point
+        assert np.hypot(*(points[-1, :2] - points[0, :2])) >= 0.5
+        open_points, open_stats = read_track_points(path, min_dist=0.5, max_step=5.0, chunk_size=100000, closed=False)
+        assert stats.num_loop_trimmed == len(open_points) - len(points) > 0
+        assert open_stats.num_loop_trimmed == 0 and open_stats.num_duplicates == stats.num_duplicates
+        assert np.array_equal(points, read_track_points(path, min_dist=0.5, max_step=5.0, chunk_size=999)[0])
+
+        bounded, _ = read_track_points(path, min_dist=0.5, max_step=5.0, max_points=1000)
+        assert len(bounded) == 1000
+        BSplineTrajectory(bounded[:, :2], 10.0, 5)
+
+        # z may be missing from the header, x and y may not
+        xy_path = os.path.join(tmp_dir, "xy.csv")
+        np.savetxt(xy_path, bounded[:, :2], delimiter=",", header="x,y", comments="")
+        assert np.array_equal(read_track_points(xy_path, min_dist=0.0)[0], bounded[:, :2])
+        for header in ("X,Y,Z", "lat,lon"):
+            np.savetxt(xy_path, bounded[:, :len(header.split(","))], delimiter=",", header=header, comments="")
+            try:
+                read_track_points(xy_path)
+                assert False, "a file without x and y columns must not be read"
+            except ValueError as e:
+                assert "['x', 'y']" in str(e) and header.split(",")[0] in str(e)
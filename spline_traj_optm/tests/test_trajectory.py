@@ -2,19 +2,27 @@ from importlib_resources import files, as_file
 from matplotlib import pyplot as plt
 import numpy as np
 from time import time
+from scipy import interpolate
+from scipy.integrate import quad
+import os
+import pickle
+import tempfile
 
-from spline_traj_optm.models.trajectory import Trajectory, BSplineTrajectory
+from spline_traj_optm.models.trajectory import Trajectory, BSplineTrajectory, BSplineBatch
 import spline_traj_optm.examples.race_track.monza
 
+
 def get_trajectory_array(traj_resource):
     traj_file = traj_resource
     with as_file(traj_file) as f:
         return np.loadtxt(f, dtype=np.float64, delimiter=',',skiprows=1)
 
+
 def get_bspline(traj_resource, s=0.8):
     traj_arr = get_trajectory_array(traj_resource)
     return BSplineTrajectory(traj_arr[:, :2], s, 5)
 
+
 def test_bsplines():
     start = time()
     left_traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_LEFT_BOUNDARY_enu.csv"))
@@ -56,6 +64,268 @@ def test_bsplines():
     plt.title("Monza Circuit (Turn Radius)")
     plt.ylabel("m")
     plt.show()
-    
+
+
+def test_arc_length():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+
+    def speed(t):
+        return np.sqrt(interpolate.splev(t, traj_spline._spl_x, der=1) ** 2 + interpolate.splev(t, traj_spline._spl_y, der=1) ** 2)
+
+    start = time()
+    traj_discrete = traj_spline.sample_along(3.0)
+    duration = time() - start
+
+    # reference from adaptive quadrature between consecutive samples
+    ts = traj_discrete.ts()
+    start = time()
+    sections = [quad(speed, t0, t1, limit=200)[0] for t0, t1 in zip(ts[:-1], ts[1:])]
+    duration_quad = time() - start
+    print(f"Arc length of {len(ts)} samples took {duration} sec (quad: {duration_quad} sec)")
+    dist = np.concatenate([[0.0], np.cumsum(sections)])
+    length = quad(speed, 0.0, 1.0, limit=200)[0]
+
+    np.testing.assert_allclose(traj_discrete[:, Trajectory.DIST_TO_SF_BWD], dist, rtol=0.0, atol=1e-6)
+    np.testing.assert_allclose(traj_discrete[:, Trajectory.DIST_TO_SF_FWD], length - dist, rtol=0.0, atol=1e-6)
+    assert abs(traj_spline.get_length() - length) < 1e-6
+    assert abs(traj_spline.eval_sectional_length(ts[10:12]) - sections[10]) < 1e-6
+
+    ss = np.linspace(0.0, length, 1000)
+    np.testing.assert_allclose(traj_spline.eval_arc_length(traj_spline.eval_arc_length_param(ss)), ss, rtol=0.0, atol=1e-6)
+
+    # the table follows control point updates
+    traj_spline.set_control_point(10, np.array(traj_spline.get_control_point(10)) + 5.0)
+    assert abs(traj_spline.get_length() - quad(speed, 0.0, 1.0, limit=200)[0]) < 1e-6
+
+
+def test_resample_dirty():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+    traj_discrete = traj_spline.sample_along(1.0)
+    columns = [Trajectory.X, Trajectory.Y, Trajectory.YAW, Trajectory.CURVATURE,
+               Trajectory.DIST_TO_SF_BWD, Trajectory.DIST_TO_SF_FWD]
+
+    # one control point in the middle, then a few around the periodic wrap at once
+    for idxs in ([10], [1, 40, -2]):
+        for idx in idxs:
+            traj_spline.set_control_point(idx, np.array(traj_spline.get_control_point(idx)) + np.array([3.0, -2.0]))
+        rows = traj_spline.resample_dirty(traj_discrete)
+        assert 0 < len(rows) < len(traj_discrete)
+        traj_full = traj_spline.sample_along(ts=traj_discrete.ts())
+        np.testing.assert_allclose(traj_discrete[:, columns], traj_full[:, columns], rtol=0.0, atol=1e-8)
+
+    # setting a control point to its current value does not dirty it
+    traj_spline.set_control_point(20, traj_spline.get_control_point(20))
+    assert len(traj_spline.resample_dirty(traj_discrete)) == 0
+
+
+def test_basis_cache():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+    ts = traj_spline.sample_along(3.0).ts()
+    k = traj_spline._spl_x.k
+
+    # the collocation matrices evaluate the spline and its derivatives
+    for nu in range(3):
+        B = traj_spline.basis_matrix(ts, nu)
+        assert B.shape == (len(ts), len(traj_spline._spl_x.c))
+        assert np.max(np.diff(B.indptr)) <= k + 1
+        ref = interpolate.splev(ts, traj_spline._spl_x, der=nu)
+        assert np.allclose(B @ traj_spline._spl_x.c, ref, rtol=1e-10, atol=1e-10 * np.max(np.abs(ref)))
+
+    # the columns match the basis elements on the supports of their control points
+    for idx in range(len(traj_spline._spl_x.c)):
+        lo, hi, values = traj_spline.basis_column(ts, idx, 2)
+        t_mask = (ts >= traj_spline._spl_x.t[idx]) & (ts < traj_spline._spl_x.t[idx+k+1])
+        assert np.array_equal(np.flatnonzero(t_mask), np.arange(lo, hi))
+        ref = interpolate.BSpline.basis_element(traj_spline._spl_x.t[idx:idx+k+2])(ts[lo:hi], 2)
+        assert np.allclose(values, ref, rtol=1e-10, atol=1e-10 * np.max(np.abs(ref)))
+
+    # moving control points keeps the cache, a new grid rebuilds it
+    cache = traj_spline.basis_cache
+    assert cache.num_built == 3 and len(cache) == 3
+    traj_spline.set_control_point(10, np.array(traj_spline.get_control_point(10)) + 1.0)
+    B = traj_spline.basis_matrix(ts, 2)
+    assert cache.num_built == 3
+    traj_spline.basis_matrix(ts[::2], 2)
+    assert cache.num_built == 4 and len(cache) == 1
+    print(cache)
+
+    # the copies are made without the matrices
+    traj_copy = traj_spline.copy()
+    assert len(traj_copy.basis_cache) == 0 and len(traj_spline.basis_cache) == 1
+
+
+def test_binary_format():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+    traj_discrete = traj_spline.sample_along(3.0)
+    ts = traj_discrete.ts()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the points round trip exactly, and memory-mapped columns are views of the file
+        traj_path = os.path.join(tmp_dir, "traj.bin")
+        Trajectory.save_binary(traj_path, traj_discrete)
+        assert np.array_equal(Trajectory.load_binary(traj_path).points, traj_discrete.points)
+        traj_mmap = Trajectory.load_binary(traj_path, mmap=True)
+        assert len(traj_mmap) == len(traj_discrete)
+        assert np.array_equal(traj_mmap[:, Trajectory.X], traj_discrete[:, Trajectory.X])
+        assert traj_mmap[:, Trajectory.SPEED].flags.c_contiguous
+        # a writable map is written through to the file
+        traj_mmap = Trajectory.load_binary(traj_path, mmap="r+")
+        traj_mmap[0, Trajectory.SPEED] = 42.0
+        del traj_mmap
+        assert Trajectory.load_binary(traj_path)[0, Trajectory.SPEED] == 42.0
+
+        # the spline is stored as its knots and control points
+        spline_path = os.path.join(tmp_dir, "spline.bin")
+        BSplineTrajectory.save_binary(spline_path, traj_spline)
+        traj_loaded = BSplineTrajectory.load_binary(spline_path)
+        assert np.array_equal(traj_loaded.sample_along(ts=ts).points, traj_spline.sample_along(ts=ts).points)
+        try:
+            Trajectory.load_binary(spline_path)
+            assert False, "a spline container must not load as a trajectory"
+        except ValueError:
+            pass
+
+        # CSV against binary on large trajectories
+        traj_large = Trajectory(100000)
+        traj_large[:, :Trajectory.IDX] = np.random.default_rng(0).normal(size=(len(traj_large), Trajectory.IDX))
+        csv_path = os.path.join(tmp_dir, "traj.csv")
+        for name, save, load in (("CSV", Trajectory.save, Trajectory.load),
+                                 ("binary", Trajectory.save_binary, Trajectory.load_binary)):
+            path = csv_path if name == "CSV" else traj_path
+            start = time()
+            save(path, traj_large)
+            save_time = time() - start
+            start = time()
+            traj_out = load(path)
+            print(f"{name} with {len(traj_large)} rows, {os.path.getsize(path) / 1e6:.1f} MB: "
+                  f"save {save_time:.3f} sec, load {time() - start:.3f} sec")
+            assert np.allclose(traj_out.points, traj_large.points, rtol=1e-15, atol=0.0)
+        start = time()
+        x = np.array(Trajectory.load_binary(traj_path, mmap=True)[:, Trajectory.X])
+        print(f"binary memory-mapped X column: {time() - start:.4f} sec")
+        assert np.array_equal(x, traj_large[:, Trajectory.X])
+
+
+def test_columnar_storage():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+    traj_discrete = traj_spline.sample_along(3.0)
+    dense = traj_discrete.to_array()
+
+    # the indexing of the former N * 19 array
+    assert np.array_equal(traj_discrete[:, Trajectory.X], dense[:, Trajectory.X])
+    assert np.array_equal(traj_discrete[5], dense[5])
+    assert np.array_equal(traj_discrete[10:20, :2], dense[10:20, :2])
+    assert np.array_equal(traj_discrete[[3, 1], [Trajectory.YAW, Trajectory.IDX]], dense[[3, 1], [Trajectory.YAW, Trajectory.IDX]])
+    assert traj_discrete[7, Trajectory.IDX] == 7.0 and traj_discrete[7, Trajectory.ITERATION_FLAG] == -1.0
+    assert traj_discrete[-1, -1] == -1.0 and traj_discrete[-1, -2] == len(traj_discrete) - 1
+    assert traj_discrete[-3, Trajectory.YAW] == dense[-3, Trajectory.YAW]
+    try:
+        traj_discrete[len(traj_discrete), Trajectory.SPEED]
+        assert False, "rows out of range must raise"
+    except IndexError:
+        pass
+    traj_discrete[3:6, Trajectory.LEFT_BOUND_X:Trajectory.LEFT_BOUND_Y+1] = [1.0, 2.0]
+    assert np.all(traj_discrete[3:6, Trajectory.LEFT_BOUND_Y] == 2.0) and traj_discrete[6, Trajectory.LEFT_BOUND_X] == 0.0
+    try:
+        traj_discrete[:, Trajectory.X][0] = 1.0
+        assert False, "columns must be written through the trajectory"
+    except ValueError:
+        pass
+
+    # columns are allocated on the first write, and copies share them until written
+    traj = Trajectory(len(traj_discrete))
+    assert traj.num_allocated() == (0, 0)
+    traj[:, Trajectory.SPEED] = 10.0
+    assert traj.num_allocated() == (1, 1)
+    traj_copy = traj_discrete.copy()
+    num_allocated, _ = traj_discrete.num_allocated()
+    assert traj_copy.num_allocated() == (num_allocated, 0)
+    traj_copy[0, Trajectory.X] = 1e6
+    assert traj_discrete[0, Trajectory.X] == dense[0, Trajectory.X]
+    assert traj_copy.num_allocated() == (num_allocated, 1)
+
+    # the columns of a column major array are used in place, but never written
+    points = np.asfortranarray(np.zeros((5, 19)))
+    traj = Trajectory(0)
+    traj.points = points
+    assert traj.num_allocated() == (19, 0)
+    traj[:, Trajectory.SPEED] = 7.0
+    assert np.all(points == 0.0) and np.all(traj[:, Trajectory.SPEED] == 7.0)
+
+    traj_large = Trajectory(1000000)
+    traj_large.points = np.random.default_rng(0).normal(size=(len(traj_large), 19))
+    start = time()
+    for _ in range(10):
+        traj_copy = traj_large.copy()
+        traj_copy[:, Trajectory.SPEED] = 0.0
+    print(f"Copy of {len(traj_large)} waypoints and write of one column: {(time() - start) * 100:.3f} ms")
+    points = traj_large.to_array()
+    start = time()
+    for _ in range(10):
+        points_copy = points.copy()
+        points_copy[:, Trajectory.SPEED] = 0.0
+    print(f"Dense copy of {len(traj_large)} waypoints and write of one column: {(time() - start) * 100:.3f} ms")
+
+
+def test_bspline_batch():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+    ts = traj_spline.sample_along(3.0).ts()
+    columns = [Trajectory.X, Trajectory.Y, Trajectory.YAW, Trajectory.CURVATURE, Trajectory.DIST_TO_SF_BWD]
+
+    # candidates with a few control points moved, like a line search or a multi-start
+    rng = np.random.default_rng(0)
+    num_candidate = 100
+    cx = np.repeat(traj_spline._spl_x.c[np.newaxis, :], num_candidate, axis=0)
+    cy = np.repeat(traj_spline._spl_y.c[np.newaxis, :], num_candidate, axis=0)
+    for i in range(num_candidate):
+        idx = rng.choice(np.arange(len(traj_spline._spl_x.c) - 5), 3, replace=False)
+        cx[i, idx] += rng.normal(scale=2.0, size=3)
+        cy[i, idx] += rng.normal(scale=2.0, size=3)
+    batch = BSplineBatch(traj_spline, cx, cy)
+    assert len(batch) == num_candidate
+
+    start = time()
+    geometry = batch.eval_geometry(ts)
+    lengths = batch.get_length()
+    duration = time() - start
+    # new candidates on the same grid reuse the basis matrices
+    batch.set_control_points(cx[::-1], cy[::-1])
+    start = time()
+    batch.eval_geometry(ts)
+    duration_cached = time() - start
+    batch.set_control_points(cx, cy)
+    start = time()
+    candidates = [batch.candidate(i) for i in range(num_candidate)]
+    assert all(candidate._dirty_ctrl_pts for candidate in candidates)
+    trajs = [candidate.sample_along(ts=ts) for candidate in candidates]
+    duration_loop = time() - start
+    print(f"Geometry of {num_candidate} candidates took {duration:.3f} sec, {duration_cached:.3f} sec with cached "
+          f"basis ({num_candidate / duration_cached:.0f} per sec), one by one: {duration_loop:.3f} sec")
+
+    for i in (0, 17, num_candidate - 1):
+        for values, col in zip(geometry, columns):
+            np.testing.assert_allclose(values[i], trajs[i][:, col], rtol=1e-8, atol=1e-8)
+        assert abs(lengths[i] - candidates[i].get_length()) < 1e-6
+    x, y = batch.eval(ts[:10])
+    assert x.shape == (num_candidate, 10)
+    np.testing.assert_allclose(batch.eval_yaw(ts)[5], geometry[2][5])
+
+
+
+def test_old_pickle():
+    traj_spline = get_bspline(files(spline_traj_optm.examples.race_track.monza).joinpath("MONZA_UNOPTIMIZED_LINE_enu.csv"), s=30.0)
+    traj_discrete = traj_spline.sample_along(3.0)
+    # a spline pickled before z, the arc length table, the dirty control points and the basis cache,
+    # with only the x and y splines
+    traj_old = BSplineTrajectory.__new__(BSplineTrajectory)
+    traj_old.__dict__.update(_spl_x=traj_spline._spl_x, _spl_y=traj_spline._spl_y)
+    traj_loaded = pickle.loads(pickle.dumps(traj_old))
+    assert traj_loaded.get_length() == traj_spline.get_length()
+    assert np.all(traj_loaded.eval_z(traj_discrete.ts()) == 0.0)
+    traj_loaded.set_control_point(10, np.array(traj_loaded.get_control_point(10)) + 5.0)
+    assert len(traj_loaded.resample_dirty(traj_discrete)) > 0
+    assert traj_loaded.basis_matrix(traj_discrete.ts()).shape == (len(traj_discrete), len(traj_loaded._spl_x.c))
+
+
 if __name__ == "__main__":
     test_bsplines()
@@ -1,6 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from spline_traj_optm.models.vehicle import VehicleParams, Vehicle
+from spline_traj_optm.models.vehicle import VehicleParams, Vehicle, VehicleEnvelope
 
 
 def test_vehicle():
@@ -48,4 +48,39 @@ def test_vehicle():
     plt.show()
 
 
-test_vehicle()
+def test_envelope():
+    acc_speed_lookup = np.array([[0.0, 10.0], [50.0, 7.0], [100.0, 0.5]])
+    dcc_speed_lookup = np.array([[0.0, -13.0], [50.0, -15.0], [100.0, -20.0]])
+    vp = VehicleParams(acc_speed_lookup, dcc_speed_lookup,
+                       10.0, -20.0, 15.0, -15.0, 100.0, 30.0)
+    v = Vehicle(vp)
+
+    # batched queries agree with the scalar lookups
+    speeds = np.linspace(0.0, 100.0, 1001)
+    acc, dcc = v.envelope.lon_limits(speeds)
+    assert np.allclose(acc, v.lookup_acc_from_speed(speeds), atol=1e-4)
+    assert np.allclose(dcc, v.lookup_dcc_from_speed(speeds), atol=1e-4)
+    lons = np.linspace(-20.0, 10.0, 301)
+    left, right = v.envelope.lat_limits(lons)
+    expected = np.array([v.lookup_acc_circle(lon=lon) for lon in lons])
+    assert np.allclose(left, expected[:, 0], atol=1e-3)
+    assert np.allclose(right, expected[:, 1], atol=1e-3)
+    lats = np.linspace(-15.0, 15.0, 301)
+    acc, dcc = v.envelope.lon_limits_given_lat(lats)
+    expected = np.array([v.lookup_acc_circle(lat=lat) for lat in lats])
+    assert np.allclose(acc, expected[:, 0], atol=1e-3)
+    assert np.allclose(dcc, expected[:, 1], atol=1e-3)
+    assert np.all(v.envelope.contains(speeds, np.zeros_like(speeds), np.full_like(speeds, 15.0)))
+    assert not np.any(v.envelope.contains(speeds, np.full_like(speeds, 5.0), np.full_like(speeds, 15.0)))
+    assert v.envelope.gg_v().shape == (VehicleEnvelope.NUM_SPEED, VehicleEnvelope.NUM_ACC, 2)
+
+    # the diamond is inside the ellipse, and a round polar is a circle
+    diamond = Vehicle(vp, model='diamond').envelope
+    assert np.allclose(diamond.lat_limits(-10.0), (7.5, -7.5))
+    assert np.all(diamond.lat_limits(lons)[0] <= left + 1e-9)
+    polar = Vehicle(vp, model='polar', polar=np.array([[-np.pi, 12.0], [0.0, 12.0]])).envelope
+    assert np.allclose(np.hypot(lons[lons > -12.0], polar.lat_limits(lons[lons > -12.0])[0]), 12.0, atol=1e-3)
+
+
+if __name__ == "__main__":
+    test_vehicle()